@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+# Synthetic spools for the benchmarks: tag dumps, key files and sniffed traces
+# Created for https://github.com/Bambu-Research-Group/RFID-Tag-Guide
+#
+# Every spool gets a random UID. Bambu spools use the keys derived from their UID, the others
+# ("foreign" spools) use random keys, so their keys have to be brute forced. The dumps are made
+# from examples/exampleDump.bin with a new block 0, tray UID and sector trailers. The traces
+# replay what an AMS does when it reads a spool, as in examples/exampleTrace.trace: select the
+# tag, authenticate sector 0 in the clear, then authenticate (nested) and read every other sector.
+# All of it is encrypted with Crypto1 and the real parity bits, so the traces decode (and brute
+# force) like captured ones.
+
+import sys
+import json
+import random
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from lib.bambu import ACCESS_BITS, BLOCK_SIZE, BLOCKS_PER_SECTOR, SECTORS
+from lib.crypto1 import Crypto1, bebit, prng_successor
+from lib.trace import HEADER, CMD_AUTH_A, CMD_WUPA, SELECT_CMDS, crc_a, oddparity8, parity_length
+from deriveKeys import kdf, keyfile_bytes
+
+TEMPLATE = ROOT / "examples" / "exampleDump.bin"
+TRAY_UID_BLOCK = 9
+NONCE_SEED = 0x01200145     #A valid tag nonce, every nonce we use is one of its PRNG successors
+CMD_READ = 0x30
+ATQA = bytes.fromhex("0400")
+SAK = bytes.fromhex("08b6dd")
+
+# One synthetic spool
+# - keys: [keysA, keysB], 16 keys of 6 bytes each
+# - bambu: True if the keys are derived from the UID
+class Spool:
+    def __init__(self, uid, keys, dump, bambu):
+        self.uid = uid
+        self.keys = keys
+        self.dump = dump
+        self.bambu = bambu
+
+    @property
+    def name(self):
+        return self.uid.hex().upper()
+
+def _random_bytes(rng, length):
+    return bytes(rng.getrandbits(8) for _ in range(length))
+
+def _random_keys(rng):
+    return [[_random_bytes(rng, 6) for _ in range(SECTORS)] for _ in range(2)]
+
+#A dump in the layout of the example dump, for another UID and keys
+def make_dump(template, uid, keys, rng):
+    dump = bytearray(template)
+    dump[0:5] = uid + bytes([uid[0] ^ uid[1] ^ uid[2] ^ uid[3]])
+    dump[TRAY_UID_BLOCK * BLOCK_SIZE:(TRAY_UID_BLOCK + 1) * BLOCK_SIZE] = _random_bytes(rng, BLOCK_SIZE)
+    for sector in range(SECTORS):
+        trailer = (sector * BLOCKS_PER_SECTOR + BLOCKS_PER_SECTOR - 1) * BLOCK_SIZE
+        dump[trailer:trailer + BLOCK_SIZE] = keys[0][sector] + ACCESS_BITS + keys[1][sector]
+    return bytes(dump)
+
+#`count` spools, of which about `foreign` (0 to 1) use random keys
+#The same seed always gives the same spools
+def make_spools(count, foreign=0.0, seed=1):
+    rng = random.Random(seed)
+    template = TEMPLATE.read_bytes()
+    spools = []
+    for index in range(count):
+        uid = _random_bytes(rng, 4)
+        bambu = rng.random() >= foreign
+        keys = kdf(uid) if bambu else _random_keys(rng)
+        spools.append(Spool(uid, keys, make_dump(template, uid, keys, rng), bambu))
+    return spools
+
+#Pack the parity bits of a frame (one per byte, first byte in the most significant bit)
+def _pack_parity(bits):
+    parity = bytearray(parity_length(len(bits)))
+    for i, bit in enumerate(bits):
+        parity[i // 8] |= bit << (7 - i % 8)
+    return bytes(parity)
+
+#Clock `state` over the 32 bits of `feed`, returns the keystream word and the keystream bit
+#that encrypts the parity of each of its 4 bytes
+def _keystream_word(state, feed=0):
+    ks = 0
+    parity = []
+    for i in range(32):
+        ks |= state.bit(bebit(feed, i)) << (i ^ 24)
+        if i % 8 == 7:
+            parity.append(state.peek())
+    return ks, parity
+
+#Encrypt a word with `state`, returns the encrypted bytes and their parity bits
+def _encrypt_word(state, value, feed=0):
+    ks, parity_ks = _keystream_word(state, feed)
+    plain = value.to_bytes(4, "big")
+    return (value ^ ks).to_bytes(4, "big"), [oddparity8(b) ^ p for b, p in zip(plain, parity_ks)]
+
+#Encrypt a frame byte by byte, as the session does for every command after an authentication
+def _encrypt_frame(state, data):
+    out = bytearray()
+    parity = []
+    for b in data:
+        out.append(b ^ state.byte(0))
+        parity.append(oddparity8(b) ^ state.peek())
+    return bytes(out), parity
+
+class _TraceWriter:
+    def __init__(self, rng, timestamp=100000000):
+        self.rng = rng
+        self.timestamp = timestamp
+        self.records = []
+
+    def frame(self, data, is_response, parity=None):
+        if parity is None:
+            parity = [oddparity8(b) for b in data]
+        duration = 1200 * len(data)
+        length = len(data) | (0x8000 if is_response else 0)
+        self.records.append(HEADER.pack(self.timestamp, duration, length) + bytes(data) + _pack_parity(parity))
+        self.timestamp += duration + self.rng.randrange(2000, 8000)
+
+    #Encrypt `data` with the session state, then add it
+    def encrypted(self, session, data, is_response):
+        data, parity = _encrypt_frame(session, data)
+        self.frame(data, is_response, parity)
+
+    def bytes(self):
+        return b"".join(self.records)
+
+#Authenticate `sector` with key A, returns the session state
+#`session` is the state of the current session for a nested authentication, None for the first one
+def _authenticate(writer, spool, sector, session):
+    rng = writer.rng
+    uid = int.from_bytes(spool.uid, "big")
+    block = sector * BLOCKS_PER_SECTOR + BLOCKS_PER_SECTOR - 1
+    cmd = bytes([CMD_AUTH_A, block])
+    cmd += crc_a(cmd)
+    if session is None:
+        writer.frame(cmd, False)
+    else:
+        writer.encrypted(session, cmd, False)
+
+    nt = prng_successor(NONCE_SEED, rng.randrange(1, 65535))
+    state = Crypto1(spool.keys[0][sector])
+    if session is None:
+        state.word(uid ^ nt)
+        writer.frame(nt.to_bytes(4, "big"), True)
+    else:
+        nt_enc, parity = _encrypt_word(state, nt, uid ^ nt)
+        writer.frame(nt_enc, True, parity)
+
+    nr = rng.getrandbits(32)
+    nr_enc, nr_parity = _encrypt_word(state, nr, nr)
+    ar_enc, ar_parity = _encrypt_word(state, prng_successor(nt, 64))
+    writer.frame(nr_enc + ar_enc, False, nr_parity + ar_parity)
+    at_enc, at_parity = _encrypt_word(state, prng_successor(nt, 96))
+    writer.frame(at_enc, True, at_parity)
+    return state
+
+#The trace of an AMS reading a spool
+def make_trace(spool, seed=1):
+    writer = _TraceWriter(random.Random(seed))
+    uid = spool.uid
+    bcc = uid[0] ^ uid[1] ^ uid[2] ^ uid[3]
+
+    writer.frame(bytes([CMD_WUPA]), False)
+    writer.frame(ATQA, True)
+    writer.frame(bytes([SELECT_CMDS[0], 0x20]), False)
+    writer.frame(uid + bytes([bcc]), True)
+    select = bytes([SELECT_CMDS[0], 0x70]) + uid + bytes([bcc])
+    writer.frame(select + crc_a(select), False)
+    writer.frame(SAK, True)
+
+    session = None
+    for sector in range(SECTORS):
+        session = _authenticate(writer, spool, sector, session)
+        for block in range(sector * BLOCKS_PER_SECTOR, sector * BLOCKS_PER_SECTOR + BLOCKS_PER_SECTOR - 1):
+            cmd = bytes([CMD_READ, block])
+            writer.encrypted(session, cmd + crc_a(cmd), False)
+            data = spool.dump[block * BLOCK_SIZE:(block + 1) * BLOCK_SIZE]
+            writer.encrypted(session, data + crc_a(data), True)
+    return writer.bytes()
+
+#Write the corpus of `spools` to `directory`, returns the paths of what was written:
+# - traces: one trace per spool
+# - dumps, keyfiles: one dump and key file per spool
+# - manifest: writeTag.py batch manifest of every dump
+# - keys: JSON file with the keys of every spool, for the stand-in Proxmark3 tools
+def write_corpus(directory, spools, seed=1):
+    directory = Path(directory)
+    for sub in ("traces", "dumps"):
+        (directory / sub).mkdir(parents=True, exist_ok=True)
+
+    paths = {"traces": [], "dumps": [], "keyfiles": []}
+    for index, spool in enumerate(spools):
+        trace = directory / "traces" / f"{spool.name}.trace"
+        trace.write_bytes(make_trace(spool, seed + index))
+        dump = directory / "dumps" / f"hf-mf-{spool.name}-dump.bin"
+        dump.write_bytes(spool.dump)
+        keyfile = directory / "dumps" / f"hf-mf-{spool.name}-key.bin"
+        keyfile.write_bytes(keyfile_bytes(spool.keys))
+        paths["traces"].append(trace)
+        paths["dumps"].append(dump)
+        paths["keyfiles"].append(keyfile)
+
+    paths["manifest"] = directory / "manifest.csv"
+    with open(paths["manifest"], "w") as fp:
+        fp.write("dump,keyfile\n")
+        for dump, keyfile in zip(paths["dumps"], paths["keyfiles"]):
+            fp.write(f"dumps/{dump.name},dumps/{keyfile.name}\n")
+
+    paths["keys"] = directory / "keys.json"
+    with open(paths["keys"], "w") as fp:
+        json.dump({spool.name: [[key.hex().upper() for key in keys] for keys in spool.keys] for spool in spools}, fp)
+    return paths
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+
+# Stand-ins for the Proxmark3 client and mf_nonce_brute, so the tools can be benchmarked without hardware
+# Created for https://github.com/Bambu-Research-Group/RFID-Tag-Guide
+#
+# benchmarks/proxmark3 is laid out like a Proxmark3 installation (bin/pm3 and
+# share/proxmark3/tools/mf_nonce_brute) and runs the code below, so it can be used as pm3Location.
+# - pm3 answers the commands the tools send: `trace load`/`trace list` (listing the trace, with the
+#   keys of its plaintext authentications), and the tag commands of writeTag.py, on an emulated
+#   magic tag. Run with -c it runs the given commands, without it reads commands from stdin, like a
+#   session. A new blank tag is placed on the reader after a written tag has been read back.
+#   `hf 14a sniff` "sniffs" the next trace of the directory named by FAKE_PM3_TRACES (in name
+#   order, one per sniff), which `trace save` then saves.
+# - mf_nonce_brute finds the key of a nested authentication among the keys of the corpus.
+# Both look up keys in the JSON file named by FAKE_PM3_KEYS (see corpus.write_corpus), and wait
+# FAKE_PM3_LATENCY (pm3, per tag command) or FAKE_BRUTE_LATENCY (mf_nonce_brute) seconds to
+# behave more like the real thing. FAKE_PM3_TAG_TYPE picks the magic tag: fuid (default) or ufuid.
+
+import os
+import sys
+import json
+import time
+import shlex
+import itertools
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from lib.bambu import json_to_bin, BLOCK_SIZE, BLOCKS_PER_SECTOR, DUMP_SIZE
+from lib.crypto1 import check_auth_key
+from lib.trace import read_frames, read_auths
+
+KEYS_ENV = "FAKE_PM3_KEYS"
+LATENCY_ENV = "FAKE_PM3_LATENCY"
+BRUTE_LATENCY_ENV = "FAKE_BRUTE_LATENCY"
+TAG_TYPE_ENV = "FAKE_PM3_TAG_TYPE"
+TRACES_ENV = "FAKE_PM3_TRACES"
+
+PROMPT = "[usb|script] pm3 --> "
+CAPABILITIES = {
+    "fuid": "Gen 4 GDM / USCUID ( Gen4 Magic Wakeup )",
+    "ufuid": "Gen 4 GDM / USCUID ( ZUID Gen1 Magic Wakeup )",
+}
+
+#Keys of every spool of the corpus, as a dict mapping the UID (int) to its 32 keys
+def load_keys():
+    path = os.environ.get(KEYS_ENV)
+    if not path:
+        return {}
+    with open(path) as fp:
+        return {int(uid, 16): [bytes.fromhex(key) for key in keys[0] + keys[1]] for uid, keys in json.load(fp).items()}
+
+def _latency(name):
+    return float(os.environ.get(name) or 0)
+
+def _hex(data):
+    return " ".join(f"{b:02X}" for b in data)
+
+#A magic tag on the reader
+class FakeTag:
+    _uids = itertools.count(1)
+
+    def __init__(self, tag_type):
+        self.tag_type = tag_type
+        uid = (0xB1A00000 + next(FakeTag._uids) + (os.getpid() << 12)).to_bytes(4, "big")[-4:]
+        self.memory = bytearray(DUMP_SIZE)
+        self.memory[0:5] = uid + bytes([uid[0] ^ uid[1] ^ uid[2] ^ uid[3]])
+        self.written = False    #Written since it was placed on the reader
+        self.read_back = False  #Its UID was read after writing it
+
+    @property
+    def uid(self):
+        return bytes(self.memory[0:4])
+
+    def load(self, path, keyfile=None):
+        with open(path, "rb") as fp:
+            data = fp.read()
+        if path.lower().endswith(".json"):
+            data = json_to_bin(data)
+        self.memory[:len(data)] = data[:DUMP_SIZE]
+        if keyfile:
+            with open(keyfile, "rb") as fp:
+                keys = fp.read()
+            sectors = len(keys) // 12
+            for sector in range(sectors):
+                trailer = (sector * BLOCKS_PER_SECTOR + BLOCKS_PER_SECTOR - 1) * BLOCK_SIZE
+                self.memory[trailer:trailer + 6] = keys[sector * 6:sector * 6 + 6]
+                self.memory[trailer + 10:trailer + 16] = keys[(sectors + sector) * 6:(sectors + sector) * 6 + 6]
+        self.written = True
+
+    def block(self, block):
+        return bytes(self.memory[block * BLOCK_SIZE:(block + 1) * BLOCK_SIZE])
+
+# The state of one pm3 client
+class FakeProxmark3:
+    def __init__(self):
+        self.tag_type = os.environ.get(TAG_TYPE_ENV) or "fuid"
+        self.latency = _latency(LATENCY_ENV)
+        self.tag = FakeTag(self.tag_type)
+        self.trace = None
+        self.sniffed = None     #Trace of the last sniff, until it is saved
+        self._sniffs = None
+        self._keys = None
+
+    @property
+    def keys(self):
+        if self._keys is None:
+            self._keys = load_keys()
+        return self._keys
+
+    #Run one command, returns its output lines
+    def run(self, line):
+        words = shlex.split(line)
+        if not words or words[0] == "rem":
+            return []
+        handler = getattr(self, "cmd_" + "_".join(words[:3]).replace("-", "_"), None) or getattr(self, "cmd_" + "_".join(words[:2]), None)
+        if handler is None:
+            return [f"[!] Unknown command: {line}"]
+        return handler(words)
+
+    def _tag_command(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    @staticmethod
+    def _option(words, name):
+        return words[words.index(name) + 1] if name in words else None
+
+    def cmd_trace_load(self, words):
+        self.trace = self._option(words, "-f")
+        return [f"[+] loaded `{self.trace}`"]
+
+    #`trace list -t mf`: one line per frame, and the key of every plaintext authentication we know
+    def cmd_trace_list(self, words):
+        if self.trace is None:
+            return ["[!] No trace loaded"]
+        keys = {}
+        for auth in read_auths(self.trace):
+            if auth.nested or auth.uid is None:
+                continue
+            for key in self.keys.get(auth.uid, []):
+                if check_auth_key(key, auth.cuid, auth.nt, auth.nr_enc, auth.ar_enc):
+                    keys[auth.timestamp] = key
+                    break
+
+        lines = ["      Start |        End | Src | Data (! denotes parity error)                                           | CRC | Annotation"]
+        for frame in read_frames(self.trace):
+            source = "Tag" if frame.is_response else "Rdr"
+            lines.append(f" {frame.timestamp:10} | {frame.timestamp + frame.duration:10} | {source} |{_hex(frame.data):<72}|     |")
+            if frame.timestamp in keys:
+                lines.append(f"            |            |  *  |{'key ' + keys[frame.timestamp].hex().upper() + ' prng WEAK':>72}|     |")
+        return lines
+
+    #`hf 14a sniff`: take the next trace of FAKE_PM3_TRACES as what was sniffed
+    def cmd_hf_14a_sniff(self, words):
+        if self._sniffs is None:
+            directory = Path(os.environ.get(TRACES_ENV) or ".")
+            self._sniffs = iter(sorted(directory.glob("*.trace")))
+        self._tag_command()
+        path = next(self._sniffs, None)
+        self.sniffed = path.read_bytes() if path else b""
+        return ["[=] Press pm3 button to abort sniffing", f"[#] trace len = {len(self.sniffed)}"]
+
+    def cmd_trace_save(self, words):
+        if self.sniffed is None:
+            return ["[!] Trace is empty, nothing to save"]
+        path = self._option(words, "-f")
+        with open(path, "wb") as fp:
+            fp.write(self.sniffed)
+        return [f"[+] saved {len(self.sniffed)} bytes to binary file `{path}`"]
+
+    def cmd_hf_14a_reader(self, words):
+        self._tag_command()
+        if self.tag.written and self.tag.read_back:
+            #The written tag was removed, and the next blank tag placed
+            self.tag = FakeTag(self.tag_type)
+        elif self.tag.written:
+            self.tag.read_back = True
+        return [f"[+]  UID: {_hex(self.tag.uid)} ", "[+] ATQA: 00 04", "[+]  SAK: 08 [2]"]
+
+    def cmd_hf_mf_info(self, words):
+        self._tag_command()
+        return ["[=] --- ISO14443-a Information ---------------------",
+                f"[+]  UID: {_hex(self.tag.uid)} ",
+                "[=] --- Magic Tag Information",
+                f"[+] Magic capabilities... {CAPABILITIES[self.tag_type]}",
+                "[=] --- PRNG Information"]
+
+    def cmd_hf_mf_gdmcfg(self, words):
+        self._tag_command()
+        if self.tag_type != "fuid":
+            return ["[-] Can't read configuration. Card doesn't support the gdm magic wakeup"]
+        return ["[+] Config... 85 00 00 00 00 00 00 00 00 00 00 00 00 00 00 08"]
+
+    def cmd_hf_mf_cgetblk(self, words):
+        self._tag_command()
+        if self.tag_type != "ufuid":
+            return ["[-] Can't read block. error=-1"]
+        block = int(self._option(words, "--blk") or 0)
+        return [f"[=]  {block:2} | {_hex(self.tag.block(block))} | ................"]
+
+    def cmd_hf_mf_restore(self, words):
+        self._tag_command()
+        self.tag.load(self._option(words, "-f"), self._option(words, "-k"))
+        return ["[=] Restoring `dump` to card", "[+] Done!"]
+
+    def cmd_hf_mf_cload(self, words):
+        self._tag_command()
+        self.tag.load(self._option(words, "-f"))
+        return ["[+] Card loaded 64 blocks from file"]
+
+    def cmd_hf_14a_raw(self, words):
+        self._tag_command()
+        return ["[+] 0A"]
+
+    def cmd_hf_mf_dump(self, words):
+        self._tag_command()
+        lines = ["[=]  sec | blk | data                                            | ascii"]
+        for block in range(DUMP_SIZE // BLOCK_SIZE):
+            lines.append(f"[=]  {block // BLOCKS_PER_SECTOR:3} | {block:3} | {_hex(self.tag.block(block))} | ................")
+        return lines
+
+def _print(lines):
+    if lines:
+        sys.stdout.write("\n".join(lines) + "\n")
+    sys.stdout.flush()
+
+#bin/pm3: `pm3 [-o] [-d N] [-c "cmd; cmd"]`, reads commands from stdin without -c
+def pm3_main(argv):
+    if "--help" in argv or "-h" in argv:
+        _print(["Stand-in Proxmark3 client for the benchmarks (benchmarks/fakes.py)"])
+        return 0
+
+    pm3 = FakeProxmark3()
+    if "-c" in argv:
+        for command in argv[argv.index("-c") + 1].split(";"):
+            command = command.strip()
+            _print([PROMPT + command] + pm3.run(command))
+        return 0
+
+    for line in sys.stdin:
+        command = line.strip()
+        _print([PROMPT + command])
+        if command in ("quit", "exit", "q"):
+            break
+        _print(pm3.run(command))
+    return 0
+
+#share/proxmark3/tools/mf_nonce_brute: <uid> <{nt}> <nt_par_err> <{nr}> <{ar}> <ar_par_err> <{at}> <at_par_err> [<{next_command}>]
+def nonce_brute_main(argv):
+    if len(argv) < 8:
+        _print(["Usage: mf_nonce_brute <uid> <{nt}> <nt_par_err> <{nr}> <{ar}> <ar_par_err> <{at}> <at_par_err> [<{next_command}>]"])
+        return 1
+
+    uid, nt, nr, ar = (int(argv[i], 16) for i in (0, 1, 3, 4))
+    _print(["Mifare classic nested auth key recovery. Phase 1.", f"uid.................. {uid:08x}", f"nt encrypted......... {nt:08x}"])
+    latency = _latency(BRUTE_LATENCY_ENV)
+    if latency:
+        time.sleep(latency)
+
+    for key in load_keys().get(uid, []):
+        if check_auth_key(key, uid, nt, nr, ar, True):
+            _print([f"Valid Key found [ {key.hex()} ] - matches candidate"])
+            return 0
+    _print(["key not found"])
+    return 1
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+# Stand-in for pynfc, so libnfc_dump.py can be benchmarked without an NFC reader
+# Created for https://github.com/Bambu-Research-Group/RFID-Tag-Guide
+#
+# Put the benchmarks directory first on the path to use it instead of the real pynfc:
+#   PYTHONPATH=benchmarks FAKE_NFC_DUMPS=dumps/ python3 libnfc_dump.py -d fake
+# Every reader presents each dump (.bin) as a tag that only opens its sectors to the key A of the
+# dump's sector trailers, a few polls in a row as if it stayed on the reader for a moment, then
+# times out like a reader with no more tags in range.
+# - FAKE_NFC_DUMPS: directory of dumps to present (or pass `dumps`, a list of dumps, to Nfc)
+# - FAKE_NFC_LATENCY: seconds every tag operation (select, authentication, read) takes
+# - FAKE_NFC_FAILURES: fraction of authentications and reads that fail, to exercise the retries
+# - FAKE_NFC_PRESENCES: polls every tag stays on the reader for (default: 3)
+
+import os
+import time
+import random
+from pathlib import Path
+
+class TimeoutException(Exception):
+    pass
+
+# A MIFARE Classic tag on the reader, its own target
+class Mifare:
+    def __init__(self, dump, latency=0.0, failures=0.0, rng=None):
+        self.dump = bytes(dump)
+        self.uid = self.dump[:4].hex().encode()
+        self.target = self
+        self.latency = latency
+        self.failures = failures
+        self.rng = rng or random.Random()
+        self.sector = None      #Sector we are authenticated to
+
+    def operation(self):
+        if self.latency:
+            time.sleep(self.latency)
+        return not (self.failures and self.rng.random() < self.failures)
+
+def _dumps_from(directory):
+    return [path.read_bytes() for path in sorted(Path(directory).glob("*.bin"))]
+
+class Nfc:
+    def __init__(self, device, dumps=None, latency=None, failures=None, presences=None, seed=None):
+        if dumps is None:
+            dumps = _dumps_from(os.environ["FAKE_NFC_DUMPS"]) if os.environ.get("FAKE_NFC_DUMPS") else []
+        self.device = device
+        self.dumps = list(dumps)
+        self.latency = float(os.environ.get("FAKE_NFC_LATENCY") or 0) if latency is None else latency
+        self.failures = float(os.environ.get("FAKE_NFC_FAILURES") or 0) if failures is None else failures
+        self.presences = int(os.environ.get("FAKE_NFC_PRESENCES") or 3) if presences is None else presences
+        self.rng = random.Random(seed)
+
+    def poll(self):
+        for dump in self.dumps:
+            tag = Mifare(dump, self.latency, self.failures, self.rng)
+            for _ in range(self.presences):
+                yield tag
+        raise TimeoutException()
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+# Stand-in for the libfreefare bindings of pynfc, see benchmarks/pynfc/__init__.py
+
+import ctypes
+
+uint8_t = ctypes.c_ubyte
+MFC_KEY_A = 0
+MFC_KEY_B = 1
+
+BLOCK_SIZE = 16
+BLOCKS_PER_SECTOR = 4
+
+def mifare_classic_connect(tag):
+    tag.sector = None
+    return 0 if tag.operation() else -1
+
+def mifare_classic_disconnect(tag):
+    tag.sector = None
+    return 0
+
+def mifare_classic_authenticate(tag, block, key, key_type):
+    sector = block // BLOCKS_PER_SECTOR
+    trailer = (sector * BLOCKS_PER_SECTOR + BLOCKS_PER_SECTOR - 1) * BLOCK_SIZE
+    expected = tag.dump[trailer:trailer + 6] if key_type == MFC_KEY_A else tag.dump[trailer + 10:trailer + 16]
+    if not tag.operation() or bytes(key) != expected:
+        tag.sector = None
+        return -1
+    tag.sector = sector
+    return 0
+
+#Sector trailers read back with their keys blanked, like a real tag
+def mifare_classic_read(tag, block, buf):
+    if tag.sector != block // BLOCKS_PER_SECTOR or not tag.operation():
+        tag.sector = None
+        return -1
+    data = bytearray(tag.dump[block * BLOCK_SIZE:(block + 1) * BLOCK_SIZE])
+    if block % BLOCKS_PER_SECTOR == BLOCKS_PER_SECTOR - 1:
+        data[0:6] = bytes(6)
+        data[10:16] = bytes(6)
+    ctypes.memmove(buf, bytes(data), BLOCK_SIZE)
+    return 0
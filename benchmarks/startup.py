@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+# Benchmark for the launch time of the command line tools
+# Created for https://github.com/Bambu-Research-Group/RFID-Tag-Guide
+#
+# Launches every tool (up to the point where it has found the Proxmark3 client) in a fresh
+# interpreter, once with an empty Proxmark3 location cache (cold) and once with a filled one (warm).
+# A failed search is never cached, so without a Proxmark3 installation cold and warm are the same.
+# Set PROXMARK3_DIR (e.g. to benchmarks/proxmark3) or put pm3 on the PATH to measure the cache.
+# Run from anywhere: python3 benchmarks/startup.py [--runs N] [--json]
+
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+FIND_PM3 = "from lib import get_proxmark3_location; get_proxmark3_location()"
+
+# Tool -> code that runs its startup
+TOOLS = {
+    "python": "pass",
+    "traceKeyExtractor": f"import traceKeyExtractor; {FIND_PM3}",
+    "writeTag": f"import writeTag; {FIND_PM3}",
+    "nonceBrute": f"import nonceBrute; {FIND_PM3}",
+    "deriveKeys": "import deriveKeys",
+    "libnfc_dump": "import libnfc_dump",
+}
+
+#Launch `code` in a new interpreter `runs` times, returns the launch times in seconds
+#With cold=True, the Proxmark3 location cache is deleted before every launch
+def time_launches(code, runs, cache, cold):
+    env = dict(os.environ, PROXMARK3_CACHE=str(cache))
+    times = []
+    for _ in range(runs):
+        if cold and cache.exists():
+            cache.unlink()
+        start = time.perf_counter()
+        process = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        times.append(time.perf_counter() - start)
+        if process.returncode != 0:
+            raise RuntimeError(f"{code!r} failed: {process.stderr.decode(errors='replace').strip()}")
+    return times
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cold and warm launch time of the tools")
+    parser.add_argument("-n", "--runs", type=int, default=10, help="Launches per tool and mode (default: 10)")
+    parser.add_argument("--tools", nargs="+", choices=TOOLS, default=list(TOOLS), help="Tools to launch (default: all)")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = Path(tmp) / "proxmark3.json"
+        for tool in args.tools:
+            try:
+                cold = time_launches(TOOLS[tool], args.runs, cache, cold=True)
+                warm = time_launches(TOOLS[tool], args.runs, cache, cold=False)
+            except RuntimeError as e:
+                print(f"Skipping {tool}: {e}", file=sys.stderr)
+                continue
+            results[tool] = {"cold_ms": statistics.median(cold) * 1000, "warm_ms": statistics.median(warm) * 1000}
+
+    if args.json:
+        print(json.dumps({"runs": args.runs, "python": sys.version.split()[0], "results": results}, indent=2))
+        return
+
+    print(f"{'tool':<20} {'cold':>10} {'warm':>10}   (median of {args.runs} launches)")
+    for tool, result in results.items():
+        print(f"{tool:<20} {result['cold_ms']:8.1f}ms {result['warm_ms']:8.1f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+
+# Benchmark suite for the tools, run against stand-ins for the Proxmark3 and the NFC reader
+# Created for https://github.com/Bambu-Research-Group/RFID-Tag-Guide
+#
+# Builds corpora of synthetic spools (see corpus.py) of every size asked for, and measures:
+# - kdf: deriveKeys.kdf, per UID
+# - discover_bambu, discover_foreign: traceKeyExtractor.discoverKeys, per trace, for spools with
+#   derived keys and for spools whose keys have to be recovered by pm3 and mf_nonce_brute
+# - sniff: traceKeyExtractor.py --sniff, per spool (from the first sniff to the last key file)
+# - nfc_dump: libnfc_dump, per complete dump (from the first poll to the dump on disk)
+# - write_tag: writeTag.py batch mode, per tag written and verified
+# The Proxmark3 is replaced by benchmarks/proxmark3 (see fakes.py), the NFC reader by the pynfc
+# stand-in in benchmarks/pynfc. Every benchmark checks that the tool produced the right keys or
+# dumps, so a broken tool fails the run instead of getting faster.
+#
+# Fast benchmarks are repeated until a run takes MIN_RUN_TIME. The best time per item of --runs
+# runs is compared to the baseline file: a result more than --tolerance
+# slower than its baseline fails the run (exit code 1). Without a baseline, or with --update, the
+# results are saved as the new baseline. Baselines only make sense on the machine they were made on.
+#   python3 benchmarks/suite.py --sizes 10 100
+#   python3 benchmarks/suite.py --update
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import contextlib
+from pathlib import Path
+
+BENCHMARKS = Path(__file__).resolve().parent
+ROOT = BENCHMARKS.parent
+#The pynfc stand-in has to come before a real pynfc
+sys.path.insert(0, str(BENCHMARKS))
+sys.path.insert(1, str(ROOT))
+
+import corpus
+import fakes
+
+FAKE_PM3 = BENCHMARKS / "proxmark3"
+MIN_RUN_TIME = 0.5          #Seconds a run takes at least, fast benchmarks are repeated until they do
+DICTIONARY = "myKeyDictionary.dic"
+DEFAULT_BASELINE = BENCHMARKS / "baseline.json"
+
+#Run `func`, returns how long it took in seconds
+#The output of the tools is discarded, they print a lot and that isn't what we measure
+def _timed(func, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        func(*args)
+        return time.perf_counter() - start
+
+#Point the dictionary of traceKeyExtractor (and so its key files) to `directory` for one run
+#Its globals are restored afterwards, so every run gets its own directory
+@contextlib.contextmanager
+def _dictionary(traceKeyExtractor, directory):
+    saved = traceKeyExtractor.dictionaryFilename, traceKeyExtractor.dictionaryFilepath
+    dictionary = str(Path(directory) / DICTIONARY)
+    os.makedirs(directory, exist_ok=True)
+    traceKeyExtractor.dictionaryFilename = traceKeyExtractor.dictionaryFilepath = dictionary
+    try:
+        yield dictionary
+    finally:
+        traceKeyExtractor.dictionaryFilename, traceKeyExtractor.dictionaryFilepath = saved
+
+def bench_kdf(spools, directory, paths, args):
+    from deriveKeys import kdf
+    kdf(b"\x00\x00\x00\x00")   #Import pycryptodome outside of the measurement
+
+    def run():
+        for spool in spools:
+            if kdf(spool.uid) != spool.keys and spool.bambu:
+                raise RuntimeError(f"kdf({spool.name}) returned the wrong keys")
+    return len(spools), _timed(run)
+
+def _discover(spools, directory, paths):
+    import traceKeyExtractor
+    from deriveKeys import keyfile_bytes
+
+    traceKeyExtractor.pm3Location = FAKE_PM3
+    elapsed = 0.0
+    for spool in spools:
+        with _dictionary(traceKeyExtractor, Path(directory) / "keys") as dictionary:
+            open(dictionary, "w").close()
+            trace = str(Path(directory) / "traces" / f"{spool.name}.trace")
+            elapsed += _timed(traceKeyExtractor.discoverKeys, trace)
+
+        with open(dictionary) as fp:
+            found = set(fp.read().split())
+        if not all(key.hex().upper() in found for key in spool.keys[0]):
+            raise RuntimeError(f"discoverKeys missed keys of {spool.name}")
+        if spool.bambu:
+            with open(Path(dictionary).parent / f"hf-mf-{spool.name}-key.bin", "rb") as fp:
+                if fp.read() != keyfile_bytes(spool.keys):
+                    raise RuntimeError(f"discoverKeys wrote a wrong key file for {spool.name}")
+    return len(spools), elapsed
+
+def bench_discover_bambu(spools, directory, paths, args):
+    return _discover([spool for spool in spools if spool.bambu], directory, paths)
+
+def bench_discover_foreign(spools, directory, paths, args):
+    return _discover([spool for spool in spools if not spool.bambu], directory, paths)
+
+def bench_sniff(spools, directory, paths, args):
+    import asyncio
+    import traceKeyExtractor
+    from deriveKeys import keyfile_bytes
+
+    traceKeyExtractor.pm3Location = FAKE_PM3
+    output = tempfile.mkdtemp(dir=directory)
+    with _dictionary(traceKeyExtractor, output) as dictionary:
+        open(dictionary, "w").close()
+        elapsed = _timed(asyncio.run, traceKeyExtractor.streamKeys(None, None, len(spools)))
+
+    for spool in spools:
+        path = Path(output) / f"hf-mf-{spool.name}-key.bin"
+        #Key B of the other spools is never used by the AMS, so it isn't in the trace
+        length = len(keyfile_bytes(spool.keys)) if spool.bambu else len(spool.keys[0]) * 6
+        if not path.exists() or path.read_bytes()[:length] != keyfile_bytes(spool.keys)[:length]:
+            raise RuntimeError(f"Sniffing didn't write the right key file for {spool.name}")
+    return len(spools), elapsed
+
+def bench_nfc_dump(spools, directory, paths, args):
+    import pynfc
+    from libnfc_dump import DumpStation
+    from lib.keycache import KeyCache
+    from lib.kiosk import UidStore
+
+    #libnfc_dump derives the keys from the UID, it can't dump the other spools
+    spools = [spool for spool in spools if spool.bambu]
+    output = tempfile.mkdtemp(dir=directory)
+    station = DumpStation(KeyCache(len(spools) + 1), output, UidStore())
+    reader = pynfc.Nfc("fake", [spool.dump for spool in spools], latency=args.nfc_latency, failures=args.nfc_failures, seed=args.seed)
+
+    def run():
+        writer = threading.Thread(target=station.write_dumps)
+        writer.start()
+        try:
+            station.poll("fake", reader)
+        finally:
+            station.write_queue.put(None)
+            writer.join()
+    elapsed = _timed(run)
+
+    for spool in spools:
+        path = Path(output) / f"hf-tag-{spool.name}.bin"
+        if not path.exists() or path.read_bytes() != spool.dump:
+            raise RuntimeError(f"libnfc_dump didn't dump {spool.name} correctly")
+    return len(spools), elapsed
+
+def bench_write_tag(spools, directory, paths, args):
+    import writeTag
+
+    writeTag.pm3Location = FAKE_PM3
+    writeTag.tagPollInterval = 0
+    report = str(Path(directory) / "write-report.json")
+    #Batch mode asks for confirmation once
+    confirm = writeTag.confirmWrite
+    writeTag.confirmWrite = lambda count=1: True
+    try:
+        elapsed = _timed(writeTag.writeBatch, str(paths["manifest"]), report)
+    finally:
+        writeTag.confirmWrite = confirm
+
+    with open(report) as fp:
+        results = json.load(fp)
+    failed = [result["dump"] for result in results if result["status"] != "ok"]
+    if len(results) != len(spools) or failed:
+        raise RuntimeError(f"writeTag wrote {len(results) - len(failed)} of {len(spools)} tags")
+    return len(spools), elapsed
+
+BENCHES = {
+    "kdf": bench_kdf,
+    "discover_bambu": bench_discover_bambu,
+    "discover_foreign": bench_discover_foreign,
+    "sniff": bench_sniff,
+    "nfc_dump": bench_nfc_dump,
+    "write_tag": bench_write_tag,
+}
+
+#Settings that change the results, a baseline is only comparable to runs with the same settings
+def settings(args):
+    return {
+        "foreign": args.foreign,
+        "seed": args.seed,
+        "pm3_latency": args.pm3_latency,
+        "brute_latency": args.brute_latency,
+        "nfc_latency": args.nfc_latency,
+        "nfc_failures": args.nfc_failures,
+        "tag_type": args.tag_type,
+    }
+
+def run_benchmarks(args):
+    os.environ[fakes.LATENCY_ENV] = str(args.pm3_latency)
+    os.environ[fakes.BRUTE_LATENCY_ENV] = str(args.brute_latency)
+    os.environ[fakes.TAG_TYPE_ENV] = args.tag_type
+
+    results = {}
+    for size in args.sizes:
+        spools = corpus.make_spools(size, args.foreign, args.seed)
+        with tempfile.TemporaryDirectory() as directory:
+            paths = corpus.write_corpus(directory, spools, args.seed)
+            os.environ[fakes.KEYS_ENV] = str(paths["keys"])
+            os.environ[fakes.TRACES_ENV] = str(Path(directory) / "traces")
+
+            for name in args.only:
+                best = None
+                for _ in range(args.runs):
+                    total_items = total_time = 0
+                    while total_time < MIN_RUN_TIME:
+                        items, elapsed = BENCHES[name](spools, directory, paths, args)
+                        if items == 0:
+                            break
+                        total_items += items
+                        total_time += elapsed
+                    if total_items == 0:
+                        break
+                    per_item = total_time / total_items
+                    best = per_item if best is None else min(best, per_item)
+                if best is None:
+                    print(f"{name}/{size}: no spools of that kind in the corpus, skipped", file=sys.stderr)
+                    continue
+
+                results[f"{name}/{size}"] = {"items": items, "ms_per_item": best * 1000}
+                print(f"{name}/{size}: {best * 1000:.3f} ms per item ({items} items)", file=sys.stderr)
+    return results
+
+#Compare the results to the baseline, returns the names of the results that got slower than the tolerance
+def compare(results, baseline, tolerance):
+    regressions = []
+    print(f"{'benchmark':<28} {'baseline':>12} {'now':>12} {'change':>9}")
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name:<28} {'-':>12} {result['ms_per_item']:10.3f}ms {'new':>9}")
+            continue
+        before = baseline[name]["ms_per_item"]
+        change = result["ms_per_item"] / before - 1 if before else 0.0
+        regressed = change > tolerance
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<28} {before:10.3f}ms {result['ms_per_item']:10.3f}ms {change:+8.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the tools against stand-ins for the Proxmark3 and the NFC reader, and compare to a baseline")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100], help="Number of spools of every corpus (default: 10 100)")
+    parser.add_argument("--only", nargs="+", choices=BENCHES, default=list(BENCHES), help="Benchmarks to run (default: all)")
+    parser.add_argument("-n", "--runs", type=int, default=5, help="Runs per benchmark, the best one counts (default: 5)")
+    parser.add_argument("--foreign", type=float, default=0.2, help="Fraction of spools that don't use derived keys (default: 0.2)")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the synthetic corpora (default: 1)")
+    parser.add_argument("--pm3-latency", type=float, default=0.0, help="Seconds every tag command of the Proxmark3 stand-in takes (default: 0)")
+    parser.add_argument("--brute-latency", type=float, default=0.0, help="Seconds every mf_nonce_brute run of the stand-in takes (default: 0)")
+    parser.add_argument("--nfc-latency", type=float, default=0.0, help="Seconds every tag operation of the NFC reader stand-in takes (default: 0)")
+    parser.add_argument("--nfc-failures", type=float, default=0.0, help="Fraction of NFC reader operations that fail (default: 0)")
+    parser.add_argument("--tag-type", choices=fakes.CAPABILITIES, default="fuid", help="Magic tag type the Proxmark3 stand-in writes to (default: fuid)")
+    parser.add_argument("-b", "--baseline", default=str(DEFAULT_BASELINE), help=f"Baseline file (default: {DEFAULT_BASELINE.relative_to(ROOT)})")
+    parser.add_argument("-u", "--update", action="store_true", help="Save the results as the new baseline instead of comparing")
+    parser.add_argument("-t", "--tolerance", type=float, default=0.25, help="Slowdown that counts as a regression (default: 0.25, 25%%)")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args)
+    current = {"python": sys.version.split()[0], "settings": settings(args), "results": results}
+    if args.json:
+        print(json.dumps(current, indent=2))
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.update:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+
+    if baseline is None:
+        with open(args.baseline, "w") as fp:
+            json.dump(current, fp, indent=2)
+        print(f"Baseline saved to {args.baseline}", file=sys.stderr)
+        return
+
+    if baseline.get("settings") != current["settings"]:
+        print(f"The baseline was made with other settings ({baseline.get('settings')}), run with the same settings or use --update", file=sys.stderr)
+        sys.exit(1)
+
+    regressions = compare(results, baseline["results"], args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} benchmarks are more than {args.tolerance:.0%} slower than the baseline: {', '.join(regressions)}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -6,20 +6,148 @@
 # Requires: pycryptodome
 
 import sys
-from Crypto.Protocol.KDF import HKDF
-from Crypto.Hash import SHA256
+import os
+import json
+import time
+import argparse
+
+from lib import metrics
 
 if not sys.version_info >= (3, 6):
    print("Python 3.6 or higher is required!")
    exit(-1)
 
+OUTPUT_FORMATS = ["keyfile", "dict", "jsonl"]
+
+#pycryptodome is only imported once the first key is derived, so importing this module (or running --help) stays fast
+@metrics.timed("kdf_seconds")
 def kdf(uid):
+    from Crypto.Protocol.KDF import HKDF
+    from Crypto.Hash import SHA256
     salt = bytes([0x9a,0x75,0x9c,0xf2,0xc4,0xf7,0xca,0xff,0x22,0x2c,0xb9,0x76,0x9b,0x41,0xbc,0x96])
     return [HKDF(uid, 6, salt, SHA256, 16, context=b"RFID-A\0"), HKDF(uid, 6, salt, SHA256, 16, context=b"RFID-B\0")]
 
-if __name__ == '__main__':
-    uid = bytes.fromhex(sys.argv[1])
-    keys = kdf(uid)
+#Build a Proxmark3-compatible keyfile (see examples/exampleKeyfile.bin)
+#The layout is the 16 A keys followed by the 16 B keys, 6 bytes each (192 bytes total)
+def keyfile_bytes(keys):
+    return b"".join(keys[0]) + b"".join(keys[1])
+
+#Read UIDs from an iterable of lines, one UID per line
+#Blank lines and lines starting with "#" are skipped, and duplicates are only yielded once
+def read_uids(lines):
+    seen = set()
+    for line in lines:
+        uid = line.strip().replace(" ", "").upper()
+        if not uid or uid.startswith("#"):
+            continue
+        if uid in seen:
+            continue
+        seen.add(uid)
+        yield uid
+
+#Worker function for the process pool
+#Takes a hex UID, returns the UID with both key sets, or the error if the UID is malformed
+def derive_uid(uid):
+    try:
+        return uid, kdf(bytes.fromhex(uid)), None
+    except ValueError as e:
+        return uid, None, str(e)
+
+#Derive keys for every UID in `uids`, spreading the work over `jobs` processes
+#Results are yielded in input order as soon as they are ready, so nothing is held in memory
+def derive_batch(uids, jobs=None, chunksize=64):
+    if jobs == 1:
+        for uid in uids:
+            yield derive_uid(uid)
+        return
+
+    from multiprocessing import Pool
+    with Pool(jobs) as pool:
+        for result in pool.imap(derive_uid, uids, chunksize):
+            yield result
+
+#Stream batch results to the chosen output format
+# - keyfile: one hf-mf-<UID>-key.bin file per UID, written into `output` (a directory)
+# - dict: a combined dictionary of unique keys, one per line
+# - jsonl: one JSON object per UID, one per line
+#Returns a tuple of (derived UID count, failed UID count)
+def write_batch(results, fmt, output):
+    derived = 0
+    failed = 0
+
+    if fmt == "keyfile":
+        os.makedirs(output, exist_ok=True)
+        fp = None
+    else:
+        fp = sys.stdout if output in (None, "-") else open(output, "w")
+
+    seen_keys = set()
+
+    try:
+        for uid, keys, error in results:
+            if error:
+                print(f"Skipping invalid UID {uid}: {error}", file=sys.stderr)
+                failed += 1
+                continue
+
+            if fmt == "keyfile":
+                with open(os.path.join(output, f"hf-mf-{uid}-key.bin"), "wb") as kf:
+                    kf.write(keyfile_bytes(keys))
+            elif fmt == "dict":
+                for key in [*keys[0], *keys[1]]:
+                    key = key.hex().upper()
+                    if key in seen_keys:
+                        continue
+                    seen_keys.add(key)
+                    fp.write(key + "\n")
+            else:
+                fp.write(json.dumps({
+                    "uid": uid,
+                    "keyA": [k.hex().upper() for k in keys[0]],
+                    "keyB": [k.hex().upper() for k in keys[1]],
+                }) + "\n")
 
-    output = [k.hex().upper() for k in [*keys[0], *keys[1]]]
-    print("\n".join(output))
+            derived += 1
+    finally:
+        if fp is not None and fp is not sys.stdout:
+            fp.close()
+
+    return derived, failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Derive the MIFARE keys of Bambu Lab RFID tags from their UID")
+    parser.add_argument('uid', nargs='?', help='Tag UID in hex, e.g. "75886B1D"')
+    parser.add_argument('-b', '--batch', metavar='FILE', help='Derive keys for every UID listed in FILE (one per line), or "-" for stdin')
+    parser.add_argument('-f', '--format', choices=OUTPUT_FORMATS, default="jsonl", help='Batch output format (default: jsonl)')
+    parser.add_argument('-o', '--output', help='Batch output file, or directory for the keyfile format (default: stdout / current directory)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Number of worker processes (default: one per CPU core)')
+
+    args = parser.parse_args()
+
+    if not args.batch:
+        if not args.uid:
+            parser.error("a UID or --batch is required")
+
+        uid = bytes.fromhex(args.uid)
+        keys = kdf(uid)
+
+        output = [k.hex().upper() for k in [*keys[0], *keys[1]]]
+        print("\n".join(output))
+        return
+
+    infile = sys.stdin if args.batch == "-" else open(args.batch, "r")
+    output = args.output if args.output else ("." if args.format == "keyfile" else None)
+
+    start = time.perf_counter()
+    try:
+        derived, failed = write_batch(derive_batch(read_uids(infile), args.jobs), args.format, output)
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+    elapsed = time.perf_counter() - start
+
+    rate = derived / elapsed if elapsed > 0 else 0
+    print(f"Derived keys for {derived} UIDs ({failed} skipped) in {elapsed:.2f}s: {rate:.0f} UIDs/s", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+# Python script to keep a collection of tag dumps in a single deduplicated archive
+# Created for https://github.com/Bambu-Research-Group/RFID-Tag-Guide
+# Requires: pycryptodome
+#
+# Every distinct block is stored once (see lib/dumparchive.py), so the archive is a fraction of the
+# size of the dump files it was built from, while any dump can still be read back by its UID.
+
+import os
+import sys
+import time
+import argparse
+
+from lib.dumparchive import DumpArchive, read_dump, export_dump
+from lib.validate import find_items
+
+EXPORT_FORMATS = ["bin", "json", "both"]
+
+#Yield (name, raw dump) for every dump of the sources, skipping files that can't be read
+def read_sources(sources):
+    for name, path, data in find_items(sources):
+        try:
+            if data is None:
+                with open(path, "rb") as fp:
+                    data = fp.read()
+            yield name, read_dump(name, data)
+        except (OSError, ValueError, TypeError, AttributeError, UnicodeDecodeError) as e:
+            print(f"Skipping {name}: {e}", file=sys.stderr)
+
+def formats(fmt):
+    return ["bin", "json"] if fmt == "both" else [fmt]
+
+def main():
+    parser = argparse.ArgumentParser(description="Store tag dumps in a deduplicated archive, and read them back")
+    parser.add_argument("archive", help="Archive file (created if it doesn't exist)")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+
+    add = subparsers.add_parser("add", help="Add dumps to the archive")
+    add.add_argument("sources", nargs="+", help="Dump files (.bin, .json, .nfc), directories of dumps, or .tar/.zip archives of dumps")
+
+    get = subparsers.add_parser("get", help="Write the most recent dump of a UID")
+    get.add_argument("uid", help='Tag UID in hex, e.g. "75886B1D"')
+    get.add_argument("-f", "--format", choices=EXPORT_FORMATS[:2], default="bin", help="Dump format (default: bin)")
+    get.add_argument("-o", "--output", help="Output file (default: stdout)")
+
+    export = subparsers.add_parser("export", help="Write the dumps back to files")
+    export.add_argument("directory", help="Directory to write the dumps to")
+    export.add_argument("-f", "--format", choices=EXPORT_FORMATS, default="bin", help="Dump format (default: bin)")
+    export.add_argument("-a", "--all", action="store_true", help="Write every dump, not only the most recent dump of each UID")
+
+    subparsers.add_parser("list", help="List the UIDs in the archive")
+    subparsers.add_parser("stats", help="Show how much space the archive saves")
+
+    args = parser.parse_args()
+    start = time.perf_counter()
+
+    with DumpArchive(args.archive) as archive:
+        if args.action == "add":
+            count = archive.add_many(read_sources(args.sources))
+            print(f"Added {count} dumps in {time.perf_counter() - start:.2f}s, {len(archive)} dumps in the archive", file=sys.stderr)
+
+        elif args.action == "get":
+            try:
+                data = export_dump(archive.get(args.uid), args.format)
+            except KeyError:
+                print(f"{args.uid} is not in the archive", file=sys.stderr)
+                sys.exit(1)
+            if args.output:
+                with open(args.output, "wb") as fp:
+                    fp.write(data)
+            else:
+                sys.stdout.buffer.write(data)
+
+        elif args.action == "export":
+            os.makedirs(args.directory, exist_ok=True)
+            count = 0
+            for number, uid, name, data in archive.dumps(latest_only=not args.all):
+                base = os.path.join(args.directory, f"hf-mf-{uid}-dump" + (f"-{number}" if args.all else ""))
+                for fmt in formats(args.format):
+                    with open(f"{base}.{fmt}", "wb") as fp:
+                        fp.write(export_dump(data, fmt))
+                count += 1
+            print(f"Exported {count} dumps in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+
+        elif args.action == "list":
+            for uid in archive.uids():
+                print(uid)
+
+        else:
+            stats = archive.stats()
+            size = sum(os.path.getsize(path) for path in (args.archive, args.archive + "-wal") if os.path.exists(path))
+            print(f"{stats['dumps']} dumps, {stats['blocks']} distinct shared blocks")
+            print(f"Archive: {size / 1024:.1f} KiB ({size / max(stats['dumps'], 1):.0f} bytes per dump, raw dumps take 1024)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+# Python script to index a directory of tag dumps and query the filament data in them
+# Created for https://github.com/Bambu-Research-Group/RFID-Tag-Guide
+# Requires: numpy
+
+import sys
+import json
+import time
+import argparse
+
+from lib.index import DumpIndex, build_index
+
+GROUP_COLUMNS = {
+    "material": "detailed_filament_type",
+    "type": "filament_type",
+    "material-id": "material_id",
+    "color": "color",
+    "weight": "spool_weight",
+    "date": "production_date",
+}
+
+def parse_range(value):
+    low, _, high = value.partition("-")
+    return (int(low), int(high or low))
+
+def main():
+    parser = argparse.ArgumentParser(description="Index tag dumps and query their filament data")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+
+    build = subparsers.add_parser("build", help="Create or update the index of a directory of dumps")
+    build.add_argument("dumps", help="Directory containing .bin and/or .json dumps")
+    build.add_argument("-i", "--index", default="dump-index", help="Index directory (default: dump-index)")
+
+    query = subparsers.add_parser("query", help="Query an index")
+    query.add_argument("-i", "--index", default="dump-index", help="Index directory (default: dump-index)")
+    query.add_argument("--material", help='Detailed filament type, e.g. "PLA Basic"')
+    query.add_argument("--type", help='Filament type, e.g. "PLA"')
+    query.add_argument("--material-id", help='Material ID, e.g. "GFA00"')
+    query.add_argument("--color", help="Color as RGB or RGBA hex, e.g. FF6A13")
+    query.add_argument("--min-weight", type=int, help="Minimum spool weight in grams")
+    query.add_argument("--max-weight", type=int, help="Maximum spool weight in grams")
+    query.add_argument("--temp", type=parse_range, help="Hotend temperature (or LOW-HIGH range) the filament must print at")
+    query.add_argument("--after", help="Produced on or after this date (YYYY-MM-DD)")
+    query.add_argument("--before", help="Produced on or before this date (YYYY-MM-DD)")
+    query.add_argument("--group-by", choices=GROUP_COLUMNS, help="Count matching spools (and their total weight) per group")
+    query.add_argument("--list", action="store_true", help="Print every matching dump as a JSON line")
+
+    args = parser.parse_args()
+    start = time.perf_counter()
+
+    if args.action == "build":
+        count, decoded = build_index(args.dumps, args.index)
+        print(f"Indexed {count} dumps ({decoded} new or changed) in {time.perf_counter() - start:.2f}s")
+        return
+
+    index = DumpIndex(args.index)
+    mask = index.query(
+        material=args.material, filament_type=args.type, material_id=args.material_id, color=args.color,
+        min_weight=args.min_weight, max_weight=args.max_weight, temperature=args.temp,
+        produced_after=args.after, produced_before=args.before,
+    )
+
+    if args.list:
+        for row in index.rows(mask):
+            print(json.dumps(row))
+
+    if args.group_by:
+        for group, totals in index.aggregate(GROUP_COLUMNS[args.group_by], mask).items():
+            print(f"{group}\t{totals['count']}\t{totals['weight']} g")
+
+    print(f"{int(mask.sum())} of {len(index)} dumps match ({(time.perf_counter() - start) * 1000:.1f} ms)", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
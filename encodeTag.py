@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+# Python script to create tag images from filament parameters
+# Created for https://github.com/Bambu-Research-Group/RFID-Tag-Guide
+# Requires: numpy, pycryptodome
+
+import sys
+import csv
+import json
+import time
+import argparse
+
+from lib.encoder import encode_batch, write_images
+
+#Read a table of specs, either CSV with a header row or JSON (a list of objects, or one object per line)
+def read_table(path):
+    with open(path, newline="") as fp:
+        if not path.lower().endswith((".json", ".jsonl")):
+            return list(csv.DictReader(fp))
+        text = fp.read()
+    if text.lstrip().startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description="Create Bambu Lab tag images from filament parameters")
+    parser.add_argument("table", help="CSV or JSON table with a uid column and the fields of lib/encoder.py (the names used by BambuTag.to_dict())")
+    parser.add_argument("-o", "--output", default=".", help="Directory to write the images to (default: current directory)")
+    parser.add_argument("-f", "--format", choices=["bin", "json", "both"], default="bin", help="Image format (default: bin)")
+    parser.add_argument("-k", "--keys", action="store_true", help="Also write the key file of every tag (hf-mf-<UID>-key.bin)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Processes used to derive the keys (default: 1)")
+    args = parser.parse_args()
+
+    specs = read_table(args.table)
+    start = time.perf_counter()
+
+    images = encode_batch(specs, jobs=args.jobs)
+    formats = ("bin", "json") if args.format == "both" else (args.format,)
+    if args.keys:
+        formats += ("key",)
+    paths = write_images(images, args.output, formats)
+    print(f"Wrote {len(paths)} files for {len(images)} tags in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -5,11 +5,16 @@
 
 import subprocess
 import os
+import re
+import json
 import sys
 import struct
+import threading
 from pathlib import Path
 from datetime import datetime
 
+from lib import metrics
+
 if not sys.version_info >= (3, 6):
   raise Exception("Python 3.6 or higher is required!")
   
@@ -21,26 +26,138 @@ def strip_color_codes(input_string):
     # Use the sub method to replace the escape sequences with an empty string
     return ansi_escape.sub('', input_string)
 
-def run_command(command, pipe=True):
+#Processes started by run_command that are still running
+running_processes = set()
+running_processes_lock = threading.Lock()
+
+def run_command(command, pipe=True, timeout=None):
+    with metrics.timer("command_seconds", program=command_name(command)):
+        return _run_command(command, pipe, timeout)
+
+#Name of the program a command runs, used to label its metrics
+def command_name(command):
+    return os.path.basename(str(command[0]))
+
+def _run_command(command, pipe=True, timeout=None):
     print(' '.join([str(c) for c in command]))
     try:
         # On Windows, use the shell=True argument to run the command
-        result = subprocess.run(command, shell=os.name == 'nt', capture_output=pipe)
-        # Check the return code to determine if the command was successful
-        if result.returncode == 0 or result.returncode == 1:
-            return result.stdout.decode("utf-8").strip().replace('\r\n', '\n') if pipe else ""
+        output = subprocess.PIPE if pipe else None
+        process = subprocess.Popen(command, shell=os.name == 'nt', stdout=output, stderr=output)
+    except Exception:
+        metrics.count("command_failures_total", program=command_name(command), reason="start")
+        return None
+
+    with running_processes_lock:
+        running_processes.add(process)
+    try:
+        stdout, _ = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.communicate()
+        print(f"Command timed out after {timeout} seconds")
+        metrics.count("command_failures_total", program=command_name(command), reason="timeout")
         return None
-    except Exception as e:
+    except Exception:
+        process.kill()
+        process.communicate()
+        metrics.count("command_failures_total", program=command_name(command), reason="error")
         return None
+    finally:
+        with running_processes_lock:
+            running_processes.discard(process)
+
+    # Check the return code to determine if the command was successful
+    if process.returncode == 0 or process.returncode == 1:
+        return stdout.decode("utf-8").strip().replace('\r\n', '\n') if pipe else ""
+    metrics.count("command_failures_total", program=command_name(command), reason="exit")
+    return None
+
+#Kill every command started by run_command that is still running
+#The interrupted run_command calls return None
+def terminate_commands():
+    with running_processes_lock:
+        for process in running_processes:
+            process.kill()
+
+#File that remembers where pm3 was found, so it doesn't have to be searched for on every start
+#Set the PROXMARK3_CACHE environment variable to use another file, or to an empty string to disable the cache
+def proxmark3_cache_path():
+    if "PROXMARK3_CACHE" in os.environ:
+        return Path(os.environ["PROXMARK3_CACHE"]) if os.environ["PROXMARK3_CACHE"] else None
+    if os.name == 'nt' and os.environ.get('LOCALAPPDATA'):
+        cache_dir = Path(os.environ['LOCALAPPDATA'])
+    else:
+        cache_dir = Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / ".cache")
+    return cache_dir / "bambu-rfid-tag-guide" / "proxmark3.json"
+
+#Identify the pm3 command of an installation by its inode, modification time and size
+#Upgrading or reinstalling the client changes at least one of them
+def _proxmark3_fingerprint(location):
+    try:
+        st = os.stat(Path(location) / "bin/pm3")
+    except OSError:
+        return None
+    return [st.st_ino, st.st_mtime_ns, st.st_size]
+
+#Everything outside the installation that changes where pm3 is found
+def _proxmark3_environment():
+    return {"PROXMARK3_DIR": os.environ.get('PROXMARK3_DIR', ""), "PATH": os.environ.get('PATH', "")}
+
+def _load_cached_proxmark3_location(cache):
+    try:
+        with open(cache) as fp:
+            cached = json.load(fp)
+        location = Path(cached["location"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+    if cached.get("environment") != _proxmark3_environment():
+        return None
+    if cached.get("fingerprint") is None or cached["fingerprint"] != _proxmark3_fingerprint(location):
+        return None
+    return location
+
+def _save_cached_proxmark3_location(cache, location):
+    try:
+        cache.parent.mkdir(parents=True, exist_ok=True)
+        #Write to a temporary file first, so a concurrent start never reads half a file
+        tmp = cache.with_name(f"{cache.name}.{os.getpid()}.tmp")
+        with open(tmp, "w") as fp:
+            json.dump({
+                "location": str(location),
+                "environment": _proxmark3_environment(),
+                "fingerprint": _proxmark3_fingerprint(location),
+            }, fp)
+        os.replace(tmp, cache)
+    except OSError as e:
+        print(f"Warning: could not cache the Proxmark3 location: {e}")
+
+#Return the directory of the Proxmark3 installation (as a Path), or None if pm3 can't be found
+#The result is cached on disk and reused as long as the pm3 command and the environment haven't changed
+# - refresh: ignore the cached location and search again
+def get_proxmark3_location(refresh=False):
+    cache = proxmark3_cache_path()
+    if cache and not refresh:
+        location = _load_cached_proxmark3_location(cache)
+        if location:
+            print(f"Using pm3 from {location}")
+            return location
+
+    location = find_proxmark3_location()
+    if location and cache:
+        _save_cached_proxmark3_location(cache, location)
+    return location
 
-def get_proxmark3_location():
+def find_proxmark3_location():
     # Find a "pm3" command that works from a list of OS-specific possibilities
     print("Checking program: pm3")
 
     # Check PROXMARK3_DIR environment variable
     if os.environ.get('PROXMARK3_DIR'):
-        if run_command(os.environ['PROXMARK3_DIR'] + "/bin/pm3", "--help"):
-            return os.environ['PROXMARK3_DIR']
+        pm3_dir = Path(os.environ['PROXMARK3_DIR'])
+        if run_command([pm3_dir / "bin/pm3", "--help"]):
+            return pm3_dir
         else:
             print("Warning: PROXMARK3_DIR environment variable points to the wrong folder, ignoring")
 
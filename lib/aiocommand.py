@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+# asyncio counterpart of lib.run_command
+# Created for https://github.com/Bambu-Research-Group/RFID-Tag-Guide
+#
+# run_command waits for a command to exit before its output can be parsed, and returns None on
+# any failure. stream_command yields the output line by line while the command is running, so
+# callers can act on a match (and stop the command) right away, and several commands can run
+# side by side in one event loop. Failures are raised as CommandError subclasses that carry the
+# command, its exit code and the last lines of its output.
+
+import os
+import asyncio
+import subprocess
+from collections import deque
+
+from lib import metrics, command_name
+
+#Exit codes treated as success, same as run_command (the Proxmark3 client often exits with 1)
+SUCCESS_CODES = (0, 1)
+#Number of output lines kept for error reports
+ERROR_TAIL = 20
+#Longest output line accepted (trace listings can have very long lines)
+LINE_LIMIT = 1024 * 1024
+
+class CommandError(RuntimeError):
+    def __init__(self, command, message, returncode=None, output=None):
+        self.command = [str(c) for c in command]
+        self.returncode = returncode
+        self.output = output or []       #Last lines of output, for diagnostics
+        super().__init__(f"`{' '.join(self.command)}`: {message}")
+
+#The command couldn't be started (not found, not executable)
+class CommandNotFoundError(CommandError):
+    pass
+
+#The command didn't finish in time and was killed
+class CommandTimeoutError(CommandError, TimeoutError):
+    pass
+
+#The command exited with an exit code that isn't in SUCCESS_CODES
+class CommandFailedError(CommandError):
+    pass
+
+async def _start(command):
+    try:
+        # On Windows, run the command through the shell, like run_command does
+        if os.name == 'nt':
+            return await asyncio.create_subprocess_shell(subprocess.list2cmdline(command), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, limit=LINE_LIMIT)
+        return await asyncio.create_subprocess_exec(*command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, limit=LINE_LIMIT)
+    except OSError as e:
+        raise CommandNotFoundError(command, f"could not be started ({e.strerror or e})")
+
+#Run a command and yield its output (stdout and stderr) one line at a time, as it is written
+# - timeout: seconds the whole command may take; it is killed and CommandTimeoutError is raised after that
+# - success_codes: exit codes that don't raise CommandFailedError once the output ends
+#The command is killed when the caller stops iterating early (break, or the task is cancelled)
+async def stream_command(command, timeout=None, success_codes=SUCCESS_CODES):
+    command = [str(c) for c in command]
+    print(' '.join(command))
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    try:
+        process = await _start(command)
+    except CommandError:
+        metrics.count("command_failures_total", program=command_name(command), reason="start")
+        raise
+    deadline = None if timeout is None else start + timeout
+    tail = deque(maxlen=ERROR_TAIL)
+
+    #Run `awaitable` with whatever is left of the timeout
+    async def within_deadline(awaitable):
+        remaining = None if deadline is None else max(deadline - loop.time(), 0)
+        try:
+            return await asyncio.wait_for(awaitable, remaining)
+        except asyncio.TimeoutError:
+            raise CommandTimeoutError(command, f"timed out after {timeout} seconds", output=list(tail)) from None
+
+    try:
+        while True:
+            try:
+                line = await within_deadline(process.stdout.readline())
+            except ValueError:
+                raise CommandFailedError(command, f"output line longer than {LINE_LIMIT} bytes", output=list(tail)) from None
+            if not line:
+                break
+
+            line = line.decode("utf-8", "replace").rstrip("\r\n")
+            tail.append(line)
+            yield line
+
+        returncode = await within_deadline(process.wait())
+        if returncode not in success_codes:
+            raise CommandFailedError(command, f"exited with code {returncode}", returncode, list(tail))
+    except CommandTimeoutError:
+        metrics.count("command_failures_total", program=command_name(command), reason="timeout")
+        raise
+    except CommandFailedError:
+        metrics.count("command_failures_total", program=command_name(command), reason="exit")
+        raise
+    finally:
+        if process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            await process.wait()
+        metrics.observe("command_seconds", loop.time() - start, program=command_name(command))
+
+#Run a command and return its output, in the same form as run_command
+#Unlike run_command, failures raise a CommandError instead of returning None
+async def run_command_async(command, timeout=None, success_codes=SUCCESS_CODES):
+    lines = [line async for line in stream_command(command, timeout, success_codes)]
+    return "\n".join(lines).strip()
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+
+# Decoder for Bambu Lab RFID tag dumps
+# Created for https://github.com/Bambu-Research-Group/RFID-Tag-Guide
+#
+# Decodes the block layout documented in docs/BambuLabRfid.md from a 1 KB MIFARE Classic dump,
+# either a raw .bin dump or a Proxmark3 "mfc v2" .json dump.
+# The dump is kept as a memoryview and every field is decoded only when it is accessed.
+
+import json
+import struct
+from datetime import datetime
+
+BLOCK_SIZE = 16
+BLOCKS_PER_SECTOR = 4
+SECTORS = 16
+DUMP_SIZE = BLOCK_SIZE * BLOCKS_PER_SECTOR * SECTORS
+
+# Precompiled layouts of the data blocks (all numbers are Little Endian)
+BLOCK0 = struct.Struct("<4s12s")          # UID, manufacturer data
+BLOCK1 = struct.Struct("<8s8s")           # Material variant ID, material ID
+STRING = struct.Struct("<16s")            # Blocks 2, 4, 12 and 13
+BLOCK5 = struct.Struct("<4sH2xf4x")       # Color (RGBA), spool weight, filament diameter
+BLOCK6 = struct.Struct("<6H4x")           # Drying temp/time, bed temp type, bed temp, max/min hotend temp
+BLOCK8 = struct.Struct("<12sf")           # X Cam info, nozzle diameter
+WIDTH_OR_LENGTH = struct.Struct("<4xH10x")  # Blocks 10 (spool width) and 14 (filament length)
+BLOCK16 = struct.Struct("<HH4s8x")        # Format identifier, color count, second color (ABGR)
+TRAILER = struct.Struct("<6s4s6s")        # Key A, access bits, key B
+
+ACCESS_BITS = bytes.fromhex("87878769")  # Access bits (and general purpose byte) of every sector trailer
+
+FORMAT_EMPTY = 0x0000
+FORMAT_COLOR_INFO = 0x0002
+
+def _string(raw):
+    return raw.split(b"\0", 1)[0].decode("ascii", "replace")
+
+# A decoded Bambu Lab tag
+# Fields are decoded from the underlying buffer every time they are accessed, and raw fields are
+# returned as memoryview slices of it, so creating a BambuTag never copies the dump
+class BambuTag:
+    __slots__ = ("_buf",)
+
+    def __init__(self, data):
+        buf = memoryview(data)
+        if buf.ndim != 1 or buf.itemsize != 1:
+            buf = buf.cast("B")
+        if len(buf) < DUMP_SIZE:
+            raise ValueError(f"Dump is {len(buf)} bytes, expected {DUMP_SIZE}")
+        self._buf = buf
+
+    def __repr__(self):
+        return f"<BambuTag {self.uid} {self.detailed_filament_type} #{self.color}>"
+
+    #Raw contents of a block
+    def block(self, block):
+        offset = block * BLOCK_SIZE
+        return self._buf[offset:offset+BLOCK_SIZE]
+
+    #Key A, access bits and key B from a sector trailer
+    def trailer(self, sector):
+        return TRAILER.unpack_from(self._buf, (sector * BLOCKS_PER_SECTOR + 3) * BLOCK_SIZE)
+
+    # Block 0
+    @property
+    def uid(self):
+        return BLOCK0.unpack_from(self._buf, 0)[0].hex().upper()
+
+    @property
+    def manufacturer_data(self):
+        return self._buf[4:16]
+
+    # Block 1
+    @property
+    def material_variant_id(self):
+        return _string(BLOCK1.unpack_from(self._buf, 1 * BLOCK_SIZE)[0])
+
+    @property
+    def material_id(self):
+        return _string(BLOCK1.unpack_from(self._buf, 1 * BLOCK_SIZE)[1])
+
+    # Block 2
+    @property
+    def filament_type(self):
+        return _string(STRING.unpack_from(self._buf, 2 * BLOCK_SIZE)[0])
+
+    # Block 4
+    @property
+    def detailed_filament_type(self):
+        return _string(STRING.unpack_from(self._buf, 4 * BLOCK_SIZE)[0])
+
+    # Block 5
+    @property
+    def color(self):
+        return BLOCK5.unpack_from(self._buf, 5 * BLOCK_SIZE)[0].hex().upper()
+
+    @property
+    def spool_weight(self):
+        return BLOCK5.unpack_from(self._buf, 5 * BLOCK_SIZE)[1]
+
+    @property
+    def filament_diameter(self):
+        return round(BLOCK5.unpack_from(self._buf, 5 * BLOCK_SIZE)[2], 3)
+
+    # Block 6
+    @property
+    def temperatures(self):
+        return BLOCK6.unpack_from(self._buf, 6 * BLOCK_SIZE)
+
+    @property
+    def drying_temperature(self):
+        return self.temperatures[0]
+
+    @property
+    def drying_time(self):
+        return self.temperatures[1]
+
+    @property
+    def bed_temperature_type(self):
+        return self.temperatures[2]
+
+    @property
+    def bed_temperature(self):
+        return self.temperatures[3]
+
+    @property
+    def max_hotend_temperature(self):
+        return self.temperatures[4]
+
+    @property
+    def min_hotend_temperature(self):
+        return self.temperatures[5]
+
+    # Block 8
+    @property
+    def xcam_info(self):
+        return self._buf[8 * BLOCK_SIZE:8 * BLOCK_SIZE + 12]
+
+    @property
+    def nozzle_diameter(self):
+        return round(BLOCK8.unpack_from(self._buf, 8 * BLOCK_SIZE)[1], 3)
+
+    # Block 9
+    @property
+    def tray_uid(self):
+        return self.block(9).hex().upper()
+
+    # Block 10
+    @property
+    def spool_width(self):
+        return WIDTH_OR_LENGTH.unpack_from(self._buf, 10 * BLOCK_SIZE)[0] / 100
+
+    # Block 12
+    @property
+    def production_date(self):
+        try:
+            return datetime.strptime(_string(STRING.unpack_from(self._buf, 12 * BLOCK_SIZE)[0]), "%Y_%m_%d_%H_%M")
+        except ValueError:
+            return None
+
+    # Block 13
+    @property
+    def short_production_date(self):
+        return _string(STRING.unpack_from(self._buf, 13 * BLOCK_SIZE)[0])
+
+    # Block 14
+    @property
+    def filament_length(self):
+        return WIDTH_OR_LENGTH.unpack_from(self._buf, 14 * BLOCK_SIZE)[0]
+
+    # Block 16
+    @property
+    def color_count(self):
+        format_id, count, _ = BLOCK16.unpack_from(self._buf, 16 * BLOCK_SIZE)
+        return count if format_id == FORMAT_COLOR_INFO else 1
+
+    @property
+    def second_color(self):
+        format_id, count, abgr = BLOCK16.unpack_from(self._buf, 16 * BLOCK_SIZE)
+        if format_id != FORMAT_COLOR_INFO or count < 2:
+            return None
+        return abgr[::-1].hex().upper()
+
+    #All decoded filament fields as a dict, e.g. for JSON output
+    def to_dict(self):
+        production_date = self.production_date
+        return {
+            "uid": self.uid,
+            "material_variant_id": self.material_variant_id,
+            "material_id": self.material_id,
+            "filament_type": self.filament_type,
+            "detailed_filament_type": self.detailed_filament_type,
+            "color": self.color,
+            "second_color": self.second_color,
+            "color_count": self.color_count,
+            "spool_weight": self.spool_weight,
+            "filament_diameter": self.filament_diameter,
+            "filament_length": self.filament_length,
+            "drying_temperature": self.drying_temperature,
+            "drying_time": self.drying_time,
+            "bed_temperature_type": self.bed_temperature_type,
+            "bed_temperature": self.bed_temperature,
+            "max_hotend_temperature": self.max_hotend_temperature,
+            "min_hotend_temperature": self.min_hotend_temperature,
+            "xcam_info": bytes(self.xcam_info).hex().upper(),
+            "nozzle_diameter": self.nozzle_diameter,
+            "spool_width": self.spool_width,
+            "tray_uid": self.tray_uid,
+            "production_date": production_date.isoformat() if production_date else None,
+            "short_production_date": self.short_production_date,
+        }
+
+#Parse a Proxmark3 "mfc v2" JSON dump, returns the document and its blocks as a dict of block -> 16 bytes
+#Raises ValueError if the dump is malformed. Blocks past the 1 KB dump (e.g. of a 4K tag) are left out
+def json_blocks(text):
+    dump = json.loads(text)
+    if not isinstance(dump, dict):
+        raise ValueError(f"Not a Proxmark3 JSON dump (not a JSON object but {type(dump).__name__})")
+    blocks = dump.get("blocks")
+    if not isinstance(blocks, dict):
+        raise ValueError("Not a Proxmark3 JSON dump (no blocks)")
+
+    parsed = {}
+    for block, value in blocks.items():
+        try:
+            block = int(block)
+        except ValueError:
+            raise ValueError(f"Invalid block number {block!r} in Proxmark3 JSON dump")
+        if block < 0:
+            raise ValueError(f"Invalid block number {block} in Proxmark3 JSON dump")
+        if not isinstance(value, str):
+            raise ValueError(f"Block {block} of Proxmark3 JSON dump is not a hex string but {type(value).__name__}")
+        value = bytes.fromhex(value)
+        if len(value) != BLOCK_SIZE:
+            raise ValueError(f"Block {block} of Proxmark3 JSON dump has {len(value)} bytes instead of {BLOCK_SIZE}")
+        if block * BLOCK_SIZE < DUMP_SIZE:
+            parsed[block] = value
+    return dump, parsed
+
+#Convert the contents of a Proxmark3 "mfc v2" JSON dump to the raw 1 KB dump
+def json_to_bin(text):
+    data = bytearray(DUMP_SIZE)
+    for block, value in json_blocks(text)[1].items():
+        data[block * BLOCK_SIZE:(block + 1) * BLOCK_SIZE] = value
+    return data
+
+#Convert a raw 1 KB image to a Proxmark3 "mfc v2" JSON dump (the inverse of json_to_bin)
+def bin_to_json(data):
+    data = bytes(data)
+    blocks = {str(block): data[block * BLOCK_SIZE:(block + 1) * BLOCK_SIZE].hex().upper() for block in range(len(data) // BLOCK_SIZE)}
+
+    sector_keys = {}
+    for sector in range(SECTORS):
+        trailer = data[(sector * BLOCKS_PER_SECTOR + 3) * BLOCK_SIZE:(sector + 1) * BLOCKS_PER_SECTOR * BLOCK_SIZE]
+        sector_keys[str(sector)] = {
+            "KeyA": trailer[0:6].hex().upper(),
+            "KeyB": trailer[10:16].hex().upper(),
+            "AccessConditions": trailer[6:10].hex().upper(),
+        }
+
+    return json.dumps({
+        "Created": "RFID-Tag-Guide",
+        "FileType": "mfc v2",
+        "Card": {"UID": data[0:4].hex().upper(), "ATQA": data[6:8].hex().upper(), "SAK": data[5:6].hex().upper()},
+        "blocks": blocks,
+        "SectorKeys": sector_keys,
+    }, indent=2)
+
+#Decode a dump given as raw bytes (any bytes-like object, which is not copied)
+def decode(data):
+    return BambuTag(data)
+
+#Load and decode a dump file, either a raw .bin dump or a Proxmark3 .json dump
+def load_dump(path):
+    path = str(path)
+    with open(path, "rb") as fp:
+        data = fp.read()
+
+    if path.lower().endswith(".json") or data[:1] == b"{":
+        return BambuTag(json_to_bin(data))
+    return BambuTag(data)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+# Pure Python implementation of the MIFARE Classic Crypto1 cipher
+# Created for https://github.com/Bambu-Research-Group/RFID-Tag-Guide
+#
+# Follows the structure (and bit ordering) of crapto1 by bla, as used by the Proxmark3 client:
+# the 48 bit LFSR is kept as two 24 bit halves holding the odd and even bits
+
+LF_POLY_ODD = 0x29CE5C
+LF_POLY_EVEN = 0x870804
+
+def bit(x, n):
+    return x >> n & 1
+
+#Bit n of a 32 bit word, counting bits in the order they are sent over the air
+def bebit(x, n):
+    return x >> (n ^ 24) & 1
+
+def evenparity32(x):
+    return bin(x).count("1") & 1
+
+#Nonlinear filter function, takes its 20 inputs from the odd half of the LFSR
+def filter(x):
+    f  = 0xf22c0 >> (x       & 0xf) & 16
+    f |= 0x6c9c0 >> (x >>  4 & 0xf) &  8
+    f |= 0x3c8b0 >> (x >>  8 & 0xf) &  4
+    f |= 0x1e458 >> (x >> 12 & 0xf) &  2
+    f |= 0x0d938 >> (x >> 16 & 0xf) &  1
+    return bit(0xEC57E80A, f)
+
+#Convert a key given as an int, bytes or hex string to an int
+def key_to_int(key):
+    if isinstance(key, int):
+        return key
+    if isinstance(key, str):
+        return int(key, 16)
+    return int.from_bytes(key, "big")
+
+#Swap the byte order of a 32 bit word
+def swapendian(x):
+    x = (x >> 8 & 0xff00ff) | (x & 0xff00ff) << 8
+    return (x >> 16 | x << 16) & 0xffffffff
+
+#Clock the 16 bit tag PRNG n times, as used for the suc64/suc96 values of the handshake
+def prng_successor(x, n):
+    x = swapendian(x)
+    for _ in range(n):
+        x = x >> 1 | (x >> 16 ^ x >> 18 ^ x >> 19 ^ x >> 21) << 31 & 0xffffffff
+    return swapendian(x)
+
+class Crypto1:
+    __slots__ = ("odd", "even")
+
+    def __init__(self, key=0):
+        key = key_to_int(key)
+        self.odd = 0
+        self.even = 0
+        for i in range(47, 0, -2):
+            self.odd = self.odd << 1 | bit(key, (i - 1) ^ 7)
+            self.even = self.even << 1 | bit(key, i ^ 7)
+
+    #Return the 48 bit LFSR contents, which is the key right after initialization
+    def lfsr(self):
+        lfsr = 0
+        for i in range(23, -1, -1):
+            lfsr = lfsr << 1 | bit(self.odd, i ^ 3)
+            lfsr = lfsr << 1 | bit(self.even, i ^ 3)
+        return lfsr
+
+    #Clock the cipher once, feeding in `inp`. Returns the keystream bit
+    #If `encrypted` is set, the input is ciphertext and is decrypted before being fed back
+    def bit(self, inp, encrypted=False):
+        ret = filter(self.odd)
+
+        feedin = ret & bool(encrypted)
+        feedin ^= bool(inp)
+        feedin ^= evenparity32(LF_POLY_ODD & self.odd)
+        feedin ^= evenparity32(LF_POLY_EVEN & self.even)
+        self.even = (self.even << 1 | feedin) & 0xffffff
+
+        self.odd, self.even = self.even, self.odd
+        return ret
+
+    def byte(self, inp, encrypted=False):
+        ret = 0
+        for i in range(8):
+            ret |= self.bit(bit(inp, i), encrypted) << i
+        return ret
+
+    #Clock the cipher 32 times, returns the 32 bit keystream word
+    def word(self, inp, encrypted=False):
+        ret = 0
+        for i in range(32):
+            ret |= self.bit(bebit(inp, i), encrypted) << (i ^ 24)
+        return ret
+
+    #The keystream bit used to encrypt the parity of the byte that was just processed (no clocking)
+    def peek(self):
+        return filter(self.odd)
+
+    #Undo one call of bit() with the same arguments. Returns the keystream bit of that clock
+    def rollback_bit(self, inp, encrypted=False):
+        self.odd, self.even = self.even, self.odd
+        out = self.even & 1
+        self.even >>= 1
+        ret = filter(self.odd)
+        out ^= evenparity32(LF_POLY_EVEN & self.even)
+        out ^= evenparity32(LF_POLY_ODD & self.odd)
+        out ^= bool(inp)
+        out ^= ret & bool(encrypted)
+        self.even |= out << 23
+        return ret
+
+    #Undo one call of word() with the same arguments. Returns the keystream word
+    def rollback_word(self, inp, encrypted=False):
+        ret = 0
+        for i in range(31, -1, -1):
+            ret |= self.rollback_bit(bebit(inp, i), encrypted) << (i ^ 24)
+        return ret
+
+#Check if `key` is the key used by an authentication (see lib.trace.AuthRecord)
+#The key is correct if it turns the reader's answer {ar} into suc64(nt)
+def check_auth_key(key, uid, nt, nr_enc, ar_enc, nested=False):
+    state = Crypto1(key)
+    if nested:
+        #The tag nonce is encrypted as well, decrypt it while loading it
+        nt ^= state.word(uid ^ nt, True)
+    else:
+        state.word(uid ^ nt)
+    state.word(nr_enc, True)
+    return ar_enc ^ state.word(0) == prng_successor(nt, 64)
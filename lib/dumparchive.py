@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+
+# Deduplicated archive of tag dumps
+# Created for https://github.com/Bambu-Research-Group/RFID-Tag-Guide
+#
+# Most of a dump is shared with other dumps: empty blocks, the access bits of every trailer, and the
+# filament blocks of spools of the same product. The archive (a SQLite file) stores every distinct
+# 16 byte block once, with the block itself as its key, and every dump as its UID plus the list of
+# its block numbers (as varints, so common blocks, which get low numbers, take one or two bytes).
+# Sector keys that match the keys derived from the UID are blanked before the trailer is stored and
+# filled in again on export, so the trailers of every Bambu Lab tag are stored only once as well.
+# The blocks that are different on every tag (UID, tray UID and the RSA signature) would never be
+# shared, so they are stored with the dump itself instead, which saves a block number and an index entry.
+# Later dumps of the same tag point to the unique blocks of the first one instead of repeating them.
+
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from lib.bambu import BLOCK_SIZE, BLOCKS_PER_SECTOR, SECTORS, bin_to_json
+from lib.keycache import KeyCache
+from lib.validate import parse_dump
+
+FORMAT_VERSION = 1
+KEY_LENGTH = 6
+BLANK_KEY = bytes(KEY_LENGTH)
+CACHE_SIZE = 65536     #Blocks kept in memory to skip database lookups
+COMMIT_INTERVAL = 1000 #Dumps per transaction in add_many
+INLINE = 0             #Block number marking a block stored with the dump
+
+#Blocks that are unique to every tag: block 0 (UID), block 9 (tray UID) and the RSA signature in the data blocks of sectors 10-15
+UNIQUE_BLOCKS = frozenset([0, 9] + [sector * BLOCKS_PER_SECTOR + block for sector in range(10, SECTORS) for block in range(BLOCKS_PER_SECTOR - 1)])
+EMPTY_BLOCK = bytes(BLOCK_SIZE)
+
+def _pack_refs(ids):
+    out = bytearray()
+    for i in ids:
+        while i >= 0x80:
+            out.append(i & 0x7F | 0x80)
+            i >>= 7
+        out.append(i)
+    return bytes(out)
+
+def _unpack_refs(blob):
+    ids = []
+    value = shift = 0
+    for byte in blob:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            ids.append(value)
+            value = shift = 0
+    return ids
+
+#Bit of the `derived` mask that marks a blanked key A (key B is 16 bits higher)
+def _key_bit(sector, key_type):
+    return 1 << (sector + (SECTORS if key_type else 0))
+
+#Offset of key A or key B of a sector trailer in the dump
+def _key_offset(sector, key_type):
+    return (sector * BLOCKS_PER_SECTOR + BLOCKS_PER_SECTOR - 1) * BLOCK_SIZE + (BLOCK_SIZE - KEY_LENGTH if key_type else 0)
+
+#Read a dump file given as its name and contents, returns the raw dump
+#Raw .bin dumps are stored as they are (even if they are short), Proxmark3 JSON and Flipper .nfc dumps
+#are converted, with any block they don't have left empty
+def read_dump(name, data):
+    if name.lower().endswith(".bin"):
+        return bytes(data)
+    return bytes(parse_dump(name, data)[0])
+
+# Deduplicated dump archive, see above
+# - path: SQLite file, created if it doesn't exist
+# - key_cache: KeyCache used to derive the sector keys (one is created if not given)
+# Use as a context manager, or call close() yourself, so the last dumps are committed
+class DumpArchive:
+    def __init__(self, path, key_cache=None):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._keys = key_cache or KeyCache(1024)
+        self._block_ids = OrderedDict()   #Block -> number, for adding
+        self._blocks = OrderedDict()      #Number -> block, for reading
+
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        version = self._db.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, FORMAT_VERSION):
+            raise ValueError(f"{self.path} is a version {version} dump archive, expected version {FORMAT_VERSION}")
+        self._db.execute("CREATE TABLE IF NOT EXISTS blocks (id INTEGER PRIMARY KEY, data BLOB NOT NULL UNIQUE)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS dumps (id INTEGER PRIMARY KEY, uid TEXT NOT NULL, name TEXT, added REAL NOT NULL, derived INTEGER NOT NULL, refs BLOB NOT NULL, inline BLOB NOT NULL, shared INTEGER)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS dumps_uid ON dumps (uid)")
+        self._db.execute(f"PRAGMA user_version = {FORMAT_VERSION}")
+        self._db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    #Number of dumps (a UID dumped twice counts twice)
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM dumps").fetchone()[0]
+
+    def __contains__(self, uid):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM dumps WHERE uid = ?", (_uid(uid),)).fetchone() is not None
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.commit()
+                self._db.close()
+                self._db = None
+
+    def commit(self):
+        with self._lock:
+            self._db.commit()
+
+    #Add a raw dump (any whole number of blocks), returns its number in the archive
+    #Takes the same arguments as RollingArchive.add, so libnfc_dump can write into either
+    # - commit: commit right away, so the dump survives a crash (add_many commits in batches instead)
+    def add(self, name, data, commit=True):
+        data = bytearray(data)
+        if not data or len(data) % BLOCK_SIZE:
+            raise ValueError(f"Dump is {len(data)} bytes, expected a multiple of {BLOCK_SIZE}")
+        uid = data[0:4].hex().upper()
+
+        #Blank the keys that can be derived from the UID
+        derived = 0
+        keys = self._keys.get(uid)
+        for sector in range(SECTORS):
+            for key_type in (0, 1):
+                offset = _key_offset(sector, key_type)
+                if offset + KEY_LENGTH <= len(data) and data[offset:offset + KEY_LENGTH] == keys[key_type][sector]:
+                    data[offset:offset + KEY_LENGTH] = BLANK_KEY
+                    derived |= _key_bit(sector, key_type)
+
+        with self._lock:
+            refs = []
+            inline = []
+            for block in range(len(data) // BLOCK_SIZE):
+                value = bytes(data[block * BLOCK_SIZE:(block + 1) * BLOCK_SIZE])
+                if block in UNIQUE_BLOCKS and value != EMPTY_BLOCK:
+                    refs.append(INLINE)
+                    inline.append(value)
+                else:
+                    refs.append(self._block_id(value))
+            inline = b"".join(inline)
+
+            #Another dump of the same tag usually has the same unique blocks, which are then only stored once
+            shared = None
+            if inline:
+                row = self._db.execute("SELECT id FROM dumps WHERE uid = ? AND shared IS NULL AND inline = ? LIMIT 1", (uid, inline)).fetchone()
+                if row:
+                    shared = row[0]
+                    inline = b""
+
+            cursor = self._db.execute(
+                "INSERT INTO dumps (uid, name, added, derived, refs, inline, shared) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (uid, name, time.time(), derived, _pack_refs(refs), inline, shared),
+            )
+            if commit:
+                self._db.commit()
+            return cursor.lastrowid
+
+    #Add (name, data) pairs, committing every COMMIT_INTERVAL dumps, returns the number of dumps added
+    def add_many(self, dumps):
+        count = 0
+        try:
+            for name, data in dumps:
+                self.add(name, data, commit=False)
+                count += 1
+                if count % COMMIT_INTERVAL == 0:
+                    self.commit()
+        finally:
+            self.commit()
+        return count
+
+    #The most recent dump of a UID as raw bytes, raises KeyError if the UID isn't in the archive
+    def get(self, uid):
+        with self._lock:
+            row = self._db.execute("SELECT derived, refs, inline, shared FROM dumps WHERE uid = ? ORDER BY id DESC LIMIT 1", (_uid(uid),)).fetchone()
+            if row is None:
+                raise KeyError(uid)
+            return self._rebuild(_uid(uid), *row)
+
+    #Every dump of a UID as (number, name, added, data) tuples, oldest first
+    def history(self, uid):
+        with self._lock:
+            rows = self._db.execute("SELECT id, name, added, derived, refs, inline, shared FROM dumps WHERE uid = ? ORDER BY id", (_uid(uid),)).fetchall()
+            return [(number, name, added, self._rebuild(_uid(uid), *record)) for number, name, added, *record in rows]
+
+    #The distinct UIDs in the archive
+    def uids(self):
+        with self._lock:
+            return [uid for uid, in self._db.execute("SELECT DISTINCT uid FROM dumps ORDER BY uid")]
+
+    #Yield every dump as (number, uid, name, data), in the order they were added
+    #Dumps are read in pages, so exporting a large archive doesn't hold it in memory
+    def dumps(self, latest_only=False, page=1000):
+        last = 0
+        query = "SELECT id, uid, name, derived, refs, inline, shared FROM dumps WHERE id > ?"
+        if latest_only:
+            query += " AND id IN (SELECT MAX(id) FROM dumps GROUP BY uid)"
+        query += " ORDER BY id LIMIT ?"
+
+        while True:
+            with self._lock:
+                rows = self._db.execute(query, (last, page)).fetchall()
+                dumps = [(number, uid, name, self._rebuild(uid, *record)) for number, uid, name, *record in rows]
+            if not dumps:
+                return
+            yield from dumps
+            last = dumps[-1][0]
+
+    #Dump and block counts, and the number of bytes the dumps and blocks take up
+    def stats(self):
+        with self._lock:
+            dumps, ref_bytes, inline_bytes = self._db.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(refs)), 0), COALESCE(SUM(LENGTH(inline)), 0) FROM dumps").fetchone()
+            blocks = self._db.execute("SELECT COUNT(*) FROM blocks").fetchone()[0]
+        return {
+            "dumps": dumps,
+            "blocks": blocks,
+            "block_bytes": blocks * BLOCK_SIZE,
+            "ref_bytes": ref_bytes,
+            "inline_bytes": inline_bytes,
+        }
+
+    #Number of a block, adding it if it's new (the lock must be held)
+    def _block_id(self, block):
+        block_id = self._block_ids.get(block)
+        if block_id is None:
+            row = self._db.execute("SELECT id FROM blocks WHERE data = ?", (block,)).fetchone()
+            block_id = row[0] if row else self._db.execute("INSERT INTO blocks (data) VALUES (?)", (block,)).lastrowid
+        _remember(self._block_ids, block, block_id)
+        return block_id
+
+    #Rebuild a dump from its block numbers and restore its derived keys (the lock must be held)
+    def _rebuild(self, uid, derived, refs, inline, shared):
+        refs = _unpack_refs(refs)
+        blocks = {}
+        missing = []
+        for block_id in set(refs):
+            if block_id == INLINE:
+                continue
+            block = self._blocks.get(block_id)
+            if block is None:
+                missing.append(block_id)
+            else:
+                blocks[block_id] = block
+                self._blocks.move_to_end(block_id)
+
+        for start in range(0, len(missing), 500):
+            chunk = missing[start:start + 500]
+            for block_id, block in self._db.execute(f"SELECT id, data FROM blocks WHERE id IN ({','.join('?' * len(chunk))})", chunk):
+                blocks[block_id] = block
+                _remember(self._blocks, block_id, block)
+
+        if shared is not None:
+            inline = self._db.execute("SELECT inline FROM dumps WHERE id = ?", (shared,)).fetchone()[0]
+        literals = iter([inline[offset:offset + BLOCK_SIZE] for offset in range(0, len(inline), BLOCK_SIZE)])
+        data = bytearray(b"".join(next(literals) if block_id == INLINE else blocks[block_id] for block_id in refs))
+        if derived:
+            keys = self._keys.get(uid)
+            for sector in range(SECTORS):
+                for key_type in (0, 1):
+                    if derived & _key_bit(sector, key_type):
+                        offset = _key_offset(sector, key_type)
+                        data[offset:offset + KEY_LENGTH] = keys[key_type][sector]
+        return bytes(data)
+
+def _uid(uid):
+    if isinstance(uid, (bytes, bytearray)):
+        return bytes(uid).hex().upper()
+    return uid.replace(" ", "").upper()
+
+#Add to a bounded (least recently used) cache
+def _remember(cache, key, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > CACHE_SIZE:
+        cache.popitem(last=False)
+
+#Convert a raw dump to the given export format ("bin" or "json")
+def export_dump(data, fmt):
+    if fmt == "json":
+        return bin_to_json(data).encode()
+    return data
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+# Encoder for Bambu Lab RFID tag images
+# Created for https://github.com/Bambu-Research-Group/RFID-Tag-Guide
+# Requires: numpy, pycryptodome
+#
+# The inverse of lib/bambu.py: builds complete 1 KB MIFARE Classic images (with the sector
+# trailers keyed for the target UID) from filament parameters. Specs use the same field names
+# as BambuTag.to_dict(), so a decoded tag can be encoded again.
+# encode_batch works a column at a time on one preallocated (count, 1024) array, so thousands of
+# images only cost a handful of NumPy operations per field, plus the key derivation.
+
+import os
+import struct
+from datetime import datetime
+
+import numpy as np
+
+from lib.bambu import BLOCK_SIZE, BLOCKS_PER_SECTOR, SECTORS, DUMP_SIZE, FORMAT_COLOR_INFO, ACCESS_BITS, bin_to_json
+
+SAK = 0x08
+ATQA = bytes.fromhex("0400")
+
+# Spec field -> (offset in the image, NumPy dtype, default)
+# Strings are stored NUL padded; "V" fields are raw bytes given as hex strings
+FIELDS = {
+    "material_variant_id":    (1 * BLOCK_SIZE,      "S8",  ""),
+    "material_id":            (1 * BLOCK_SIZE + 8,  "S8",  ""),
+    "filament_type":          (2 * BLOCK_SIZE,      "S16", ""),
+    "detailed_filament_type": (4 * BLOCK_SIZE,      "S16", ""),
+    "color":                  (5 * BLOCK_SIZE,      "V4",  "000000FF"),
+    "spool_weight":           (5 * BLOCK_SIZE + 4,  "<u2", 0),
+    "filament_diameter":      (5 * BLOCK_SIZE + 8,  "<f4", 1.75),
+    "drying_temperature":     (6 * BLOCK_SIZE,      "<u2", 0),
+    "drying_time":            (6 * BLOCK_SIZE + 2,  "<u2", 0),
+    "bed_temperature_type":   (6 * BLOCK_SIZE + 4,  "<u2", 0),
+    "bed_temperature":        (6 * BLOCK_SIZE + 6,  "<u2", 0),
+    "max_hotend_temperature": (6 * BLOCK_SIZE + 8,  "<u2", 0),
+    "min_hotend_temperature": (6 * BLOCK_SIZE + 10, "<u2", 0),
+    "xcam_info":              (8 * BLOCK_SIZE,      "V12", ""),
+    "nozzle_diameter":        (8 * BLOCK_SIZE + 12, "<f4", 0.2),
+    "tray_uid":               (9 * BLOCK_SIZE,      "V16", ""),
+    "spool_width":            (10 * BLOCK_SIZE + 4, "<u2", 0),     # mm, stored as mm*100
+    "production_date":        (12 * BLOCK_SIZE,     "S16", ""),
+    "short_production_date":  (13 * BLOCK_SIZE,     "S16", ""),
+    "filament_length":        (14 * BLOCK_SIZE + 4, "<u2", 0),
+}
+
+#Convert a specs table (a list of dicts, or a dict of columns) to a dict of columns
+def _columns(specs):
+    if isinstance(specs, dict):
+        return specs
+    names = set().union(*specs) if specs else set()
+    return {name: [spec.get(name) for spec in specs] for name in names}
+
+#Column values of a field, with missing values replaced by the default
+def _column(columns, name, count, default):
+    values = columns.get(name)
+    if values is None:
+        return [default] * count
+    if isinstance(values, (str, bytes, int, float)):
+        return [values] * count
+    return [default if value is None or value == "" else value for value in values]
+
+def _color(value):
+    value = value.lstrip("#")
+    return value + "FF" if len(value) == 6 else value
+
+def _production_date(value):
+    if isinstance(value, str):
+        if not value or "_" in value:
+            return value
+        value = datetime.fromisoformat(value)
+    return value.strftime("%Y_%m_%d_%H_%M")
+
+#Turn a column of values into a (count, size) uint8 array in the layout of the field
+def _field_bytes(name, values, dtype):
+    count = len(values)
+    if name == "color":
+        values = [_color(value) for value in values]
+    elif name == "spool_width":
+        values = [round(float(value) * 100) for value in values]
+    elif name == "production_date":
+        values = [_production_date(value) for value in values]
+
+    if dtype.startswith("V"):
+        size = int(dtype[1:])
+        raw = b"".join(bytes.fromhex(value).ljust(size, b"\0")[:size] for value in values)
+        return np.frombuffer(raw, np.uint8).reshape(count, size)
+
+    array = np.asarray(values, dtype=dtype)
+    return array.view(np.uint8).reshape(count, array.dtype.itemsize)
+
+#UIDs given as hex strings or bytes, as a (count, 4) uint8 array
+def uid_array(uids):
+    raw = b"".join(bytes.fromhex(uid) if isinstance(uid, str) else bytes(uid) for uid in uids)
+    if len(raw) != 4 * len(uids):
+        raise ValueError("Every UID must be 4 bytes")
+    return np.frombuffer(raw, np.uint8).reshape(len(uids), 4)
+
+#Sector keys for every UID as a (count, 2, 16, 6) uint8 array of [key A, key B]
+def derive_keys(uids, jobs=1):
+    #Imported here so the encoder can be used without pycryptodome when keys are given
+    from deriveKeys import derive_batch
+
+    hex_uids = [uid if isinstance(uid, str) else bytes(uid).hex() for uid in uids]
+    keys = np.empty((len(uids), 2, SECTORS, 6), np.uint8)
+    for row, (uid, uid_keys, error) in enumerate(derive_batch(hex_uids, jobs)):
+        if error:
+            raise ValueError(f"Invalid UID {uid}: {error}")
+        keys[row] = np.frombuffer(b"".join(uid_keys[0] + uid_keys[1]), np.uint8).reshape(2, SECTORS, 6)
+    return keys
+
+#Build the images of many tags at once
+# - specs: a list of dicts, or a dict of columns (lists or arrays), using the field names of
+#   BambuTag.to_dict(). Missing fields get their default
+# - uids: the UID of every tag, as hex strings or bytes (the "uid" field of the specs by default)
+# - out: optional preallocated (count, 1024) uint8 array to build the images in
+# - keys: optional (count, 2, 16, 6) array of sector keys, derived from the UIDs by default
+# - manufacturer_data: the 8 bytes following SAK and ATQA in block 0, as hex
+#Returns the (count, 1024) uint8 array of images
+def encode_batch(specs, uids=None, out=None, keys=None, jobs=1, manufacturer_data="00" * 8):
+    columns = _columns(specs)
+    if uids is None:
+        uids = columns.get("uid")
+        if uids is None:
+            raise ValueError("No UIDs given")
+    count = len(uids)
+
+    if out is None:
+        out = np.zeros((count, DUMP_SIZE), np.uint8)
+    else:
+        if out.shape[0] < count or out.shape[1] != DUMP_SIZE or out.dtype != np.uint8:
+            raise ValueError(f"Output buffer must be a uint8 array of at least ({count}, {DUMP_SIZE})")
+        out = out[:count]
+        out[:] = 0
+    if count == 0:
+        return out
+
+    #Block 0: UID, BCC, SAK, ATQA, manufacturer data
+    uid = uid_array(uids)
+    out[:, 0:4] = uid
+    out[:, 4] = np.bitwise_xor.reduce(uid, axis=1)
+    out[:, 5] = SAK
+    out[:, 6:8] = np.frombuffer(ATQA, np.uint8)
+    out[:, 8:16] = _field_bytes("manufacturer_data", _column(columns, "manufacturer_data", count, manufacturer_data), "V8")
+
+    for name, (offset, dtype, default) in FIELDS.items():
+        values = _field_bytes(name, _column(columns, name, count, default), dtype)
+        out[:, offset:offset + values.shape[1]] = values
+
+    #Block 16: second color, only for tags that have one
+    second = _column(columns, "second_color", count, None)
+    has_second = np.array([value is not None for value in second])
+    if has_second.any():
+        colors = _field_bytes("color", [value for value in second if value is not None], "V4")
+        block16 = out[has_second, 16 * BLOCK_SIZE:17 * BLOCK_SIZE]
+        block16[:, 0:4] = np.frombuffer(struct.pack("<HH", FORMAT_COLOR_INFO, 2), np.uint8)
+        block16[:, 4:8] = colors[:, ::-1]
+        counts = np.asarray(_column(columns, "color_count", count, 2), "<u2")[has_second]
+        block16[:, 2:4] = counts.view(np.uint8).reshape(-1, 2)
+        out[has_second, 16 * BLOCK_SIZE:17 * BLOCK_SIZE] = block16
+
+    #Sector trailers
+    if keys is None:
+        keys = derive_keys(uids, jobs)
+    trailers = out.reshape(count, SECTORS, BLOCKS_PER_SECTOR, BLOCK_SIZE)[:, :, BLOCKS_PER_SECTOR - 1]
+    trailers[:, :, 0:6] = keys[:, 0]
+    trailers[:, :, 6:10] = np.frombuffer(ACCESS_BITS, np.uint8)
+    trailers[:, :, 10:16] = keys[:, 1]
+
+    return out
+
+#Build the image of a single tag from a spec dict (e.g. BambuTag.to_dict()), returns bytes
+def encode(spec, uid=None, **kwargs):
+    return encode_batch([spec], [uid or spec["uid"]], **kwargs)[0].tobytes()
+
+#Write images built by encode_batch to `directory` as hf-mf-<UID>-dump.bin and/or .json
+#With "key" in `formats`, the Proxmark3 key file (hf-mf-<UID>-key.bin) is written as well
+#Returns the list of written paths
+def write_images(images, directory, formats=("bin",)):
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for image in images:
+        uid = image[0:4].tobytes().hex().upper()
+        base = os.path.join(directory, f"hf-mf-{uid}-dump")
+        if "key" in formats:
+            #Same layout as deriveKeys.keyfile_bytes: the 16 A keys, then the 16 B keys
+            trailers = image.reshape(SECTORS, BLOCKS_PER_SECTOR, BLOCK_SIZE)[:, BLOCKS_PER_SECTOR - 1]
+            keyfile = os.path.join(directory, f"hf-mf-{uid}-key.bin")
+            with open(keyfile, "wb") as fp:
+                fp.write(trailers[:, 0:6].tobytes() + trailers[:, 10:16].tobytes())
+            paths.append(keyfile)
+        if "bin" in formats:
+            image.tofile(base + ".bin")
+            paths.append(base + ".bin")
+        if "json" in formats:
+            with open(base + ".json", "w") as fp:
+                fp.write(bin_to_json(image.tobytes()))
+            paths.append(base + ".json")
+    return paths
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+# Columnar index over a directory of Bambu Lab tag dumps
+# Created for https://github.com/Bambu-Research-Group/RFID-Tag-Guide
+# Requires: numpy
+#
+# The index is a directory holding one NumPy array (.npy) per decoded field, plus the list of
+# indexed files. Queries memory-map the arrays, so they never touch the original dumps.
+# Rebuilding the index only decodes the files whose size or modification time changed.
+
+import os
+import json
+from datetime import datetime
+
+import numpy as np
+
+from lib.bambu import load_dump
+
+DUMP_EXTENSIONS = (".bin", ".json")
+FILES_NAME = "files.json"
+
+# Column name -> (dtype, function extracting the value from a BambuTag)
+COLUMNS = {
+    "uid":                    ("S20", lambda tag: tag.uid),
+    "material_id":            ("S8",  lambda tag: tag.material_id),
+    "material_variant_id":    ("S8",  lambda tag: tag.material_variant_id),
+    "filament_type":          ("S16", lambda tag: tag.filament_type),
+    "detailed_filament_type": ("S16", lambda tag: tag.detailed_filament_type),
+    "color":                  ("S8",  lambda tag: tag.color),
+    "spool_weight":           ("u2",  lambda tag: tag.spool_weight),
+    "filament_diameter":      ("f4",  lambda tag: tag.filament_diameter),
+    "filament_length":        ("u2",  lambda tag: tag.filament_length),
+    "drying_temperature":     ("u2",  lambda tag: tag.drying_temperature),
+    "drying_time":            ("u2",  lambda tag: tag.drying_time),
+    "bed_temperature":        ("u2",  lambda tag: tag.bed_temperature),
+    "min_hotend_temperature": ("u2",  lambda tag: tag.min_hotend_temperature),
+    "max_hotend_temperature": ("u2",  lambda tag: tag.max_hotend_temperature),
+    "nozzle_diameter":        ("f4",  lambda tag: tag.nozzle_diameter),
+    "production_date":        ("M8[m]", lambda tag: tag.production_date or "NaT"),
+}
+
+# Columns describing the indexed files themselves
+FILE_COLUMNS = {
+    "mtime": "i8",
+    "size": "i8",
+    "valid": "?",
+}
+
+#Yield the path of every dump file below `root`
+def find_dumps(root):
+    for entry in os.scandir(root):
+        if entry.is_dir(follow_symlinks=False):
+            if not entry.name.startswith("."):
+                yield from find_dumps(entry.path)
+        elif entry.name.lower().endswith(DUMP_EXTENSIONS):
+            yield entry.path
+
+#Decode one dump into a row of column values, or None if it isn't a valid dump
+#A file that can't be decoded, whatever is wrong with it, is skipped rather than ending the build
+def _decode_row(path):
+    try:
+        tag = load_dump(path)
+        #Convert to the column types here, a value that doesn't fit makes the whole file invalid
+        return [np.array(extract(tag), dtype)[()] for dtype, extract in COLUMNS.values()]
+    except (OSError, ValueError, KeyError, TypeError, AttributeError, IndexError, OverflowError, RecursionError):
+        return None
+
+#Build or update the index of every dump below `root`, saved in the `index` directory
+#Returns a tuple of (indexed file count, decoded file count)
+def build_index(root, index):
+    old_paths = []
+    old = {}
+    if os.path.exists(os.path.join(index, FILES_NAME)):
+        old = _load_columns(index, mmap=False)
+        with open(os.path.join(index, FILES_NAME)) as fp:
+            old_paths = json.load(fp)
+    old_rows = {path: row for row, path in enumerate(old_paths)}
+
+    paths = []
+    reused = []           #(new row, old row) of files that didn't change
+    decoded = []          #(new row, values) of files that were (re)decoded
+    stats = []
+
+    for path in find_dumps(root):
+        st = os.stat(path)
+        row = len(paths)
+        paths.append(os.path.relpath(path, root))
+        stats.append((st.st_mtime_ns, st.st_size))
+
+        old_row = old_rows.get(paths[-1])
+        if old_row is not None and old["mtime"][old_row] == st.st_mtime_ns and old["size"][old_row] == st.st_size:
+            reused.append((row, old_row))
+        else:
+            decoded.append((row, _decode_row(path)))
+
+    count = len(paths)
+    columns = {name: np.zeros(count, dtype) for name, (dtype, _) in COLUMNS.items()}
+    columns.update({name: np.zeros(count, dtype) for name, dtype in FILE_COLUMNS.items()})
+    columns["production_date"][:] = np.datetime64("NaT")
+
+    stats = np.array(stats, dtype="i8").reshape(count, 2)
+    columns["mtime"][:] = stats[:, 0]
+    columns["size"][:] = stats[:, 1]
+
+    #Copy the unchanged rows over from the old index in one go
+    if reused:
+        new_rows, old_rows = np.array(reused).T
+        for name in COLUMNS:
+            columns[name][new_rows] = old[name][old_rows]
+        columns["valid"][new_rows] = old["valid"][old_rows]
+
+    for row, values in decoded:
+        if values is None:
+            continue
+        for name, value in zip(COLUMNS, values):
+            columns[name][row] = value
+        columns["valid"][row] = True
+
+    _save_columns(index, columns, paths)
+    return count, len(decoded)
+
+def _save_columns(index, columns, paths):
+    os.makedirs(index, exist_ok=True)
+    #Write everything to temporary files first, so a crash never leaves a half written index
+    for name, values in columns.items():
+        np.save(os.path.join(index, f"{name}.tmp.npy"), values)
+    with open(os.path.join(index, f"{FILES_NAME}.tmp"), "w") as fp:
+        json.dump(paths, fp)
+
+    for name in columns:
+        os.replace(os.path.join(index, f"{name}.tmp.npy"), os.path.join(index, f"{name}.npy"))
+    os.replace(os.path.join(index, f"{FILES_NAME}.tmp"), os.path.join(index, FILES_NAME))
+
+def _load_columns(index, mmap=True):
+    columns = {}
+    for name in [*COLUMNS, *FILE_COLUMNS]:
+        columns[name] = np.load(os.path.join(index, f"{name}.npy"), mmap_mode="r" if mmap else None)
+    return columns
+
+#Convert a date given as a string (YYYY-MM-DD or ISO timestamp) or datetime to a numpy datetime
+def _to_datetime(value):
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return np.datetime64(value, "m")
+
+# Read-only view of an index built with build_index
+# The columns are memory-mapped, so opening an index is cheap no matter how many dumps it covers
+class DumpIndex:
+    def __init__(self, index):
+        self.index = index
+        self.columns = _load_columns(index)
+        self._paths = None
+
+    def __len__(self):
+        return len(self.columns["valid"])
+
+    @property
+    def paths(self):
+        #The file list is only needed to report matching files, so it is loaded on first use
+        if self._paths is None:
+            with open(os.path.join(self.index, FILES_NAME)) as fp:
+                self._paths = json.load(fp)
+        return self._paths
+
+    #Return a boolean mask of the dumps matching every given filter
+    # - material: detailed filament type (e.g. "PLA Basic"), filament_type: e.g. "PLA", material_id: e.g. "GFA00"
+    # - color: RGBA (or RGB) hex color
+    # - min_weight/max_weight: spool weight in grams
+    # - temperature: a hotend temperature (or (low, high) range) the filament must be printable at
+    # - produced_after/produced_before: production date limits
+    def query(self, material=None, filament_type=None, material_id=None, color=None,
+              min_weight=None, max_weight=None, temperature=None,
+              produced_after=None, produced_before=None):
+        c = self.columns
+        mask = np.array(c["valid"], dtype=bool)
+
+        if material is not None:
+            mask &= c["detailed_filament_type"] == material.encode()
+        if filament_type is not None:
+            mask &= c["filament_type"] == filament_type.encode()
+        if material_id is not None:
+            mask &= c["material_id"] == material_id.encode()
+        if color is not None:
+            color = color.lstrip("#").upper()
+            if len(color) == 6:
+                color += "FF"
+            mask &= c["color"] == color.encode()
+        if min_weight is not None:
+            mask &= c["spool_weight"] >= min_weight
+        if max_weight is not None:
+            mask &= c["spool_weight"] <= max_weight
+        if temperature is not None:
+            low, high = temperature if isinstance(temperature, (tuple, list)) else (temperature, temperature)
+            mask &= (c["max_hotend_temperature"] >= low) & (c["min_hotend_temperature"] <= high)
+        if produced_after is not None:
+            mask &= c["production_date"] >= _to_datetime(produced_after)
+        if produced_before is not None:
+            mask &= c["production_date"] <= _to_datetime(produced_before)
+
+        return mask
+
+    #Count the dumps in `mask` (all dumps if None) and sum their spool weight, grouped by a column
+    #Returns a dict mapping each value of the column to {"count": ..., "weight": ...}
+    def aggregate(self, by, mask=None):
+        if mask is None:
+            mask = np.array(self.columns["valid"], dtype=bool)
+
+        values = self.columns[by][mask]
+        weights = self.columns["spool_weight"][mask].astype("i8")
+        groups, inverse, counts = np.unique(values, return_inverse=True, return_counts=True)
+        totals = np.bincount(inverse.ravel(), weights=weights, minlength=len(groups))
+
+        return {
+            _to_python(group): {"count": int(count), "weight": int(total)}
+            for group, count, total in zip(groups, counts, totals)
+        }
+
+    #Decoded fields of every row in `mask`, as dicts
+    def rows(self, mask):
+        for row in np.flatnonzero(mask):
+            yield {"path": self.paths[row], **{name: _to_python(self.columns[name][row]) for name in COLUMNS}}
+
+def _to_python(value):
+    if isinstance(value, bytes):
+        return value.decode("ascii", "replace")
+    if isinstance(value, np.datetime64):
+        return None if np.isnat(value) else str(value)
+    if isinstance(value, np.floating):
+        return round(float(value), 3)
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+# Bounded cache for the per-UID sector keys derived by deriveKeys.kdf
+# Created for https://github.com/Bambu-Research-Group/RFID-Tag-Guide
+
+import sqlite3
+import threading
+from collections import OrderedDict
+
+SECTORS = 16
+KEY_LENGTH = 6
+
+#Normalize a UID given as bytes, a hex string or a hex bytestring (as pynfc returns it) to uppercase hex
+def normalize_uid(uid):
+    if isinstance(uid, (bytes, bytearray)):
+        try:
+            text = uid.decode("ascii")
+            bytes.fromhex(text)
+            return text.upper()
+        except (UnicodeDecodeError, ValueError):
+            return bytes(uid).hex().upper()
+    return str(uid).replace(" ", "").upper()
+
+#Pack a [keysA, keysB] pair into a 192 byte blob, in the same layout as a Proxmark3 keyfile
+def pack_keys(keys):
+    return b"".join(keys[0]) + b"".join(keys[1])
+
+#Unpack a 192 byte blob back into the [keysA, keysB] pair that kdf returns
+def unpack_keys(blob):
+    blob = bytes(blob)
+    half = SECTORS * KEY_LENGTH
+    return [
+        [blob[i:i+KEY_LENGTH] for i in range(0, half, KEY_LENGTH)],
+        [blob[i:i+KEY_LENGTH] for i in range(half, 2*half, KEY_LENGTH)],
+    ]
+
+# Cache in front of deriveKeys.kdf
+# - size: maximum number of UIDs kept in memory (least recently used are evicted first)
+# - path: optional SQLite database that keeps derived keys across runs
+# - derive: key derivation function, defaults to deriveKeys.kdf
+# Lookups return the same [keysA, keysB] structure as kdf
+class KeyCache:
+    def __init__(self, size=1024, path=None, derive=None):
+        if size < 1:
+            raise ValueError("Cache size must be at least 1")
+
+        self.size = size
+        self.path = path
+        self._derive = derive
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if path:
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS keys (uid TEXT PRIMARY KEY, keys BLOB NOT NULL)")
+            self._db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self._memory)
+
+    def __contains__(self, uid):
+        uid = normalize_uid(uid)
+        with self._lock:
+            if uid in self._memory:
+                return True
+            return self._load(uid) is not None
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    #Return the keys for `uid`, deriving (and storing) them only if neither the memory nor the disk store has them
+    def get(self, uid):
+        uid = normalize_uid(uid)
+
+        with self._lock:
+            blob = self._memory.get(uid)
+            if blob is not None:
+                self._memory.move_to_end(uid)
+                self.hits += 1
+                return unpack_keys(blob)
+
+            blob = self._load(uid)
+            if blob is not None:
+                self.disk_hits += 1
+                self._remember(uid, blob)
+                return unpack_keys(blob)
+
+            self.misses += 1
+
+        keys = self._kdf(bytes.fromhex(uid))
+        blob = pack_keys(keys)
+
+        with self._lock:
+            self._remember(uid, blob)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO keys (uid, keys) VALUES (?, ?)", (uid, blob))
+                self._db.commit()
+
+        return unpack_keys(blob)
+
+    #Drop every key from memory (the disk store is kept)
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+
+    def stats(self):
+        return {
+            "size": len(self._memory),
+            "max_size": self.size,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+        }
+
+    def _kdf(self, uid):
+        if self._derive is None:
+            from deriveKeys import kdf
+            self._derive = kdf
+        return self._derive(uid)
+
+    def _load(self, uid):
+        if self._db is None:
+            return None
+        row = self._db.execute("SELECT keys FROM keys WHERE uid = ?", (uid,)).fetchone()
+        return row[0] if row else None
+
+    def _remember(self, uid, blob):
+        self._memory[uid] = blob
+        self._memory.move_to_end(uid)
+        while len(self._memory) > self.size:
+            self._memory.popitem(last=False)
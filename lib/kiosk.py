@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+# Storage for long-running dumping stations
+# Created for https://github.com/Bambu-Research-Group/RFID-Tag-Guide
+#
+# A station that runs for weeks can't keep every UID and dump it has seen in memory.
+# UidStore keeps the set of dumped UIDs on disk, and RollingArchive streams the dumps into
+# a series of tar files instead of writing one small file per tag.
+
+import io
+import os
+import re
+import time
+import sqlite3
+import tarfile
+import threading
+from collections import OrderedDict
+
+# Persistent set of UIDs, backed by SQLite
+# With the default path (":memory:") nothing is kept between runs
+class UidStore:
+    def __init__(self, path=":memory:"):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        if self.path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS uids (uid TEXT PRIMARY KEY, added REAL NOT NULL)")
+        self._db.commit()
+
+    def __contains__(self, uid):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM uids WHERE uid = ?", (_key(uid),)).fetchone() is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM uids").fetchone()[0]
+
+    def add(self, uid):
+        with self._lock:
+            self._db.execute("INSERT OR IGNORE INTO uids (uid, added) VALUES (?, ?)", (_key(uid), time.time()))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+def _key(uid):
+    if isinstance(uid, (bytes, bytearray)):
+        uid = uid.decode("ascii", "replace")
+    return uid.upper()
+
+# Set that only remembers its `size` most recently added items
+class BoundedSet:
+    def __init__(self, size):
+        self.size = size
+        self._items = OrderedDict()
+
+    def __contains__(self, item):
+        return item in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, item):
+        self._items[item] = None
+        self._items.move_to_end(item)
+        while len(self._items) > self.size:
+            self._items.popitem(last=False)
+
+    def discard(self, item):
+        self._items.pop(item, None)
+
+# Writes files into <directory>/<prefix>-<number>.tar, starting a new tar file every `max_entries` files
+# Each tar file is flushed after every file, so a crash only loses the file being written
+class RollingArchive:
+    def __init__(self, directory, max_entries=10000, prefix="dumps"):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.prefix = prefix
+        self._tar = None
+        self._fp = None
+        self._entries = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        #Never append to an archive from an earlier run, it may have been cut short
+        pattern = re.compile(rf"^{re.escape(prefix)}-(\d+)\.tar$")
+        numbers = [int(m.group(1)) for m in map(pattern.match, os.listdir(directory)) if m]
+        self._number = max(numbers, default=0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def current_path(self):
+        return os.path.join(self.directory, f"{self.prefix}-{self._number:06d}.tar")
+
+    def add(self, name, data):
+        with self._lock:
+            if self._tar is None or self._entries >= self.max_entries:
+                self._rotate()
+
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            self._tar.addfile(info, io.BytesIO(data))
+            self._fp.flush()
+            self._entries += 1
+
+    def close(self):
+        with self._lock:
+            self._close_tar()
+
+    def _rotate(self):
+        self._close_tar()
+        self._number += 1
+        self._fp = open(self.current_path, "wb")
+        self._tar = tarfile.open(fileobj=self._fp, mode="w")
+        self._entries = 0
+
+    def _close_tar(self):
+        if self._tar is not None:
+            self._tar.close()
+            self._fp.close()
+            self._tar = None
+            self._fp = None
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+# Timers and counters for finding out where the time of a run goes
+# Created for https://github.com/Bambu-Research-Group/RFID-Tag-Guide
+#
+# Disabled unless the RFID_METRICS environment variable is set to a file name. Durations are then
+# aggregated into histograms and counts into counters, and written to that file when the program
+# exits: as Prometheus text if the name ends in .prom or .txt, as JSON otherwise ("-" for stderr).
+#   RFID_METRICS=metrics.json python3 traceKeyExtractor.py trace.trace
+# When disabled, timed() returns the function it decorates unchanged and timer() returns a shared
+# do-nothing context manager, so instrumented code runs as if it wasn't instrumented. Since timed()
+# decides when the function is defined, the variable has to be set before the program starts.
+# Only the main process exports; timings taken in worker processes are not collected.
+
+import os
+import sys
+import json
+import time
+import atexit
+import bisect
+import threading
+import functools
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+PROMETHEUS_PREFIX = "rfid_"
+
+enabled = False
+output = None
+
+_lock = threading.Lock()
+_histograms = {}     #(name, labels) -> _Histogram
+_counters = {}       #(name, labels) -> value
+
+class _Histogram:
+    __slots__ = ("buckets", "count", "sum", "min", "max")
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+#Record a duration (in seconds) in the histogram `name`
+def observe(name, seconds, **labels):
+    if not enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = _Histogram()
+        histogram.observe(seconds)
+
+#Add `value` to the counter `name`
+def count(name, value=1, **labels):
+    if not enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+class _Timer:
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+class _NoTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+_NO_TIMER = _NoTimer()
+
+#Context manager that records how long its block takes in the histogram `name`
+#   with metrics.timer("nfc_read_seconds"):
+#       ...
+def timer(name, **labels):
+    if not enabled:
+        return _NO_TIMER
+    return _Timer(name, labels)
+
+#Decorator that records how long every call of the function takes in the histogram `name`
+def timed(name, **labels):
+    def decorator(func):
+        if not enabled:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Timer(name, labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+#Everything recorded so far, as a JSON-compatible dict
+def snapshot():
+    with _lock:
+        histograms = {}
+        for (name, labels), h in sorted(_histograms.items()):
+            histograms.setdefault(name, []).append({
+                "labels": dict(labels),
+                "count": h.count,
+                "sum": h.sum,
+                "min": h.min,
+                "max": h.max,
+                "buckets": {str(bound): n for bound, n in zip(list(BUCKETS) + ["+Inf"], h.buckets)},
+            })
+        counters = {}
+        for (name, labels), value in sorted(_counters.items()):
+            counters.setdefault(name, []).append({"labels": dict(labels), "value": value})
+    return {"histograms": histograms, "counters": counters}
+
+def to_json():
+    return json.dumps(snapshot(), indent=2)
+
+def _prometheus_labels(labels, extra=None):
+    labels = list(labels) + ([extra] if extra else [])
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}={json.dumps(str(v))}' for k, v in labels) + "}"
+
+#Everything recorded so far, in the Prometheus text exposition format
+def to_prometheus():
+    lines = []
+    with _lock:
+        names = sorted(set(name for name, _ in _histograms))
+        for name in names:
+            metric = PROMETHEUS_PREFIX + name
+            lines.append(f"# TYPE {metric} histogram")
+            for (hname, labels), h in sorted(_histograms.items()):
+                if hname != name:
+                    continue
+                cumulative = 0
+                for bound, n in zip(list(BUCKETS) + ["+Inf"], h.buckets):
+                    cumulative += n
+                    lines.append(f"{metric}_bucket{_prometheus_labels(labels, ('le', bound))} {cumulative}")
+                lines.append(f"{metric}_sum{_prometheus_labels(labels)} {h.sum}")
+                lines.append(f"{metric}_count{_prometheus_labels(labels)} {h.count}")
+
+        names = sorted(set(name for name, _ in _counters))
+        for name in names:
+            metric = PROMETHEUS_PREFIX + name
+            lines.append(f"# TYPE {metric} counter")
+            for (cname, labels), value in sorted(_counters.items()):
+                if cname == name:
+                    lines.append(f"{metric}{_prometheus_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+#Write everything recorded so far to `path` ("-" for stderr), in the format its extension asks for
+def export(path):
+    text = to_prometheus() if str(path).lower().endswith((".prom", ".txt")) else to_json()
+    if path == "-":
+        sys.stderr.write(text)
+        return
+    with open(path, "w") as fp:
+        fp.write(text)
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+def _export_at_exit():
+    #Worker processes that were started by importing the main module run this too, only the main process exports
+    multiprocessing = sys.modules.get("multiprocessing")
+    if multiprocessing is not None and multiprocessing.current_process().name != "MainProcess":
+        return
+    try:
+        export(output)
+    except OSError as e:
+        print(f"Could not write metrics to {output}: {e}", file=sys.stderr)
+
+#Start recording, and export to `path` when the program exits (if given)
+#Functions decorated with timed() before this is called stay uninstrumented
+def enable(path=None):
+    global enabled, output
+    if path and output is None:
+        atexit.register(_export_at_exit)
+    enabled = True
+    output = path or output
+
+if os.environ.get("RFID_METRICS"):
+    enable(os.environ["RFID_METRICS"])
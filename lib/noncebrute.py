@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+
+# Key recovery for nested MIFARE Classic authentications, a Python counterpart of mf_nonce_brute
+# Created for https://github.com/Bambu-Research-Group/RFID-Tag-Guide
+# Requires: numpy
+#
+# In a nested authentication the tag nonce is encrypted, so it has to be guessed. Tags with the
+# weak 16 bit PRNG only have 65535 possible nonces, and the parity bits of {nt}, {ar} and {at}
+# rule out all but about 1 in 1000 of them without knowing the key.
+# For every remaining nonce, the reader answer gives 32 bits of keystream (ar ^ suc64(nt)),
+# from which the candidate LFSR states are recovered with NumPy: the odd and even halves of the
+# LFSR are built separately, one keystream bit at a time, and then joined on the feedback bits
+# they must agree on (the same approach as lfsr_recovery32 in crapto1).
+# The tag answer (at ^ suc96(nt)) then leaves a single state, which is rolled back to the key.
+# Nonces are tried in parallel over a process pool.
+
+import time
+from multiprocessing import Pool, TimeoutError as PoolTimeoutError
+
+import numpy as np
+
+from lib.crypto1 import Crypto1, LF_POLY_ODD, LF_POLY_EVEN, prng_successor, check_auth_key
+
+MASK24 = 0xFFFFFF
+ODD_PARITY8 = np.array([1 ^ bin(x).count("1") & 1 for x in range(256)], np.uint8)
+PARITY16 = None
+FILTER = None
+NONCES = None
+STOP_POLL_INTERVAL = 0.1    #Seconds between checks of the stop event while the pool is searching
+
+#Build the lookup tables on first use (once per process)
+def _tables():
+    global PARITY16, FILTER
+    if FILTER is None:
+        x = np.arange(1 << 16, dtype=np.uint32)
+        parity = np.zeros(1 << 16, np.uint32)
+        for n in range(16):
+            parity ^= x >> n & 1
+        PARITY16 = parity.astype(np.uint8)
+
+        #Output of the Crypto1 filter function for every possible 20 bit input
+        x = np.arange(1 << 20, dtype=np.uint32)
+        f  = np.right_shift(np.uint32(0xf22c0), x       & 0xf) & 16
+        f |= np.right_shift(np.uint32(0x6c9c0), x >>  4 & 0xf) &  8
+        f |= np.right_shift(np.uint32(0x3c8b0), x >>  8 & 0xf) &  4
+        f |= np.right_shift(np.uint32(0x1e458), x >> 12 & 0xf) &  2
+        f |= np.right_shift(np.uint32(0x0d938), x >> 16 & 0xf) &  1
+        FILTER = (np.right_shift(np.uint32(0xEC57E80A), f) & 1).astype(np.uint8)
+
+def _parity(x):
+    return PARITY16[x & 0xFFFF] ^ PARITY16[x >> 16]
+
+#Keystream bit produced by clock i of a 32 bit word (see Crypto1.word)
+def _ks_bit(word, i):
+    return word >> (i ^ 24) & 1
+
+#Grow a table of LFSR bit sequences by one bit, keeping the ones whose filter output matches `ks`
+#The newest bit is the lowest, and the filter looks at the newest 20 bits
+def _extend(sequences, ks):
+    shifted = sequences << np.uint64(1)
+    window = shifted.astype(np.uint32) & 0xFFFFF
+    return np.concatenate([shifted[FILTER[window] == ks], shifted[FILTER[window | 1] == ks] | np.uint64(1)])
+
+#Keystream bits 1, 3, 5, ... (odd=False) or 0, 2, 4, ... (odd=True) of `ks` grow one half of the
+#LFSR into a table of 24 + FEEDBACK_BITS bit sequences
+FEEDBACK_BITS = 11
+
+def _half(ks, odd):
+    first = 0 if odd else 1
+    sequences = np.flatnonzero(FILTER == _ks_bit(ks, first)).astype(np.uint64)
+    for i in range(first + 2, 32, 2):
+        sequences = _extend(sequences, _ks_bit(ks, i))
+    return sequences
+
+#Feedback terms of one half, for every bit after its first 24 (see recover_states)
+def _feedback_key(sequences, odd):
+    key = np.zeros(len(sequences), np.uint32)
+    for k in range(FEEDBACK_BITS):
+        previous = (sequences >> np.uint64(FEEDBACK_BITS - k) & np.uint64(MASK24)).astype(np.uint32)
+        current = (sequences >> np.uint64(FEEDBACK_BITS - 1 - k) & np.uint64(MASK24)).astype(np.uint32)
+        bit = current & 1
+        if odd:
+            key |= (bit ^ _parity(previous & LF_POLY_EVEN)).astype(np.uint32) << 2*k
+            key |= _parity(current & LF_POLY_ODD).astype(np.uint32) << 2*k + 1
+        else:
+            key |= _parity(previous & LF_POLY_ODD).astype(np.uint32) << 2*k
+            key |= (bit ^ _parity(previous & LF_POLY_EVEN)).astype(np.uint32) << 2*k + 1
+    return key
+
+#Recover every LFSR state that produces the 32 bit keystream `ks` with no input
+#The states are returned as (odd, even) arrays, 9 clocks after the start of the keystream
+#
+#The filter only looks at the odd register, which alternates between the two halves of the LFSR:
+#keystream bits 0, 2, 4, ... come from one half ("odd" here) and 1, 3, 5, ... from the other.
+#Each half is grown one bit per keystream bit on its own: the first 20 bits come from its first
+#keystream bit, every further keystream bit adds one. Bits after the first 24 are feedback bits,
+#which must match the feedback of both halves:
+#   new odd bit  = parity(even & POLY_ODD) ^ parity(odd & POLY_EVEN)
+#   new even bit = parity(odd' & POLY_ODD) ^ parity(even & POLY_EVEN)   (odd' = odd after its new bit)
+#Each half keeps its own terms of these equations in a key, and the halves are joined on equal keys.
+def recover_states(ks):
+    _tables()
+
+    odd = _half(ks, True)
+    even = _half(ks, False)
+    odd_key = _feedback_key(odd, True)
+    even_key = _feedback_key(even, False)
+
+    #Join both halves on their keys: sort the even half, then look up the range of every odd key
+    order = np.argsort(even_key)
+    counts = np.bincount(even_key, minlength=1 << 2*FEEDBACK_BITS)
+    starts = np.cumsum(counts) - counts
+    matches = counts[odd_key]
+    odd_rows = np.repeat(np.arange(len(odd_key)), matches)
+    first = np.repeat(starts[odd_key], matches)
+    even_rows = order[first + np.arange(len(first)) - np.repeat(np.cumsum(matches) - matches, matches)]
+
+    #9 clocks in, the filter register holds the first 24 bits of the even half, the other register
+    #the first 24 bits of the odd half
+    shift = np.uint64(FEEDBACK_BITS)
+    return (even[even_rows] >> shift).astype(np.uint32), (odd[odd_rows] >> shift).astype(np.uint32)
+
+#Clock arrays of states with no input, skipping `skip` keystream bits and then checking the
+#32 bit keystream `ks`. Returns the indices of the states that produce it
+def _check_keystream(odd, even, ks, skip=0):
+    rows = np.arange(len(odd))
+    for i in range(skip + 32):
+        if i >= skip:
+            keep = FILTER[odd & 0xFFFFF] == _ks_bit(ks, i - skip)
+            odd, even, rows = odd[keep], even[keep], rows[keep]
+            if not len(rows):
+                break
+        feedback = _parity(odd & LF_POLY_ODD) ^ _parity(even & LF_POLY_EVEN)
+        odd, even = (even << 1 | feedback) & MASK24, odd
+    return rows
+
+#Every possible nonce of the 16 bit tag PRNG, in PRNG order (so suc(n) of nonce i is nonce i+n)
+def prng_nonces():
+    global NONCES
+    if NONCES is not None:
+        return NONCES
+
+    bits = np.zeros(65535 + 32, np.uint8)
+    bits[0] = 1
+    for i in range(16, len(bits)):
+        bits[i] = bits[i - 16] ^ bits[i - 14] ^ bits[i - 13] ^ bits[i - 11]
+    windows = np.lib.stride_tricks.sliding_window_view(bits, 32)[:65535]
+    swapped = (windows.astype(np.uint64) << np.arange(32, dtype=np.uint64)).sum(axis=1).astype(np.uint32)
+    #Same byte swap as prng_successor
+    NONCES = swapped.byteswap()
+    return NONCES
+
+#Parity error bits (as in the mf_nonce_brute arguments) expected for an encrypted value,
+#given its plaintext and the keystream bit that follows each byte
+def _parity_errors(encrypted, plain, keystream, next_bit=None):
+    errors = []
+    for i in range(4):
+        shift = 24 - 8*i
+        error = ODD_PARITY8[encrypted >> shift & 0xFF] ^ ODD_PARITY8[plain >> shift & 0xFF]
+        if i < 3:
+            error = error ^ (keystream >> (16 - 8*i) & 1).astype(np.uint8)
+        elif next_bit is not None:
+            error = error ^ next_bit.astype(np.uint8)
+        else:
+            error = None
+        errors.append(error)
+    return errors
+
+#Tag nonces of a nested authentication that agree with the parity errors of {nt}, {ar} and {at}
+def nonce_candidates(nt_enc, nt_par_err, ar_enc, ar_par_err, at_enc, at_par_err):
+    _tables()
+    nonces = prng_nonces()
+    keep = np.ones(len(nonces), bool)
+
+    suc64 = np.roll(nonces, -64)
+    suc96 = np.roll(nonces, -96)
+    ks0 = nonces ^ np.uint32(nt_enc)
+    ks2 = suc64 ^ np.uint32(ar_enc)
+    ks3 = suc96 ^ np.uint32(at_enc)
+
+    checks = [
+        (nt_par_err, _parity_errors(np.uint32(nt_enc), nonces, ks0)),
+        (ar_par_err, _parity_errors(np.uint32(ar_enc), suc64, ks2, ks3 >> 24 & 1)),
+        (at_par_err, _parity_errors(np.uint32(at_enc), suc96, ks3)),
+    ]
+    for recorded, expected in checks:
+        if not recorded:
+            continue
+        for i, error in enumerate(expected):
+            if error is not None:
+                keep &= error == int(recorded[i])
+
+    return [int(nonce) for nonce in nonces[keep]]
+
+#Try one tag nonce: recover the key if the handshake can be explained by it, None otherwise
+def try_nonce(uid, nt, nt_enc, nr_enc, ar_enc, at_enc, nested=True):
+    ks2 = ar_enc ^ prng_successor(nt, 64)
+    ks3 = at_enc ^ prng_successor(nt, 96)
+
+    odd, even = recover_states(ks2)
+    #The states are 9 clocks into {ar}, check the rest of {ar} and {at}
+    rows = _check_keystream(odd, even, ks3, skip=32 - 9)
+
+    for o, e in zip(odd[rows].tolist(), even[rows].tolist()):
+        state = Crypto1()
+        state.odd, state.even = o, e
+        for i in range(8, -1, -1):
+            state.rollback_bit(0)
+        state.rollback_word(nr_enc, True)
+        ks0 = state.rollback_word(uid ^ nt)
+        key = state.lfsr()
+
+        if nested and ks0 != nt ^ nt_enc:
+            continue
+        if check_auth_key(key, uid, nt_enc if nested else nt, nr_enc, ar_enc, nested):
+            return key
+    return None
+
+def _try_nonce(args):
+    return try_nonce(*args)
+
+#Recover the key of an authentication. Takes the same values as mf_nonce_brute:
+#  uid, {nt}, nt parity errors, {nr}, {ar}, ar parity errors, {at}, at parity errors
+#(parity errors as strings of 4 "0"/"1", or None to skip that check)
+#For a plaintext authentication (nested=False), nt_enc is the plaintext tag nonce.
+#`stop` is an optional threading.Event: once it is set, the search ends and its processes are stopped
+#Returns the key as an int, or None if it wasn't found (or the timeout ran out, or it was stopped)
+def nonce_brute(uid, nt_enc, nt_par_err, nr_enc, ar_enc, ar_par_err, at_enc, at_par_err, nested=True, jobs=None, timeout=None, stop=None):
+    if not nested:
+        return try_nonce(uid, nt_enc, nt_enc, nr_enc, ar_enc, at_enc, False)
+
+    candidates = nonce_candidates(nt_enc, nt_par_err, ar_enc, ar_par_err, at_enc, at_par_err)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    work = [(uid, nt, nt_enc, nr_enc, ar_enc, at_enc, True) for nt in candidates]
+
+    if jobs == 1:
+        for args in work:
+            if stop is not None and stop.is_set():
+                return None
+            key = _try_nonce(args)
+            if key is not None or (deadline and time.monotonic() > deadline):
+                return key
+        return None
+
+    pool = Pool(jobs)
+    try:
+        results = pool.imap_unordered(_try_nonce, work)
+        done = 0
+        while done < len(work):
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return None
+            if stop is not None:
+                if stop.is_set():
+                    return None
+                remaining = STOP_POLL_INTERVAL if remaining is None else min(remaining, STOP_POLL_INTERVAL)
+            try:
+                key = results.next(remaining)
+            except PoolTimeoutError:
+                continue
+            done += 1
+            if key is not None:
+                return key
+        return None
+    finally:
+        pool.terminate()
+        pool.join()
+
+#nonce_brute with the command line arguments of mf_nonce_brute (as given by AuthRecord.brute_args())
+#Returns the key as a hex string, or "" if it wasn't found
+def nonce_brute_args(args, nested=True, jobs=None, timeout=None, stop=None):
+    uid, nt, nt_par_err, nr, ar, ar_par_err, at, at_par_err = args[:8]
+    key = nonce_brute(int(uid, 16), int(nt, 16), nt_par_err, int(nr, 16), int(ar, 16), ar_par_err,
+                      int(at, 16), at_par_err, nested, jobs, timeout, stop)
+    return "" if key is None else f"{key:012x}"
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+# Long-lived Proxmark3 client session
+# Created for https://github.com/Bambu-Research-Group/RFID-Tag-Guide
+#
+# Starting the pm3 client (and opening the serial port) takes a while, so instead of starting
+# a new client for every command, this keeps a single client running and feeds it commands
+# over stdin. When reading commands from stdin, the client echoes each one after its prompt
+# (e.g. "[usb|script] pm3 --> hf mf info"), which is where one reply ends and the next begins.
+# Every command is followed by a `rem` marker, so the end of a reply is known as soon as the
+# client reaches the marker, without waiting for the next command. A marker is also sent right
+# after starting the client, so its startup banner isn't taken as the reply to the first command.
+
+import os
+import re
+import queue
+import itertools
+import subprocess
+import threading
+
+from lib import metrics
+
+PROMPT_RE = re.compile(r"^(?:\x1B\[[0-9;]*m)*\[[^\]]*\] pm3 --> ?(.*)$")
+
+class Proxmark3Error(RuntimeError):
+    pass
+
+# A running pm3 client
+# - command: the client command line, e.g. [pm3Location / "bin/pm3"] or [pm3Location / "bin/pm3", "-o"]
+# - timeout: default time in seconds a command may take to reply
+# Use as a context manager, or call start() and close() yourself:
+#   with Proxmark3Session([pm3Location / pm3Command]) as pm3:
+#       output = pm3.command("hf mf info")
+class Proxmark3Session:
+    def __init__(self, command, timeout=30):
+        self.command_line = [str(c) for c in (command if isinstance(command, (list, tuple)) else [command])]
+        self.timeout = timeout
+        self.process = None
+        self._lines = queue.Queue()
+        self._reader = None
+        self._markers = itertools.count()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        if self.running:
+            return
+
+        print(' '.join(self.command_line))
+        try:
+            self.process = subprocess.Popen(
+                self.command_line,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                # On Windows, use the shell=True argument to run the command
+                shell=os.name == 'nt',
+                bufsize=1,
+                universal_newlines=True,
+                encoding="utf-8",
+                errors="replace",
+            )
+        except OSError as e:
+            raise Proxmark3Error(f"Could not start the Proxmark3 client: {e}")
+
+        self._lines = queue.Queue()
+        self._reader = threading.Thread(target=self._read_output, args=(self.process.stdout, self._lines), daemon=True)
+        self._reader.start()
+
+        try:
+            self.process.stdin.write(f"rem {self._marker()}\n")
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError):
+            pass  #The first command reports it
+
+    def _marker(self):
+        return f"pm3session-{os.getpid()}-{next(self._markers)}"
+
+    #Send a command and return its output, in the same form as lib.run_command
+    #Raises TimeoutError if the client doesn't finish the command in time (the session is closed,
+    #as the client is in an unknown state), and Proxmark3Error if the client exits
+    def command(self, command, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+
+        with self._lock:
+            if not self.running:
+                self.start()
+
+            with metrics.timer("pm3_command_seconds", command=" ".join(command.split()[:3])):
+                marker = self._marker()
+                print(f"pm3 --> {command}")
+                try:
+                    self.process.stdin.write(f"{command}\nrem {marker}\n")
+                    self.process.stdin.flush()
+                except (BrokenPipeError, OSError) as e:
+                    raise Proxmark3Error(f"The Proxmark3 client is not accepting commands: {e}")
+
+                output = []
+                while True:
+                    try:
+                        line = self._lines.get(timeout=timeout)
+                    except queue.Empty:
+                        self.close()
+                        raise TimeoutError(f"Command `{command}` timed out after {timeout} seconds")
+
+                    if line is None:
+                        raise Proxmark3Error(f"The Proxmark3 client exited while running `{command}`")
+
+                    if "pm3session-" in line:
+                        if marker in line:
+                            break
+                        output = []  #Everything so far came before an earlier marker (e.g. the startup banner)
+                        continue
+
+                    prompt = PROMPT_RE.match(line)
+                    if prompt:
+                        continue  #Echo of the command we just sent
+
+                    output.append(line)
+
+                return "\n".join(output).strip()
+
+    #Run several commands, returning their outputs as a list
+    def commands(self, commands, timeout=None):
+        return [self.command(c, timeout) for c in commands]
+
+    def close(self, timeout=5):
+        process = self.process
+        if process is None:
+            return
+        self.process = None
+
+        if process.poll() is None:
+            try:
+                process.stdin.write("quit\n")
+                process.stdin.flush()
+                process.stdin.close()
+            except (BrokenPipeError, OSError):
+                pass
+            try:
+                process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+    #Background thread: move every line of client output into the queue, None marks the end
+    @staticmethod
+    def _read_output(stream, lines):
+        for line in stream:
+            lines.put(line.rstrip("\r\n"))
+        lines.put(None)
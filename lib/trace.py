@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+
+# Reader for Proxmark3 binary trace files (as written by `trace save`)
+# Created for https://github.com/Bambu-Research-Group/RFID-Tag-Guide
+#
+# A trace file is a list of records, each laid out as:
+#   uint32 timestamp, uint16 duration, uint16 length (bit 15 set for tag responses),
+#   <length> bytes of frame data, followed by the frame's parity bits packed MSB first
+# All numbers are Little Endian (LE)
+
+import os
+import mmap
+import struct
+from collections import namedtuple
+
+from lib.crypto1 import Crypto1, check_auth_key
+
+HEADER = struct.Struct("<IHH")
+
+CMD_AUTH_A = 0x60
+CMD_AUTH_B = 0x61
+CMD_REQA = 0x26
+CMD_WUPA = 0x52
+CMD_HALT = bytes.fromhex("500057CD")
+CMD_READ = 0x30
+CMD_WRITE = 0xA0
+CASCADE_TAG = 0x88
+SELECT_CMDS = (0x93, 0x95, 0x97)
+
+# One frame of the trace, either from the reader or from the tag
+Frame = namedtuple("Frame", ["timestamp", "duration", "is_response", "data", "parity"])
+
+#Return the number of parity bytes stored after a frame of `length` bytes
+def parity_length(length):
+    return max(length - 1, 0) // 8 + 1
+
+#Get parity bit `n` out of the packed parity bytes
+def parity_bit(parity, n):
+    return parity[n // 8] >> (7 - n % 8) & 1
+
+def oddparity8(x):
+    return 1 ^ bin(x).count("1") & 1
+
+#ISO14443-A CRC (CRC_A)
+def crc_a(data):
+    crc = 0x6363
+    for b in data:
+        b ^= crc & 0xFF
+        b = (b ^ (b << 4)) & 0xFF
+        crc = (crc >> 8) ^ (b << 8) ^ (b << 3) ^ (b >> 4)
+    return bytes([crc & 0xFF, crc >> 8])
+
+def check_crc(data):
+    return len(data) > 2 and crc_a(data[:-2]) == bytes(data[-2:])
+
+#Return the binary "parity error" string that mf_nonce_brute expects for a 4 byte value
+#Each character is 1 when the recorded parity bit differs from the parity of the plaintext byte
+def parity_errors(value, parity, offset=0):
+    return "".join(str(oddparity8(value >> (24 - 8*i) & 0xFF) ^ parity_bit(parity, offset + i)) for i in range(4))
+
+# A single MIFARE Classic authentication, as recorded in the trace
+# - uid: UID of the selected tag (int), or None if the anticollision wasn't captured
+# - nested: True if the authentication happened inside an encrypted session, which means
+#           the command and the tag nonce are encrypted and key_type/block are unknown
+# - nt: tag nonce (encrypted for nested authentications), nr_enc/ar_enc/at_enc: the rest of the handshake
+# - *_par: raw parity bytes of the corresponding frame
+# - next_cmd: the (encrypted) reader command that followed the authentication, if any
+class AuthRecord(namedtuple("AuthRecord", [
+        "timestamp", "uid", "nested", "key_type", "block",
+        "nt", "nt_par", "nr_enc", "ar_enc", "nr_ar_par", "at_enc", "at_par", "next_cmd"])):
+    __slots__ = ()
+
+    @property
+    def sector(self):
+        if self.block is None:
+            return None
+        return block_sector(self.block)
+
+    #The 4 bytes of the UID used by Crypto1 (the last 4 bytes for 7 byte UIDs)
+    @property
+    def cuid(self):
+        if self.uid is None:
+            return None
+        return self.uid & 0xFFFFFFFF
+
+    @property
+    def nt_par_err(self):
+        return parity_errors(self.nt, self.nt_par)
+
+    @property
+    def ar_par_err(self):
+        return parity_errors(self.ar_enc, self.nr_ar_par, 4)
+
+    @property
+    def at_par_err(self):
+        return parity_errors(self.at_enc, self.at_par)
+
+    #Check if `key` (int, bytes or hex string) is the key used by this authentication
+    def check_key(self, key):
+        if self.uid is None:
+            return False
+        return check_auth_key(key, self.cuid, self.nt, self.nr_enc, self.ar_enc, self.nested)
+
+    #The cipher state right after the authentication, if `key` is its key
+    def session(self, key):
+        state = Crypto1(key)
+        if self.nested:
+            state.word(self.cuid ^ self.nt, True)
+        else:
+            state.word(self.cuid ^ self.nt)
+        state.word(self.nr_enc, True)
+        state.word(0)   #{ar}
+        state.word(0)   #{at}
+        return state
+
+    #The block the reader read or wrote right after the authentication, using `key` to decrypt the command
+    #This tells the sector of a nested authentication, as the reader reads a block of the sector it
+    #just authenticated. Returns None if there was no such command
+    def next_block(self, key):
+        if self.uid is None or not self.next_cmd or len(self.next_cmd) != 4:
+            return None
+        state = self.session(key)
+        cmd = bytes(b ^ state.byte(0) for b in self.next_cmd)
+        if cmd[0] in (CMD_READ, CMD_WRITE) and check_crc(cmd):
+            return cmd[1]
+        return None
+
+    #Arguments for mf_nonce_brute, in the same order as suggested by `trace list -t mf`:
+    #  <uid> <{nt}> <nt_par_err> <{nr}> <{ar}> <ar_par_err> <{at}> <at_par_err> [<{next_command}>]
+    def brute_args(self):
+        args = [
+            f"{self.cuid or 0:08x}", f"{self.nt:08x}", self.nt_par_err,
+            f"{self.nr_enc:08x}", f"{self.ar_enc:08x}", self.ar_par_err,
+            f"{self.at_enc:08x}", self.at_par_err,
+        ]
+        if self.next_cmd:
+            args.append(self.next_cmd.hex())
+        return args
+
+#Sector of a block (MIFARE Classic 4K has 32 sectors of 4 blocks, then 8 sectors of 16 blocks)
+def block_sector(block):
+    if block < 128:
+        return block // 4
+    return 32 + (block - 128) // 16
+
+#Convert a UID from an AuthRecord back to its 4, 7 or 10 bytes
+def uid_to_bytes(uid):
+    for length in (4, 7, 10):
+        if uid < 1 << (8 * length):
+            return uid.to_bytes(length, "big")
+    raise ValueError(f"UID {uid:x} is too long")
+
+#Open `source` (a path, or the contents of a trace as a bytes-like object) as a memoryview
+def _load(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return memoryview(source)
+    with open(source, "rb") as fp:
+        return memoryview(fp.read())
+
+#Parse the frame starting at `offset` of `buf`
+#Returns the frame and the offset of the next one, or (None, offset) if the frame isn't complete yet
+def next_frame(buf, offset=0):
+    end = len(buf)
+    if offset + HEADER.size > end:
+        return None, offset
+
+    timestamp, duration, length = HEADER.unpack_from(buf, offset)
+    start = offset + HEADER.size
+
+    is_response = bool(length & 0x8000)
+    length &= 0x7FFF
+    par_len = parity_length(length)
+
+    if start + length + par_len > end:
+        return None, offset  #Truncated record at the end of the trace
+
+    data = bytes(buf[start:start+length])
+    parity = bytes(buf[start+length:start+length+par_len])
+    return Frame(timestamp, duration, is_response, data, parity), start + length + par_len
+
+#Yield every frame in the trace
+def read_frames(source):
+    buf = _load(source)
+    offset = 0
+
+    while True:
+        frame, offset = next_frame(buf, offset)
+        if frame is None:
+            break
+        yield frame
+
+#Yield every authentication found in the trace, in a single pass over the frames
+#The UID is taken from the anticollision/select frames preceding the authentication
+def read_auths(source):
+    decoder = AuthDecoder()
+    for frame in read_frames(source):
+        yield from decoder.feed(frame)
+    yield from decoder.flush()
+
+# Finds the authentications in a trace, one frame at a time, so a trace can be decoded while it's being captured
+#   decoder = AuthDecoder()
+#   for frame in frames:
+#       for auth in decoder.feed(frame):
+#           ...
+#   auths = decoder.flush()
+# An authentication is returned with the frame that follows it, which tells its next_cmd
+class AuthDecoder:
+    # Expected (is_response, length) of the frames following the auth command
+    AUTH_SEQUENCE = [(True, 4), (False, 8), (True, 4)]
+
+    def __init__(self):
+        self.uid_parts = []        #UID bytes collected from the current anticollision
+        self.uid = None
+        self.last_select = None    #Select command waiting for its anticollision response
+        self.encrypted = False     #True once an authentication succeeded and the session is encrypted
+        self.pending = []          #Frames of an authentication in progress
+        self.finished = None       #Completed authentication, waiting to see if a reader command follows it
+
+    #Process the next frame of the trace, returns the authentications it completes
+    def feed(self, frame):
+        auths = []
+        if self.finished is not None:
+            if not frame.is_response and len(frame.data) == 4:
+                self.finished = self.finished._replace(next_cmd=frame.data)
+            auths.append(self.finished)
+            self.finished = None
+
+        if self.pending:
+            is_response, length = self.AUTH_SEQUENCE[len(self.pending) - 1]
+            if frame.is_response == is_response and len(frame.data) == length:
+                self.pending.append(frame)
+                if len(self.pending) == 4:
+                    self.finished = _build_auth(self.uid, self.encrypted, *self.pending)
+                    self.encrypted = True
+                    self.pending = []
+                return auths
+            self.pending = []
+
+        data = frame.data
+
+        if frame.is_response:
+            if self.last_select is not None and len(data) == 5 and data[0] ^ data[1] ^ data[2] ^ data[3] == data[4]:
+                self.uid_parts = _add_uid_part(self.uid_parts, self.last_select, data[:4])
+                self.uid = int.from_bytes(bytes(self.uid_parts), "big")
+            self.last_select = None
+            return auths
+
+        # Reader frames
+        if len(data) == 1 and data[0] in (CMD_REQA, CMD_WUPA):
+            self.encrypted = False
+            return auths
+
+        if not self.encrypted and data == CMD_HALT:
+            return auths
+
+        if len(data) >= 2 and data[0] in SELECT_CMDS and data[1] == 0x20:
+            #Anticollision, the UID part comes in the tag's response
+            if data[0] == SELECT_CMDS[0]:
+                self.uid_parts = []
+            self.last_select = data[0]
+            self.encrypted = False
+            return auths
+
+        if len(data) == 9 and data[0] in SELECT_CMDS and data[1] == 0x70:
+            #Select, the UID part is part of the command
+            if data[2] ^ data[3] ^ data[4] ^ data[5] == data[6]:
+                if data[0] == SELECT_CMDS[0]:
+                    self.uid_parts = []
+                self.uid_parts = _add_uid_part(self.uid_parts, data[0], data[2:6])
+                self.uid = int.from_bytes(bytes(self.uid_parts), "big")
+            self.encrypted = False
+            return auths
+
+        if len(data) == 4 and (self.encrypted or (data[0] in (CMD_AUTH_A, CMD_AUTH_B) and check_crc(data))):
+            self.pending = [frame]
+        return auths
+
+    #The authentication still waiting for its next frame, call at the end of the trace
+    def flush(self):
+        auths = [] if self.finished is None else [self.finished]
+        self.finished = None
+        return auths
+
+#Add a cascade level's UID bytes to the UID collected so far
+def _add_uid_part(uid_parts, select_cmd, part):
+    level = SELECT_CMDS.index(select_cmd)
+    uid_parts = uid_parts[:3 * level]
+    if part[0] == CASCADE_TAG:
+        return uid_parts + list(part[1:])
+    return uid_parts + list(part)
+
+def _build_auth(uid, nested, cmd, nt, nr_ar, at):
+    return AuthRecord(
+        timestamp=cmd.timestamp,
+        uid=uid,
+        nested=nested,
+        key_type=None if nested else ("A" if cmd.data[0] == CMD_AUTH_A else "B"),
+        block=None if nested else cmd.data[1],
+        nt=int.from_bytes(nt.data, "big"),
+        nt_par=nt.parity,
+        nr_enc=int.from_bytes(nr_ar.data[:4], "big"),
+        ar_enc=int.from_bytes(nr_ar.data[4:], "big"),
+        nr_ar_par=nr_ar.parity,
+        at_enc=int.from_bytes(at.data, "big"),
+        at_par=at.parity,
+        next_cmd=None,
+    )
+
+# Reads the frames of a trace file while it is being written
+# Every call of poll() returns the frames that were added since the last call. The file is memory
+# mapped, so only the new part of it is read. If the file is replaced by a shorter one or a
+# different one (e.g. `trace save` after a new sniff), reading starts over and `restarted` is set.
+#   follower = TraceFollower("trace.trace")
+#   while sniffing:
+#       for frame in follower.poll():
+#           ...
+class TraceFollower:
+    HEAD_SIZE = 64          #Bytes compared to notice that the file was replaced
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.head = b""
+        self.restarted = False
+
+    def poll(self):
+        self.restarted = False
+        try:
+            fp = open(self.path, "rb")
+        except FileNotFoundError:
+            return []
+
+        with fp:
+            size = os.fstat(fp.fileno()).st_size
+            if size == 0:
+                return []
+            with mmap.mmap(fp.fileno(), size, access=mmap.ACCESS_READ) as buf:
+                head = bytes(buf[:self.HEAD_SIZE])
+                if size < self.offset or head[:len(self.head)] != self.head:
+                    self.offset = 0
+                    self.restarted = True
+                self.head = head
+
+                frames = []
+                while True:
+                    frame, self.offset = next_frame(buf, self.offset)
+                    if frame is None:
+                        return frames
+                    frames.append(frame)
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+# Consistency checks for Bambu Lab tag dumps
+# Created for https://github.com/Bambu-Research-Group/RFID-Tag-Guide
+# Requires: pycryptodome
+#
+# Dumps come from many tools (Proxmark3 .bin/.json, libnfc_dump, Flipper .nfc) and some of them are
+# corrupt, e.g. truncated when a sector couldn't be read. validate() checks the length of a dump,
+# the BCC of block 0, and the keys and access bits of every sector trailer.
+# validate_corpus() streams the dumps of a directory or archive through a process pool, a chunk of
+# files per work unit, so a corpus of 100k dumps is checked in a few minutes.
+
+import os
+import re
+import tarfile
+import zipfile
+from multiprocessing import Pool
+
+from lib.bambu import BLOCK_SIZE, BLOCKS_PER_SECTOR, SECTORS, DUMP_SIZE, ACCESS_BITS, TRAILER, json_blocks
+from lib.keycache import KeyCache, pack_keys
+
+DUMP_EXTENSIONS = (".bin", ".json", ".nfc")
+ARCHIVE_EXTENSIONS = (".tar", ".tar.gz", ".tgz", ".tar.xz", ".zip")
+BLOCKS = SECTORS * BLOCKS_PER_SECTOR
+KEY_LENGTH = 6
+UNREAD_KEY = bytes(KEY_LENGTH)
+CHUNK_SIZE = 256
+
+#UID in the file names written by the Proxmark3 client and libnfc_dump, e.g. hf-mf-75886B1D-dump.bin
+FILENAME_UID_RE = re.compile(r"hf-(?:mf|tag)-([0-9A-F]{8})\b", re.IGNORECASE)
+#A block line of a Flipper .nfc file, e.g. "Block 3: 6E 5B 0E C6 EF 7C 87 87 87 69 ?? ?? ?? ?? ?? ??"
+FLIPPER_BLOCK_RE = re.compile(r"^Block (\d+): ((?:[0-9A-F?]{2} ?){16})$", re.IGNORECASE | re.MULTILINE)
+FLIPPER_UID_RE = re.compile(r"^UID: ([0-9A-F ]+)$", re.IGNORECASE | re.MULTILINE)
+
+#Keys of recently seen UIDs, one cache per worker process
+_key_cache = None
+
+#Convert the contents of a dump file to the raw dump and the set of blocks missing from it
+#Also returns the UID the file itself claims (Proxmark3 JSON "Card" or Flipper "UID:" line), if any
+def parse_dump(name, data):
+    lower = name.lower()
+    raw_dump = lower.endswith(".bin")
+    if lower.endswith(".json") or (not raw_dump and data[:1] == b"{"):
+        #Same checks as json_to_bin, but the blocks the dump doesn't have are reported as missing
+        dump, blocks = json_blocks(data)
+        raw = bytearray(DUMP_SIZE)
+        for block, value in blocks.items():
+            raw[block * BLOCK_SIZE:(block + 1) * BLOCK_SIZE] = value
+        return raw, set(range(BLOCKS)) - set(blocks), dump.get("Card", {}).get("UID")
+
+    if lower.endswith(".nfc") or (not raw_dump and data.startswith(b"Filetype: Flipper")):
+        text = data.decode("ascii", "replace")
+        raw = bytearray(DUMP_SIZE)
+        missing = set(range(BLOCKS))
+        for match in FLIPPER_BLOCK_RE.finditer(text):
+            block = int(match.group(1))
+            value = match.group(2).replace(" ", "")
+            #Flipper writes unread bytes as "??", a block with any of them counts as missing
+            if block < BLOCKS and "?" not in value:
+                raw[block * BLOCK_SIZE:(block + 1) * BLOCK_SIZE] = bytes.fromhex(value)
+                missing.discard(block)
+        uid = FLIPPER_UID_RE.search(text)
+        return raw, missing, uid.group(1).replace(" ", "") if uid else None
+
+    #Raw dumps have no gaps, everything after the end of a short dump is missing
+    raw = bytearray(data[:DUMP_SIZE].ljust(DUMP_SIZE, b"\0"))
+    return raw, set(range(len(data) // BLOCK_SIZE, BLOCKS)), None
+
+#Check that the access bits of a trailer are well formed (every bit is stored inverted as well)
+def access_bits_consistent(access):
+    c1, c2, c3 = access[1] >> 4, access[2] & 0x0F, access[2] >> 4
+    n1, n2, n3 = access[0] & 0x0F, access[0] >> 4, access[1] & 0x0F
+    return c1 ^ n1 == c2 ^ n2 == c3 ^ n3 == 0x0F
+
+def _issue(check, message, **where):
+    return {"check": check, **where, "message": message}
+
+#Check one dump, given as the file name and contents
+# - strict: also require key B, which most readers can't read and leave as zeros
+#Returns a dict with the UID and the list of issues found (empty if the dump is valid)
+def validate(name, data, strict=False):
+    global _key_cache
+    result = {"path": name, "uid": None, "size": len(data), "issues": []}
+    issues = result["issues"]
+
+    try:
+        raw, missing, claimed_uid = parse_dump(name, data)
+    except (ValueError, TypeError, AttributeError, UnicodeDecodeError) as e:
+        issues.append(_issue("format", f"Unreadable dump: {e}"))
+        return result
+
+    if name.lower().endswith(".bin") and len(data) != DUMP_SIZE:
+        issues.append(_issue("length", f"Dump is {len(data)} bytes, expected {DUMP_SIZE}"))
+    if missing:
+        issues.append(_issue("missing", f"{len(missing)} of {BLOCKS} blocks missing", blocks=sorted(missing)))
+    if 0 in missing:
+        return result
+
+    uid = bytes(raw[0:4])
+    result["uid"] = uid.hex().upper()
+
+    if not any(uid):
+        issues.append(_issue("uid", "UID is all zeros", block=0))
+    if raw[4] != uid[0] ^ uid[1] ^ uid[2] ^ uid[3]:
+        issues.append(_issue("bcc", f"BCC is {raw[4]:02X}, expected {uid[0] ^ uid[1] ^ uid[2] ^ uid[3]:02X} for UID {result['uid']}", block=0))
+
+    filename_uid = FILENAME_UID_RE.search(os.path.basename(name))
+    for source, other in (("file name", filename_uid.group(1) if filename_uid else None), ("dump header", claimed_uid)):
+        if other and other.upper() != result["uid"]:
+            issues.append(_issue("uid", f"UID in the {source} is {other.upper()}, block 0 has {result['uid']}", block=0))
+
+    if _key_cache is None:
+        _key_cache = KeyCache(4096)
+    keys = pack_keys(_key_cache.get(result["uid"]))
+
+    for sector in range(SECTORS):
+        block = sector * BLOCKS_PER_SECTOR + BLOCKS_PER_SECTOR - 1
+        if block in missing:
+            continue
+        key_a, access, key_b = TRAILER.unpack_from(raw, block * BLOCK_SIZE)
+        expected_a = keys[sector * KEY_LENGTH:(sector + 1) * KEY_LENGTH]
+        expected_b = keys[(SECTORS + sector) * KEY_LENGTH:(SECTORS + sector + 1) * KEY_LENGTH]
+
+        if key_a != expected_a:
+            issues.append(_issue("key_a", f"Key A is {key_a.hex().upper()}, expected {expected_a.hex().upper()}", sector=sector))
+        if key_b != expected_b and (strict or key_b != UNREAD_KEY):
+            issues.append(_issue("key_b", f"Key B is {key_b.hex().upper()}, expected {expected_b.hex().upper()}", sector=sector))
+        if not access_bits_consistent(access):
+            issues.append(_issue("access_bits", f"Access bits {access.hex().upper()} are malformed", sector=sector))
+        elif access[:3] != ACCESS_BITS[:3]:
+            issues.append(_issue("access_bits", f"Access bits are {access.hex().upper()}, expected {ACCESS_BITS.hex().upper()}", sector=sector))
+
+    return result
+
+#Worker function for the process pool
+#Takes a list of (name, path, data) items, where data is None for files that still have to be read
+def validate_chunk(items, strict=False):
+    results = []
+    for name, path, data in items:
+        if data is None:
+            try:
+                with open(path, "rb") as fp:
+                    data = fp.read(DUMP_SIZE * 16)
+            except OSError as e:
+                results.append({"path": name, "uid": None, "size": None, "issues": [_issue("format", f"Unreadable file: {e}")]})
+                continue
+        results.append(validate(name, data, strict))
+    return results
+
+def _validate_strict(items):
+    return validate_chunk(items, strict=True)
+
+def is_archive(path):
+    return os.path.isfile(path) and path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+def _is_dump(name):
+    return name.lower().endswith(DUMP_EXTENSIONS)
+
+#Yield a (name, path, data) item for every dump below `root`
+#Files are read by the workers, so only their paths are listed here
+def _directory_items(root):
+    for entry in os.scandir(root):
+        if entry.is_dir(follow_symlinks=False):
+            if not entry.name.startswith("."):
+                yield from _directory_items(entry.path)
+        elif _is_dump(entry.name):
+            yield entry.path, entry.path, None
+
+#Yield a (name, path, data) item for every dump in a tar or zip archive
+#Members are read here in one pass, since an archive can't be shared between processes
+def _archive_items(path):
+    if path.lower().endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and _is_dump(info.filename):
+                    yield f"{path}:{info.filename}", None, archive.read(info)
+        return
+
+    with tarfile.open(path, "r|*") as archive:
+        for member in archive:
+            if member.isfile() and _is_dump(member.name):
+                yield f"{path}:{member.name}", None, archive.extractfile(member).read()
+
+#Yield the dumps of every source, which can be dump files, directories or archives
+def find_items(sources):
+    for source in sources:
+        source = str(source)
+        if os.path.isdir(source):
+            yield from _directory_items(source)
+        elif is_archive(source):
+            yield from _archive_items(source)
+        else:
+            yield source, source, None
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+#Validate every dump of `sources`, spreading the work over `jobs` processes
+#Results are yielded in input order as soon as they are ready
+def validate_corpus(sources, jobs=None, strict=False, chunksize=CHUNK_SIZE):
+    chunks = _chunks(find_items(sources), chunksize)
+    worker = _validate_strict if strict else validate_chunk
+
+    if jobs == 1:
+        for chunk in chunks:
+            yield from worker(chunk)
+        return
+
+    with Pool(jobs) as pool:
+        for results in pool.imap(worker, chunks):
+            yield from results
@@ -6,126 +6,391 @@
 # Created for https://github.com/Bambu-Research-Group/RFID-Tag-Guide
 # Written by scourge411, 2026
 
+import os
+import time
+import queue
 import argparse
+import threading
+from collections import OrderedDict
 import pynfc.nfc as nfcmod
 
 from pynfc import Nfc, TimeoutException
 
-from deriveKeys import kdf
+from lib import metrics
+from lib.keycache import KeyCache
+from lib.kiosk import UidStore, BoundedSet, RollingArchive
+from lib.dumparchive import DumpArchive
 
 SECNUM = 16
 BPS = 4
 
-dump = {}
-dumped_ids = []
-warned_ids = []
-
-def build_auth_tag(sector, keys):
-    tag_struct = nfcmod.mifare_classic_tag()
-
-    last_block = (sector + 1) * BPS - 1
-
-    tag_struct.amb[last_block].mbt.abtKeyA = (nfcmod.uint8_t * 6)(*keys[0][sector])
-    tag_struct.amb[last_block].mbt.abtKeyB = (nfcmod.uint8_t * 6)(*keys[1][sector])
+READ_ATTEMPTS = 3      # Attempts per sector and tag presence
+AUTH_PRESENCES = 3     # Presences in which a sector couldn't be authenticated before we give up on it
+MAX_IN_FLIGHT = 64     # Partially dumped tags kept in memory before the oldest is dropped
+WARNED_IDS = 1024      # Recently seen dumped UIDs we don't print "Already read" for again
+GIVEN_UP_IDS = 1024    # Recently given up UIDs, skipped until the tag leaves the reader
+
+# Build the libfreefare keys for every sector once per UID
+def build_auth_keys(keys):
+    return [
+        [(nfcmod.uint8_t * 6)(*key) for key in keys[0]],
+        [(nfcmod.uint8_t * 6)(*key) for key in keys[1]],
+    ]
+
+# Dumping progress of a tag, kept between presences so a removed tag resumes where it left off
+def new_tag_state(keys):
+    return {
+        'blocks': [None] * (SECNUM * BPS),
+        'keys': keys,
+        'auth_keys': build_auth_keys(keys),
+        'auth_failures': [0] * SECNUM,    # Presences in which the sector couldn't be authenticated
+        'presences': 0,
+        'first_seen': time.perf_counter(),
+        'read_time': 0.0,
+    }
+
+# (Re)select the tag, which is needed after a failed authentication or read
+def connect(tag, connected=False):
+    if connected:
+        nfcmod.mifare_classic_disconnect(tag.target)
+    return nfcmod.mifare_classic_connect(tag.target) == 0
+
+def auth_sector(tag, state, sector):
+    last_block = sector * BPS + BPS - 1
+    with metrics.timer("nfc_auth_seconds"):
+        try:
+            ok = nfcmod.mifare_classic_authenticate(tag.target, last_block, state['auth_keys'][0][sector], nfcmod.MFC_KEY_A) == 0
+        except Exception as e:
+            ok = False
+    if not ok:
+        metrics.count("nfc_auth_failures_total")
+    return ok
+
+def read_block(tag, block):
+    buf = (nfcmod.uint8_t * 16)()
+    with metrics.timer("nfc_read_seconds"):
+        ok = nfcmod.mifare_classic_read(tag.target, block, buf) == 0
+    if not ok:
+        metrics.count("nfc_read_failures_total")
+        return None
+    return bytearray(buf)
+
+# Blocks of a sector that still have to be read, or an empty list if we gave up on the sector
+def missing_blocks(state, sector):
+    if given_up(state, sector):
+        return []
+    first_block = sector * BPS
+    return [block for block in range(first_block, first_block + BPS) if state['blocks'][block] is None]
 
-    return tag_struct
+def given_up(state, sector):
+    return state['auth_failures'][sector] >= AUTH_PRESENCES
 
-def read_tag(tag, sector, keys):
+def is_complete(state):
+    return not any(missing_blocks(state, sector) for sector in range(SECNUM))
 
-    data = bytearray()
-    
-    print(f"\t--- Reading sector {sector} ---")
-    first_block = sector * BPS
-    last_block = first_block + BPS - 1
+# Read every block that is still missing while the tag is on the reader
+# Failed blocks are retried (after selecting the tag again), everything else is only read once
+def read_tag(tag, state):
+    state['presences'] += 1
+    start = time.perf_counter()
+    read = 0
 
-    authenticated = False
+    connected = connect(tag)
+    if not connected:
+        print("Could not connect to tag")
+        return
 
-    try:  
-        auth_tag = build_auth_tag(sector, keys)       
-        key = auth_tag.amb[last_block].mbt.abtKeyA
-        if tag.auth(auth_tag,sector,True):
-                # print(f"Authenticated sector {sector} with Key A:  {list(map(hex,key[:6]))} ")
+    try:
+        # A failed authentication or read halts the tag, it has to be selected again before the next one
+        halted = False
+        for sector in range(SECNUM):
+            authenticated = False
+            for attempt in range(READ_ATTEMPTS):
+                missing = missing_blocks(state, sector)
+                if not missing:
+                    break
+
+                if halted:
+                    connected = connect(tag, connected)
+                    if not connected:
+                        print("Lost connection to tag")
+                        return
+                    halted = False
+
+                if not auth_sector(tag, state, sector):
+                    print(f"Authentication failed for sector {sector} (attempt {attempt + 1} of {READ_ATTEMPTS})")
+                    halted = True
+                    continue
                 authenticated = True
-    except Exception as e:
-            pass
 
-    if not authenticated:
-        print("Authentication failed for this sector")
-        return data
-
-    for block in range(first_block, first_block + BPS):
+                for block in missing:
+                    data = read_block(tag, block)
+                    if data is None:
+                        print(f"Error reading block {block}")
+                        halted = True
+                        break
+
+                    if block % BPS == BPS - 1:
+                        data[0:6] = state['keys'][0][sector]
+                        data[-6:] = state['keys'][1][sector]
+
+                    state['blocks'][block] = data
+                    read += 1
+
+            # A sector is only given up after it failed in several presences, a single bad
+            # placement of the tag shouldn't cost a sector
+            if not authenticated and missing_blocks(state, sector):
+                state['auth_failures'][sector] += 1
+                if given_up(state, sector):
+                    print(f"Giving up on sector {sector} after {AUTH_PRESENCES} presences")
+    finally:
+        if connected:
+            nfcmod.mifare_classic_disconnect(tag.target)
+        elapsed = time.perf_counter() - start
+        state['read_time'] += elapsed
+        metrics.observe("nfc_presence_seconds", elapsed)
+        print(f"\tRead {read} blocks in {elapsed * 1000:.0f} ms")
+
+# State shared by every reader of a dumping station
+# Each reader polls in its own thread and hands the tags it sees to handle_tag. A UID is only
+# read by one reader at a time and is only dumped once, even if the spool moves between readers.
+# Finished dumps are written to disk by a separate writer thread, so polling never waits on disk.
+# Memory use doesn't grow with the number of dumped tags: only `max_in_flight` partial dumps are
+# kept, dumped UIDs live in a UidStore (pass one with a path to remember them between runs), and
+# with an `archive` (RollingArchive) the dumps go into rolling tar files instead of one file each.
+class DumpStation:
+    def __init__(self, key_cache, output=".", dumped_ids=None, archive=None, max_in_flight=MAX_IN_FLIGHT):
+        self.key_cache = key_cache
+        self.output = output
+        self.archive = archive
+        self.max_in_flight = max_in_flight
+        self.lock = threading.Lock()
+        self.dump = OrderedDict()   # UID -> state of tags being dumped, least recently seen first
+        self.dumped_ids = dumped_ids if dumped_ids is not None else UidStore()
+        self.warned_ids = BoundedSet(WARNED_IDS)
+        self.given_up_ids = BoundedSet(GIVEN_UP_IDS)
+        self.present = {}           # Reader -> UID of the tag it saw last
+        self.reading = set()        # UIDs a reader is working on right now
+        self.writing = set()        # UIDs of finished dumps waiting for the writer
+        self.evicted_count = 0
+        self.write_queue = queue.Queue()
+        self.dumped_count = 0
+        self.started = time.perf_counter()
+
+    # Tags dumped per minute since the station started, over all readers
+    def tags_per_minute(self):
+        minutes = (time.perf_counter() - self.started) / 60
+        return self.dumped_count / minutes if minutes > 0 else 0.0
+
+    # Reserve a UID for a reader. Returns its dumping state, or None if it shouldn't be read
+    def claim(self, uid, reader):
+        with self.lock:
+            # Tags that were just reported stay on the reader for a while, don't look them up every poll
+            if uid in self.warned_ids or uid in self.given_up_ids:
+                return None
+
+            if uid in self.writing or uid in self.dumped_ids:
+                print(f"[{reader}] Already read tag:", uid.decode())
+                self.warned_ids.add(uid)
+                return None
+
+            if uid in self.reading:
+                return None
+
+            # Reserve the UID, so no other reader picks it up while its keys are derived
+            self.reading.add(uid)
+            state = self.dump.get(uid)
+            if state is not None:
+                print(f"[{reader}] Resuming tag {uid.decode()}")
+                self.dump.move_to_end(uid)
+                return state
+
+        # Deriving the keys takes a while, the other readers shouldn't have to wait for it
         try:
-            buf = (nfcmod.uint8_t* 16)()
-            ret = nfcmod.mifare_classic_read(tag.target, block, buf)
-
-            if ret != 0:
-                raise RuntimeError("read failed")
-            block_data = bytearray(buf)
-            
-            #print(f"Block {block:02d}: {block_data}")
-
-            if block == last_block:
-                block_data[0:6]=key[:6]
-                block_data[-6:]=auth_tag.amb[last_block].mbt.abtKeyB[:6]
+            state = new_tag_state(self.key_cache.get(uid))
+        except Exception:
+            with self.lock:
+                self.reading.discard(uid)
+            raise
+
+        with self.lock:
+            print(f"[{reader}] Tag UID: {uid.decode()}")
+            self.evict()
+            self.dump[uid] = state
+            return state
+
+    # Drop the least recently seen partial dumps until there is room for a new tag (call with the lock held)
+    # A dropped tag simply starts over if it comes back
+    def evict(self):
+        for uid in list(self.dump):
+            if len(self.dump) < self.max_in_flight:
+                return
+            if uid in self.reading:
+                continue
+            del self.dump[uid]
+            self.evicted_count += 1
+            print(f"Dropping partial dump of tag {uid.decode()} to make room")
+
+    # Give a UID back after reading it. Complete dumps are queued for writing
+    def release(self, uid, state, reader):
+        with self.lock:
+            self.reading.discard(uid)
+            if not is_complete(state):
+                print(f"[{reader}] {sum(len(missing_blocks(state, s)) for s in range(SECNUM))} blocks left; keep the tag on the reader.")
+                return
+
+            self.writing.add(uid)
+            # The dump is handed to the writer, don't keep its data and keys around
+            del self.dump[uid]
+
+            total = time.perf_counter() - state['first_seen']
+            skipped = [sector for sector in range(SECNUM) if given_up(state, sector)]
+            if skipped:
+                # Don't dump the tag again every few polls while it is still on the reader
+                self.given_up_ids.add(uid)
+            else:
+                self.dumped_count += 1
+            done = f"dumped without sectors {skipped}" if skipped else "fully dumped"
+            print(f"[{reader}] Tag {uid.decode()} {done} in {total:.2f}s ({state['presences']} presences, {state['read_time']:.2f}s reading); remove tag.")
+            print(f"Station total: {self.dumped_count} tags, {self.tags_per_minute():.1f} tags/minute")
+
+        self.write_queue.put((uid, state))
+
+    def handle_tag(self, tag, reader):
+        if tag.__class__.__name__ != "Mifare":
+            print(f"[{reader}] Non-MIFARE tag detected, skipping")
+            return
+
+        uid = tag.uid
+        if not uid:
+            print(f"[{reader}] No UID found; skipping")
+            return
+
+        self.seen(uid, reader)
+        state = self.claim(uid, reader)
+        if state is None:
+            return
 
-            data += block_data
+        try:
+            read_tag(tag, state)
+        finally:
+            self.release(uid, state, reader)
+
+    # Remember which tag is on a reader. A given up tag is read again once it left the reader
+    def seen(self, uid, reader):
+        with self.lock:
+            previous = self.present.get(reader)
+            if previous is not None and previous != uid:
+                self.given_up_ids.discard(previous)
+            self.present[reader] = uid
+
+    # Polling thread of one reader
+    def poll(self, reader, nfc):
+        try:
+            for tag in nfc.poll():
+                self.handle_tag(tag, reader)
+        except TimeoutException:
+            print(f"[{reader}] Reader timed out")
+            with self.lock:
+                previous = self.present.pop(reader, None)
+                if previous is not None:
+                    self.given_up_ids.discard(previous)
+
+    # Writer thread, writes every finished dump until it receives None
+    def write_dumps(self):
+        while True:
+            item = self.write_queue.get()
+            if item is None:
+                return
+
+            uid, state = item
+            # Blocks we couldn't read are written as zeros, so every other block stays at its offset
+            data = b''.join(bytes(data) if data is not None else bytes(16) for data in state['blocks'])
+            skipped = [sector for sector in range(SECNUM) if given_up(state, sector)]
+            if skipped:
+                # Incomplete dumps are always written as a file of their own, never into an archive,
+                # and the tag isn't remembered as dumped so it is read again when it comes back later
+                print(f"Warning: could not authenticate sectors {skipped} of tag {uid.decode()}, the dump is incomplete")
+                with open(os.path.join(self.output, f'hf-tag-{uid.decode().upper()}-incomplete.bin'),'wb') as fp:
+                    fp.write(data)
+            else:
+                name = f'hf-tag-{uid.decode().upper()}.bin'
+                if self.archive is not None:
+                    self.archive.add(name, data)
+                else:
+                    with open(os.path.join(self.output, name),'wb') as fp:
+                        fp.write(data)
 
-        except Exception as e:
-            print(f"Error reading block {block}: {e}")
+                # Only remember the UID once its dump is safely written
+                self.dumped_ids.add(uid)
 
-    return data
+            with self.lock:
+                self.writing.discard(uid)
 
 def main():
 
     parser = argparse.ArgumentParser(description="Use libnfc to dump a tag")
-    parser.add_argument('-d', '--device', required=True, help='libnfc device to open. e.g "pn532_uart:/dev/ttyUSB0"')
+    parser.add_argument('-d', '--device', required=True, action='append', help='libnfc device to open. e.g "pn532_uart:/dev/ttyUSB0". Repeat to use several readers at once')
+    parser.add_argument('-o', '--output', default='.', help='Directory to write the dumps to (default: current directory)')
+    parser.add_argument('--key-cache', metavar='PATH', help='SQLite file to keep derived keys in between runs')
+    parser.add_argument('--key-cache-size', type=int, default=1024, help='Number of tags whose keys are kept in memory (default: 1024)')
+    parser.add_argument('--kiosk', action='store_true', help='Long-running mode: remember dumped tags between runs and write the dumps into rolling tar archives in the output directory')
+    parser.add_argument('--archive-size', type=int, default=10000, help='Dumps per tar archive in kiosk mode (default: 10000)')
+    parser.add_argument('--dump-archive', metavar='PATH', help='Add the dumps to a deduplicated dump archive (see dumpArchive.py) instead of writing files')
+    parser.add_argument('--max-in-flight', type=int, default=MAX_IN_FLIGHT, help=f'Partially dumped tags kept in memory (default: {MAX_IN_FLIGHT})')
 
     args = parser.parse_args()
-    try:
-        n = Nfc(args.device)
-    except Exception as e:
-        print("Could not open NFC device:", e)
+
+    readers = []
+    for device in args.device:
+        try:
+            readers.append((device, Nfc(device)))
+        except Exception as e:
+            print(f"Could not open NFC device {device}:", e)
+    if not readers:
         return
 
-    print("Waiting for Bambu tag... (Ctrl+C to exit)")
+    key_cache = KeyCache(args.key_cache_size, args.key_cache)
+    if args.kiosk:
+        os.makedirs(args.output, exist_ok=True)
+        dumped_ids = UidStore(os.path.join(args.output, 'dumped.sqlite'))
+        archive = None if args.dump_archive else RollingArchive(args.output, args.archive_size)
+        print(f"Kiosk mode: {len(dumped_ids)} tags dumped in earlier runs")
+    else:
+        dumped_ids = UidStore()
+        archive = None
+    if args.dump_archive:
+        archive = DumpArchive(args.dump_archive, key_cache)
+    station = DumpStation(key_cache, args.output, dumped_ids, archive, args.max_in_flight)
 
-    try:
-        for tag in n.poll():
+    writer = threading.Thread(target=station.write_dumps)
+    writer.start()
 
-            if tag.__class__.__name__ != "Mifare":
-                print("Non-MIFARE tag detected, skipping")
-                continue
+    workers = [threading.Thread(target=station.poll, args=(device, n), daemon=True) for device, n in readers]
+    for worker in workers:
+        worker.start()
 
-            if not tag.uid:
-                print("No UID found; skipping")
-                continue
+    print(f"Waiting for Bambu tags on {len(readers)} reader(s)... (Ctrl+C to exit)")
 
-            if tag.uid in dumped_ids and not tag.uid in warned_ids:
-                print("Already read tag:", tag.uid.decode())
-                warned_ids.append(tag.uid)
-                continue
-            
-            if tag.uid in warned_ids:
-                continue
-
-            if not dump.get(tag.uid):
-                print(f"Tag UID: {tag.uid.decode()}")
-                dump[tag.uid]={'sector':0,'data':list(), 'keys': kdf(bytes.fromhex(tag.uid.decode()))}
-
-            if not tag.uid in dumped_ids and dump[tag.uid]['sector']==SECNUM:
-                print(f'Tag {tag.uid.decode()} fully dumped; remove tag.')
-                with open(f'hf-tag-{tag.uid.decode().upper()}.bin','wb') as fp:
-                    for data in dump[tag.uid]['data']:
-                        fp.write(data)
-                dumped_ids.append(tag.uid)
-                continue
-
-            dump[tag.uid]['data'].append(read_tag(tag,dump[tag.uid]['sector'], dump[tag.uid]['keys']))
-            dump[tag.uid]['sector']+=1
-    
-    except (TimeoutException, KeyboardInterrupt):
+    try:
+        while any(worker.is_alive() for worker in workers):
+            for worker in workers:
+                worker.join(0.5)
         print("\nExiting.")
+    except KeyboardInterrupt:
+        print("\nExiting.")
+    finally:
+        # Let the writer finish the dumps that are still queued
+        station.write_queue.put(None)
+        writer.join()
+        if archive is not None:
+            archive.close()
+        dumped_ids.close()
+
+        print(f"Dumped {station.dumped_count} tags ({station.tags_per_minute():.1f} tags/minute, {station.evicted_count} partial dumps dropped)")
+        stats = key_cache.stats()
+        print(f"Key cache: {stats['hits']} hits, {stats['disk_hits']} disk hits, {stats['misses']} misses")
+        key_cache.close()
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+# Python script to recover the key of a nested MIFARE Classic authentication without mf_nonce_brute
+# Created for https://github.com/Bambu-Research-Group/RFID-Tag-Guide
+# Requires: numpy
+#
+# Takes the same arguments as mf_nonce_brute (as suggested by `trace list -t mf`), or benchmarks the
+# built-in brute force against mf_nonce_brute on the nested authentications of a trace file.
+
+import sys
+import time
+import argparse
+
+from lib import get_proxmark3_location, run_command
+from lib.trace import read_auths
+from lib.noncebrute import nonce_brute_args
+
+mfNonceBruteCommand = "share/proxmark3/tools/mf_nonce_brute"
+
+def benchmark(trace, count, jobs, timeout):
+    auths = list({tuple(auth.brute_args()): auth for auth in read_auths(trace) if auth.nested}.values())[:count]
+    if not auths:
+        print("No nested authentications in the trace")
+        return
+
+    native = None
+    pm3Location = get_proxmark3_location()
+    if pm3Location and (pm3Location / mfNonceBruteCommand).exists():
+        native = pm3Location / mfNonceBruteCommand
+    else:
+        print("mf_nonce_brute not found, only timing the built-in brute force")
+
+    print(f"{'auth':>4}  {'built-in':>10}  {'native':>10}  key")
+    totals = [0.0, 0.0]
+    for i, auth in enumerate(auths):
+        start = time.perf_counter()
+        key = nonce_brute_args(auth.brute_args(), jobs=jobs, timeout=timeout)
+        builtin = time.perf_counter() - start
+        totals[0] += builtin
+
+        nativeTime = ""
+        if native:
+            start = time.perf_counter()
+            output = run_command([native] + auth.brute_args(), timeout=timeout) or ""
+            elapsed = time.perf_counter() - start
+            totals[1] += elapsed
+            nativeTime = f"{elapsed:9.2f}s"
+            if key and key.lower() not in output.lower():
+                nativeTime += " (different key!)"
+
+        print(f"{i:>4}  {builtin:9.2f}s  {nativeTime:>10}  {key or 'not found'}")
+
+    print(f"Total {totals[0]:.2f}s built-in" + (f", {totals[1]:.2f}s native" if native else ""))
+
+def main():
+    parser = argparse.ArgumentParser(description="Recover the key of a nested MIFARE Classic authentication (same arguments as mf_nonce_brute)")
+    parser.add_argument("args", nargs="*", metavar="ARG", help="<uid> <{nt}> <nt_par_err> <{nr}> <{ar}> <ar_par_err> <{at}> <at_par_err> [<{next_command}>]")
+    parser.add_argument("-j", "--jobs", type=int, help="Worker processes (default: one per CPU core)")
+    parser.add_argument("-t", "--timeout", type=float, help="Give up after this many seconds")
+    parser.add_argument("--benchmark", metavar="TRACE", help="Time the built-in brute force (and mf_nonce_brute, if installed) on the nested authentications of a trace")
+    parser.add_argument("--count", type=int, default=4, help="Number of authentications to benchmark (default: 4)")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark, args.count, args.jobs, args.timeout)
+        return
+
+    if len(args.args) < 8:
+        parser.error("expected at least 8 arguments")
+
+    start = time.perf_counter()
+    key = nonce_brute_args(args.args, jobs=args.jobs, timeout=args.timeout)
+    if not key:
+        print(f"No key found ({time.perf_counter() - start:.1f}s)")
+        sys.exit(1)
+    print(f"Valid Key found [ {key} ] - matches candidate ({time.perf_counter() - start:.1f}s)")
+
+if __name__ == "__main__":
+    main()
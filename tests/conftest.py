@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+
+# Shared pytest setup
+# Created for https://github.com/Bambu-Research-Group/RFID-Tag-Guide
+#
+# The scripts and lib/ are imported the same way the scripts import them, from the repository root
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+EXAMPLES = ROOT / "examples"
+
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
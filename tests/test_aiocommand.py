@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+# Tests for lib/aiocommand.py, running small Python scripts as the commands
+
+import sys
+import time
+import asyncio
+
+import pytest
+
+from lib.aiocommand import (stream_command, run_command_async, CommandError, CommandNotFoundError,
+                            CommandTimeoutError, CommandFailedError)
+
+def python(script):
+    return [sys.executable, "-c", script]
+
+def test_run_command_async():
+    output = asyncio.run(run_command_async(python("print('first'); print('second\\r')")))
+    assert output == "first\nsecond"
+
+def test_exit_code_one_is_success():
+    #The Proxmark3 client exits with 1 after most commands
+    assert asyncio.run(run_command_async(python("print('done'); raise SystemExit(1)"))) == "done"
+
+def test_failed_command():
+    with pytest.raises(CommandFailedError) as info:
+        asyncio.run(run_command_async(python("print('working'); print('broken'); raise SystemExit(3)")))
+    assert info.value.returncode == 3
+    assert info.value.output == ["working", "broken"]
+    assert "exited with code 3" in str(info.value)
+
+def test_success_codes():
+    assert asyncio.run(run_command_async(python("raise SystemExit(3)"), success_codes=(3,))) == ""
+
+def test_command_not_found(tmp_path):
+    with pytest.raises(CommandNotFoundError):
+        asyncio.run(run_command_async([tmp_path / "missing"]))
+
+def test_timeout():
+    start = time.monotonic()
+    with pytest.raises(CommandTimeoutError) as info:
+        asyncio.run(run_command_async(python("import time; print('waiting', flush=True); time.sleep(30)"), timeout=0.5))
+    assert time.monotonic() - start < 10
+    assert isinstance(info.value, TimeoutError)
+    assert info.value.output == ["waiting"]
+
+#Lines are yielded while the command runs, and the command is killed when the caller stops early
+def test_stream_stops_early():
+    async def first_line():
+        async for line in stream_command(python("import time; print('key found', flush=True); time.sleep(30)")):
+            return line
+
+    start = time.monotonic()
+    assert asyncio.run(first_line()) == "key found"
+    assert time.monotonic() - start < 10
+
+def test_cancel():
+    async def cancelled():
+        task = asyncio.ensure_future(run_command_async(python("import time; time.sleep(30)")))
+        await asyncio.sleep(0.5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    start = time.monotonic()
+    asyncio.run(cancelled())
+    assert time.monotonic() - start < 10
+
+def test_errors_are_runtime_errors():
+    assert issubclass(CommandError, RuntimeError)
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+# Tests for lib/bambu.py, decoding the dumps in examples/
+
+import json
+
+import pytest
+
+from conftest import EXAMPLES
+from lib.bambu import decode, load_dump, json_to_bin, bin_to_json
+
+def test_decode_example():
+    tag = load_dump(EXAMPLES / "exampleDump.bin")
+    assert tag.uid == "75886B1D"
+    assert (tag.filament_type, tag.detailed_filament_type, tag.material_id) == ("PLA", "PLA Basic", "GFA00")
+    assert tag.color == "FF6A13FF"
+    assert (tag.spool_weight, tag.filament_diameter) == (250, 1.75)
+    assert (tag.min_hotend_temperature, tag.max_hotend_temperature) == (220, 220)
+    assert tag.production_date.isoformat() == "2022-10-15T08:26:00"
+
+def test_json_dump():
+    assert load_dump(EXAMPLES / "exampleDump.json").to_dict() == load_dump(EXAMPLES / "exampleDump.bin").to_dict()
+
+def test_bin_to_json():
+    data = (EXAMPLES / "exampleDump.bin").read_bytes()
+    assert bytes(json_to_bin(bin_to_json(data))) == data
+
+def test_short_dump():
+    with pytest.raises(ValueError):
+        decode(bytes(512))
+
+@pytest.mark.parametrize("document", [
+    [1, 2],
+    "blocks",
+    {"Card": {}},
+    {"blocks": ["00" * 16]},
+    {"blocks": {"one": "00" * 16}},
+    {"blocks": {"0": 1234}},
+    {"blocks": {"0": None}},
+    {"blocks": {"0": "00" * 15}},
+    {"blocks": {"0": "not hex"}},
+])
+def test_malformed_json_dump(document):
+    with pytest.raises(ValueError):
+        json_to_bin(json.dumps(document))
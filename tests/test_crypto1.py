@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+# Tests for lib/crypto1.py, using the authentications of the trace in examples/
+# The tag in the trace is a Bambu Lab tag, so its keys are derived from its UID
+
+from conftest import EXAMPLES
+from deriveKeys import kdf
+from lib.crypto1 import Crypto1, check_auth_key, key_to_int, prng_successor
+from lib.trace import read_auths
+
+AUTHS = list(read_auths(EXAMPLES / "exampleTrace.trace"))
+KEYS_A, KEYS_B = kdf(bytes.fromhex("75066B1D"))
+
+def test_key_to_int():
+    assert key_to_int(0xE0B50731BE27) == key_to_int("E0B50731BE27") == key_to_int(bytes.fromhex("E0B50731BE27"))
+
+def test_prng_successor():
+    assert prng_successor(0x01200145, 0) == 0x01200145
+    assert prng_successor(prng_successor(0x01200145, 32), 32) == prng_successor(0x01200145, 64)
+
+def test_crypto1_key_loading():
+    #The LFSR is loaded with the key, the odd and even halves hold alternating key bits
+    assert Crypto1(0).odd == Crypto1(0).even == 0
+    state = Crypto1(0xFFFFFFFFFFFF)
+    assert state.odd == state.even == 0xFFFFFF
+
+def test_plain_auth_key():
+    auth = AUTHS[0]
+    assert not auth.nested
+    assert check_auth_key(KEYS_A[0], auth.uid, auth.nt, auth.nr_enc, auth.ar_enc)
+    assert auth.check_key(KEYS_A[0].hex())
+    assert not auth.check_key(KEYS_B[0])
+    assert not auth.check_key(KEYS_A[1])
+
+def test_nested_auth_keys():
+    #The reader reads the sectors in order, with key A, each nested authentication uses the next key
+    for sector, auth in enumerate(AUTHS[1:16], 1):
+        assert auth.nested
+        assert check_auth_key(KEYS_A[sector], auth.uid, auth.nt, auth.nr_enc, auth.ar_enc, nested=True)
+        assert not auth.check_key(KEYS_A[sector - 1])
+        assert not auth.check_key(KEYS_B[sector])
+
+def test_auth_without_uid():
+    assert not AUTHS[0]._replace(uid=None).check_key(KEYS_A[0])
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+# Tests for the batch mode of deriveKeys.py
+
+import sys
+import json
+
+import pytest
+
+from conftest import EXAMPLES
+import deriveKeys
+from deriveKeys import kdf, keyfile_bytes, read_uids, derive_batch, write_batch
+
+UIDS = ["75886B1D", "75066B1D", "11223344"]
+
+#The example keyfile only has the A keys, its B keys are blank
+def test_kdf_matches_example_keyfile():
+    example = (EXAMPLES / "exampleKeyfile.bin").read_bytes()
+    assert keyfile_bytes(kdf(bytes.fromhex("75886B1D")))[:96] == example[:96]
+
+def test_read_uids():
+    lines = ["75886b1d\n", "\n", "# comment\n", "75 06 6B 1D\n", "75886B1D\n", "11223344"]
+    assert list(read_uids(lines)) == UIDS
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_derive_batch(jobs):
+    results = list(derive_batch(UIDS + ["XYZ", "123"], jobs, chunksize=2))
+    #Results come back in input order, with the malformed UIDs carrying their error
+    assert [uid for uid, _, _ in results] == UIDS + ["XYZ", "123"]
+    for uid, keys, error in results[:3]:
+        assert error is None
+        assert keys == kdf(bytes.fromhex(uid))
+    for uid, keys, error in results[3:]:
+        assert keys is None and error
+
+def test_keyfile_output(tmp_path, capsys):
+    output = tmp_path / "keys"
+    assert write_batch(derive_batch(UIDS + ["ZZ"], 1), "keyfile", str(output)) == (3, 1)
+    assert "Skipping invalid UID ZZ" in capsys.readouterr().err
+    assert sorted(path.name for path in output.iterdir()) == sorted(f"hf-mf-{uid}-key.bin" for uid in UIDS)
+    for uid in UIDS:
+        assert (output / f"hf-mf-{uid}-key.bin").read_bytes() == keyfile_bytes(kdf(bytes.fromhex(uid)))
+
+def test_dict_output(tmp_path):
+    output = tmp_path / "keys.dic"
+    assert write_batch(derive_batch(UIDS, 1), "dict", str(output)) == (3, 0)
+    keys = output.read_text().split()
+    #Every key once, in the order they were derived
+    expected = []
+    for uid in UIDS:
+        for key in [*kdf(bytes.fromhex(uid))[0], *kdf(bytes.fromhex(uid))[1]]:
+            if key.hex().upper() not in expected:
+                expected.append(key.hex().upper())
+    assert keys == expected
+    assert len(keys) == len(set(keys))
+
+def test_jsonl_output(tmp_path):
+    output = tmp_path / "keys.jsonl"
+    assert write_batch(derive_batch(UIDS + ["1234G"], 1), "jsonl", str(output)) == (3, 1)
+    lines = [json.loads(line) for line in output.read_text().splitlines()]
+    assert [line["uid"] for line in lines] == UIDS
+    for line in lines:
+        keys = kdf(bytes.fromhex(line["uid"]))
+        assert line["keyA"] == [key.hex().upper() for key in keys[0]]
+        assert line["keyB"] == [key.hex().upper() for key in keys[1]]
+
+def test_batch_command_line(tmp_path, monkeypatch, capsys):
+    uids = tmp_path / "uids.txt"
+    uids.write_text("75886B1D\nnot a uid\n75886B1D\n")
+    output = tmp_path / "keys.jsonl"
+    monkeypatch.setattr(sys, "argv", ["deriveKeys.py", "--batch", str(uids), "-o", str(output), "-j", "1"])
+    deriveKeys.main()
+    assert "Derived keys for 1 UIDs (1 skipped)" in capsys.readouterr().err
+    assert [json.loads(line)["uid"] for line in output.read_text().splitlines()] == ["75886B1D"]
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+# Tests for lib/dumparchive.py, storing copies of the example dump
+
+import sqlite3
+
+import pytest
+
+from conftest import EXAMPLES
+from deriveKeys import kdf
+from lib.dumparchive import DumpArchive, FORMAT_VERSION
+
+#The example dump with another UID, and the keys derived from that UID in its sector trailers
+def bambu_dump(uid, tray=0):
+    dump = bytearray((EXAMPLES / "exampleDump.bin").read_bytes())
+    dump[0:4] = uid
+    dump[4] = uid[0] ^ uid[1] ^ uid[2] ^ uid[3]
+    dump[9 * 16] = tray
+    keys = kdf(uid)
+    for sector in range(16):
+        trailer = (sector * 4 + 3) * 16
+        dump[trailer:trailer + 6] = keys[0][sector]
+        dump[trailer + 10:trailer + 16] = keys[1][sector]
+    return bytes(dump)
+
+#A dump whose keys have nothing to do with its UID
+def foreign_dump():
+    return bytes((i * 7 + 3) % 256 for i in range(1024))
+
+@pytest.fixture
+def archive(tmp_path):
+    with DumpArchive(tmp_path / "dumps.db") as archive:
+        yield archive
+
+@pytest.mark.parametrize("data", [
+    bambu_dump(b"\x11\x22\x33\x44"),
+    (EXAMPLES / "exampleDump.bin").read_bytes(),
+    foreign_dump(),
+    bambu_dump(b"\x11\x22\x33\x44")[:320],
+], ids=["bambu", "example", "foreign", "short"])
+def test_round_trip(archive, data):
+    archive.add("dump.bin", data)
+    assert archive.get(data[:4]) == data
+    assert archive.get(data[:4].hex()) == data
+    assert [dump for _, _, _, dump in archive.dumps()] == [data]
+
+def test_derived_keys_blanked(tmp_path):
+    data = bambu_dump(b"\x11\x22\x33\x44")
+    keys = kdf(data[:4])
+    with DumpArchive(tmp_path / "dumps.db") as archive:
+        archive.add("dump.bin", data)
+        assert archive._db.execute("SELECT derived FROM dumps").fetchone()[0] == (1 << 32) - 1
+        #No stored block has one of the keys in it
+        stored = b"".join(block for block, in archive._db.execute("SELECT data FROM blocks"))
+        assert not any(key in stored for key in keys[0] + keys[1])
+
+    #The keys are derived again when the archive is opened another time
+    with DumpArchive(tmp_path / "dumps.db") as archive:
+        assert archive.get(data[:4]) == data
+
+def test_only_matching_keys_blanked(archive):
+    #The example dump has the right key A but a blank key B in every trailer
+    data = (EXAMPLES / "exampleDump.bin").read_bytes()
+    archive.add("dump.bin", data)
+    assert archive._db.execute("SELECT derived FROM dumps").fetchone()[0] == (1 << 16) - 1
+    assert archive.get(data[:4]) == data
+
+def test_repeat_dumps_share_unique_blocks(archive):
+    data = bambu_dump(b"\x11\x22\x33\x44")
+    first = archive.add("first.bin", data)
+    second = archive.add("second.bin", data)
+    third = archive.add("third.bin", bambu_dump(b"\x11\x22\x33\x44", tray=1))
+    rows = dict((number, (inline, shared)) for number, inline, shared in archive._db.execute("SELECT id, inline, shared FROM dumps"))
+    assert rows[first][0] and rows[first][1] is None
+    assert rows[second] == (b"", first)
+    #A dump with other unique blocks keeps its own
+    assert rows[third][0] and rows[third][1] is None
+    assert archive.get(data[:4]) == bambu_dump(b"\x11\x22\x33\x44", tray=1)
+    assert [dump for _, _, _, dump in archive.history(data[:4])][:2] == [data, data]
+
+def test_history_oldest_first(archive):
+    uid = b"\x11\x22\x33\x44"
+    dumps = [bambu_dump(uid, tray) for tray in range(3)]
+    archive.add("other.bin", bambu_dump(b"\x55\x66\x77\x88"))
+    for tray, data in enumerate(dumps):
+        archive.add(f"{tray}.bin", data)
+    history = archive.history(uid)
+    assert [name for _, name, _, _ in history] == ["0.bin", "1.bin", "2.bin"]
+    assert [data for _, _, _, data in history] == dumps
+    numbers = [number for number, _, _, _ in history]
+    assert numbers == sorted(numbers)
+    assert archive.history(b"\x99\x99\x99\x99") == []
+    with pytest.raises(KeyError):
+        archive.get(b"\x99\x99\x99\x99")
+
+def test_dumps_paging(archive):
+    added = []
+    for i in range(7):
+        data = bambu_dump(bytes([0x10 + i % 3, 0x22, 0x33, 0x44]), tray=i)
+        added.append((archive.add(f"{i}.bin", data), data))
+
+    #Pages smaller than the archive return every dump once, in the order they were added
+    for page in (1, 2, 3, 1000):
+        assert [(number, data) for number, _, _, data in archive.dumps(page=page)] == added
+
+    #Only the last dump of each UID, still in the order they were added
+    latest = [(number, uid, data) for number, uid, _, data in archive.dumps(latest_only=True, page=2)]
+    assert [number for number, _, _ in latest] == [number for number, _ in added[4:]]
+    assert [uid for _, uid, _ in latest] == ["11223344", "12223344", "10223344"]
+    assert len(archive) == 7
+    assert archive.uids() == ["10223344", "11223344", "12223344"]
+
+def test_version_check(tmp_path):
+    path = tmp_path / "dumps.db"
+    DumpArchive(path).close()
+    db = sqlite3.connect(path)
+    assert db.execute("PRAGMA user_version").fetchone()[0] == FORMAT_VERSION
+    db.execute(f"PRAGMA user_version = {FORMAT_VERSION + 1}")
+    db.commit()
+    db.close()
+    with pytest.raises(ValueError, match="version"):
+        DumpArchive(path)
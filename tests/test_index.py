@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+# Tests for lib/index.py, indexing copies of the example dump
+
+import os
+import json
+
+import pytest
+
+from conftest import EXAMPLES
+from lib.index import build_index, DumpIndex
+
+@pytest.fixture
+def dumps(tmp_path):
+    root = tmp_path / "dumps"
+    (root / "spools").mkdir(parents=True)
+    (root / "spools" / "a.bin").write_bytes((EXAMPLES / "exampleDump.bin").read_bytes())
+    (root / "spools" / "b.json").write_text((EXAMPLES / "exampleDump.json").read_text())
+    return root
+
+def test_build_and_query(tmp_path, dumps):
+    assert build_index(dumps, tmp_path / "index") == (2, 2)
+    index = DumpIndex(tmp_path / "index")
+    assert len(index) == 2
+    assert index.query(material="PLA Basic").sum() == 2
+    assert index.query(color="#FF6A13").sum() == 2
+    assert index.query(temperature=(230, 250)).sum() == 0
+    assert index.aggregate("filament_type") == {"PLA": {"count": 2, "weight": 500}}
+
+def test_update_only_decodes_changes(tmp_path, dumps):
+    build_index(dumps, tmp_path / "index")
+    os.remove(dumps / "spools" / "b.json")
+    (dumps / "c.bin").write_bytes((EXAMPLES / "exampleDump.bin").read_bytes())
+    assert build_index(dumps, tmp_path / "index") == (2, 1)
+
+def test_malformed_dumps_are_skipped(tmp_path, dumps):
+    #Files that look like dumps but aren't must not end the build
+    (dumps / "list.json").write_text("[1, 2]")
+    (dumps / "number.json").write_text(json.dumps({"blocks": {"0": 1234}}))
+    (dumps / "broken.json").write_text("{")
+    (dumps / "short.bin").write_bytes(bytes(100))
+
+    assert build_index(dumps, tmp_path / "index") == (6, 6)
+    index = DumpIndex(tmp_path / "index")
+    rows = list(index.rows(index.query()))
+    assert sorted(row["path"] for row in rows) == [os.path.join("spools", "a.bin"), os.path.join("spools", "b.json")]
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+# Tests for lib/keycache.py, with a counting stand-in for the key derivation
+
+import pytest
+
+from deriveKeys import kdf
+from lib.keycache import KeyCache, normalize_uid, pack_keys, unpack_keys
+
+UIDS = ["75066B1D", "75886B1D", "11223344", "55667788"]
+
+#kdf that records every UID it derives keys for
+class CountingKdf:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, uid):
+        self.calls.append(uid.hex().upper())
+        return kdf(uid)
+
+def test_keys_match_kdf():
+    cache = KeyCache()
+    for uid in UIDS:
+        assert cache.get(uid) == kdf(bytes.fromhex(uid))
+    assert unpack_keys(pack_keys(kdf(b"\x75\x06\x6b\x1d"))) == kdf(b"\x75\x06\x6b\x1d")
+
+def test_uid_forms():
+    derive = CountingKdf()
+    cache = KeyCache(derive=derive)
+    #pynfc hands out UIDs as hex bytestrings, the Proxmark3 as spaced hex
+    for uid in ("75066b1d", b"75066b1d", b"\x75\x06\x6b\x1d", "75 06 6B 1D"):
+        assert normalize_uid(uid) == "75066B1D"
+        assert cache.get(uid) == kdf(b"\x75\x06\x6b\x1d")
+    assert derive.calls == ["75066B1D"]
+
+def test_lru_eviction():
+    derive = CountingKdf()
+    cache = KeyCache(size=2, derive=derive)
+    cache.get(UIDS[0])
+    cache.get(UIDS[1])
+    #Using the first UID again makes the second the least recently used one
+    cache.get(UIDS[0])
+    cache.get(UIDS[2])
+    assert len(cache) == 2
+    assert UIDS[0] in cache and UIDS[2] in cache
+    assert UIDS[1] not in cache
+
+    cache.get(UIDS[1])
+    assert derive.calls == [UIDS[0], UIDS[1], UIDS[2], UIDS[1]]
+    assert UIDS[0] not in cache
+
+def test_counters():
+    cache = KeyCache(size=2)
+    cache.get(UIDS[0])
+    cache.get(UIDS[0])
+    cache.get(UIDS[1])
+    cache.get(UIDS[0])
+    assert cache.stats() == {"size": 2, "max_size": 2, "hits": 2, "disk_hits": 0, "misses": 2}
+
+    cache.clear()
+    assert len(cache) == 0
+    cache.get(UIDS[0])
+    assert cache.stats()["misses"] == 3
+
+def test_persistence(tmp_path):
+    path = tmp_path / "keys.db"
+    with KeyCache(path=path) as cache:
+        for uid in UIDS:
+            cache.get(uid)
+        assert cache.misses == len(UIDS)
+
+    #Another cache on the same file reads the keys back instead of deriving them
+    derive = CountingKdf()
+    with KeyCache(size=2, path=path, derive=derive) as cache:
+        assert UIDS[0] in cache
+        for uid in UIDS:
+            assert cache.get(uid) == kdf(bytes.fromhex(uid))
+        assert derive.calls == []
+        assert cache.stats() == {"size": 2, "max_size": 2, "hits": 0, "disk_hits": len(UIDS), "misses": 0}
+
+        #Evicted from memory, but still on disk
+        cache.get(UIDS[0])
+        assert cache.disk_hits == len(UIDS) + 1
+        cache.get(UIDS[0])
+        assert cache.hits == 1
+
+        cache.clear()
+        cache.get(UIDS[3])
+        assert derive.calls == []
+
+def test_invalid_size():
+    with pytest.raises(ValueError):
+        KeyCache(size=0)
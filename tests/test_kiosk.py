@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+# Tests for lib/kiosk.py
+
+import tarfile
+
+from lib.kiosk import UidStore, BoundedSet, RollingArchive
+
+#Names and contents of the files in a tar archive
+def read_tar(path):
+    with tarfile.open(path) as tar:
+        return [(member.name, tar.extractfile(member).read()) for member in tar.getmembers()]
+
+def test_uid_store_persists(tmp_path):
+    path = tmp_path / "uids.db"
+    store = UidStore(path)
+    store.add(b"75066b1d")
+    store.add("11223344")
+    store.add("11223344")
+    assert len(store) == 2
+    store.close()
+
+    #UIDs are matched whatever case or type they are given in
+    store = UidStore(path)
+    assert len(store) == 2
+    assert "75066B1D" in store and b"75066B1D" in store
+    assert b"11223344" in store
+    assert "55667788" not in store
+    store.close()
+
+def test_uid_store_in_memory():
+    store = UidStore()
+    store.add("11223344")
+    assert "11223344" in store
+    store.close()
+    assert "11223344" not in UidStore()
+
+def test_bounded_set_evicts_oldest():
+    items = BoundedSet(3)
+    for item in "abcd":
+        items.add(item)
+    assert len(items) == 3
+    assert "a" not in items
+    assert all(item in items for item in "bcd")
+
+    #Adding an item again makes it the most recent one
+    items.add("b")
+    items.add("e")
+    assert "c" not in items
+    assert all(item in items for item in "bde")
+
+    items.discard("d")
+    items.discard("x")
+    assert len(items) == 2
+
+def test_rolling_archive(tmp_path):
+    files = [(f"hf-tag-{i:08X}.bin", bytes([i]) * 1024) for i in range(5)]
+    with RollingArchive(tmp_path, max_entries=2) as archive:
+        for name, data in files:
+            archive.add(name, data)
+        #Every file is flushed as it is added, the open archive can already be read
+        assert read_tar(archive.current_path) == files[4:]
+
+    paths = sorted(tmp_path.iterdir())
+    assert [path.name for path in paths] == ["dumps-000001.tar", "dumps-000002.tar", "dumps-000003.tar"]
+    assert [read_tar(path) for path in paths] == [files[0:2], files[2:4], files[4:]]
+
+def test_rolling_archive_never_appends(tmp_path):
+    with RollingArchive(tmp_path, prefix="spools") as archive:
+        archive.add("first.bin", b"1" * 16)
+
+    #A later run starts a tar file of its own
+    with RollingArchive(tmp_path, prefix="spools") as archive:
+        archive.add("second.bin", b"2" * 16)
+        assert archive.current_path == str(tmp_path / "spools-000002.tar")
+
+    assert read_tar(tmp_path / "spools-000001.tar") == [("first.bin", b"1" * 16)]
+    assert read_tar(tmp_path / "spools-000002.tar") == [("second.bin", b"2" * 16)]
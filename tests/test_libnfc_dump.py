@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+# Tests for the dumping station of libnfc_dump.py, with a stand-in for pynfc
+# Every tag only opens its sectors to the key A derived from its UID, like a Bambu Lab tag
+
+import sys
+import types
+import ctypes
+import threading
+
+import pytest
+
+from conftest import EXAMPLES
+from deriveKeys import kdf
+from lib.keycache import KeyCache
+
+class TimeoutException(Exception):
+    pass
+
+class Mifare:
+    def __init__(self, dump, flaky_blocks=()):
+        self.dump = bytes(dump)
+        self.uid = self.dump[:4].hex().encode()
+        self.target = self
+        self.sector = None
+        self.halted = False     #A failed authentication or read halts the tag until it is selected again
+        self.flaky_blocks = dict(flaky_blocks)    #Block -> number of reads of it that fail
+
+def mifare_classic_connect(tag):
+    tag.sector = None
+    tag.halted = False
+    return 0
+
+def mifare_classic_disconnect(tag):
+    tag.sector = None
+    return 0
+
+def mifare_classic_authenticate(tag, block, key, key_type):
+    trailer = (block | 3) * 16
+    tag.sector = block // 4 if not tag.halted and bytes(key) == tag.dump[trailer:trailer + 6] else None
+    tag.halted = tag.sector is None
+    return 0 if tag.sector is not None else -1
+
+#Sector trailers read back with their keys blanked, like a real tag
+def mifare_classic_read(tag, block, buf):
+    if tag.sector != block // 4:
+        return -1
+    if tag.flaky_blocks.get(block):
+        tag.flaky_blocks[block] -= 1
+        tag.sector = None
+        tag.halted = True
+        return -1
+    data = bytearray(tag.dump[block * 16:(block + 1) * 16])
+    if block % 4 == 3:
+        data[0:6] = data[10:16] = bytes(6)
+    ctypes.memmove(buf, bytes(data), 16)
+    return 0
+
+# Presents every tag `presences` polls in a row, then times out
+class Nfc:
+    def __init__(self, tags, presences=2):
+        self.tags = tags
+        self.presences = presences
+
+    def poll(self):
+        for tag in self.tags:
+            for _ in range(self.presences):
+                yield tag
+        raise TimeoutException()
+
+pynfc = types.ModuleType("pynfc")
+pynfc.Nfc = Nfc
+pynfc.TimeoutException = TimeoutException
+pynfc.nfc = types.ModuleType("pynfc.nfc")
+pynfc.nfc.uint8_t = ctypes.c_ubyte
+pynfc.nfc.MFC_KEY_A, pynfc.nfc.MFC_KEY_B = 0, 1
+for function in (mifare_classic_connect, mifare_classic_disconnect, mifare_classic_authenticate, mifare_classic_read):
+    setattr(pynfc.nfc, function.__name__, function)
+sys.modules["pynfc"] = pynfc
+sys.modules["pynfc.nfc"] = pynfc.nfc
+
+import libnfc_dump
+from libnfc_dump import DumpStation
+
+#The example dump with another UID, and the keys derived from that UID in its sector trailers
+def make_dump(uid):
+    dump = bytearray((EXAMPLES / "exampleDump.bin").read_bytes())
+    dump[0:4] = uid
+    dump[4] = uid[0] ^ uid[1] ^ uid[2] ^ uid[3]
+    keys = kdf(uid)
+    for sector in range(16):
+        trailer = (sector * 4 + 3) * 16
+        dump[trailer:trailer + 6] = keys[0][sector]
+        dump[trailer + 10:trailer + 16] = keys[1][sector]
+    return bytes(dump)
+
+DUMPS = [make_dump(bytes([0x10 + i, 0x22, 0x33, 0x44])) for i in range(4)]
+
+#Run a station with one polling thread per reader until every reader timed out
+def run_station(station, readers):
+    writer = threading.Thread(target=station.write_dumps)
+    writer.start()
+    pollers = [threading.Thread(target=station.poll, args=(f"reader{i}", nfc)) for i, nfc in enumerate(readers)]
+    for poller in pollers:
+        poller.start()
+    for poller in pollers:
+        poller.join()
+    station.write_queue.put(None)
+    writer.join()
+
+def read_output(path, dump):
+    return (path / f"hf-tag-{dump[:4].hex().upper()}.bin").read_bytes()
+
+def test_dumps_every_tag_once(tmp_path, capsys):
+    station = DumpStation(KeyCache(), str(tmp_path))
+    run_station(station, [Nfc([Mifare(dump) for dump in DUMPS], presences=3)])
+
+    assert station.dumped_count == len(DUMPS)
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(f"hf-tag-{d[:4].hex().upper()}.bin" for d in DUMPS)
+    for dump in DUMPS:
+        assert read_output(tmp_path, dump) == dump
+    #Presences after the dump is complete are only reported once
+    assert capsys.readouterr().out.count("Already read tag") == len(DUMPS)
+
+def test_several_readers(tmp_path):
+    #Every spool passes over all three readers, each UID is still only dumped once
+    station = DumpStation(KeyCache(), str(tmp_path))
+    run_station(station, [Nfc([Mifare(dump) for dump in DUMPS]) for _ in range(3)])
+
+    assert station.dumped_count == len(DUMPS)
+    assert not station.dump and not station.reading
+    for dump in DUMPS:
+        assert read_output(tmp_path, dump) == dump
+
+def test_resume_on_next_presence(tmp_path, capsys):
+    #Block 10 can't be read during the whole first presence, which leaves blocks 10 and 11 of sector 2
+    #The second presence only reads those
+    tag = Mifare(DUMPS[0], flaky_blocks={10: libnfc_dump.READ_ATTEMPTS})
+    station = DumpStation(KeyCache(), str(tmp_path))
+    run_station(station, [Nfc([tag], presences=2)])
+
+    out = capsys.readouterr().out
+    assert "Resuming tag" in out
+    assert "Read 62 blocks" in out
+    assert "Read 2 blocks" in out
+    assert station.dumped_count == 1
+    assert read_output(tmp_path, DUMPS[0]) == DUMPS[0]
+
+def test_skips_other_tags(tmp_path, capsys):
+    station = DumpStation(KeyCache(), str(tmp_path))
+    station.handle_tag(types.SimpleNamespace(uid=b"11223344"), "reader0")
+    assert "Non-MIFARE tag" in capsys.readouterr().out
+    assert station.dumped_count == 0
+
+#A tag whose sector 12 doesn't open to the derived key
+def foreign_dump():
+    dump = bytearray(DUMPS[1])
+    dump[(12 * 4 + 3) * 16:(12 * 4 + 3) * 16 + 6] = bytes.fromhex("FFFFFFFFFFFF")
+    return bytes(dump)
+
+def test_sector_given_up_after_presences(tmp_path, capsys):
+    dump = foreign_dump()
+    station = DumpStation(KeyCache(), str(tmp_path))
+    run_station(station, [Nfc([Mifare(dump)], presences=libnfc_dump.AUTH_PRESENCES - 1)])
+    #A couple of bad presences don't cost the sector yet
+    assert station.dumped_count == 0
+    assert list(tmp_path.iterdir()) == []
+
+    run_station(station, [Nfc([Mifare(dump)], presences=1)])
+    assert "Giving up on sector 12 after" in capsys.readouterr().out
+    #An incomplete dump doesn't count as dumped
+    assert station.dumped_count == 0
+
+    #The blocks of the sector are written as zeros, so every other block keeps its offset
+    data = (tmp_path / f"hf-tag-{dump[:4].hex().upper()}-incomplete.bin").read_bytes()
+    assert len(data) == 1024
+    assert data[12 * 64:13 * 64] == bytes(64)
+    assert data[:12 * 64] == dump[:12 * 64]
+    assert data[13 * 64:] == dump[13 * 64:]
+
+    #The tag isn't remembered as dumped, it is read again when it comes back
+    assert dump[:4].hex().encode() not in station.dumped_ids
+    run_station(station, [Nfc([Mifare(dump)], presences=1)])
+    assert "Tag UID: " + dump[:4].hex() in capsys.readouterr().out
+
+#After a sector that couldn't be authenticated the tag is selected again, so the next sector
+#doesn't lose an attempt to the halted tag
+def test_reselect_after_failed_sector(tmp_path, capsys):
+    dump = foreign_dump()
+    station = DumpStation(KeyCache(), str(tmp_path))
+    run_station(station, [Nfc([Mifare(dump)], presences=1)])
+    out = capsys.readouterr().out
+    assert "Authentication failed for sector 12" in out
+    assert "Authentication failed for sector 13" not in out
+    assert station.dump[dump[:4].hex().encode()]['blocks'][13 * 4] is not None
+
+def test_given_up_tag_skipped_until_it_leaves(tmp_path, capsys):
+    dump = foreign_dump()
+    station = DumpStation(KeyCache(), str(tmp_path))
+    #The tag stays on the reader long after it was given up, then another tag takes its place
+    run_station(station, [Nfc([Mifare(dump)] * (libnfc_dump.AUTH_PRESENCES + 5) + [Mifare(DUMPS[0])], presences=1)])
+    out = capsys.readouterr().out
+    assert out.count("Tag UID: " + dump[:4].hex()) == 1
+    assert out.count("the dump is incomplete") == 1
+    assert station.dumped_count == 1
+    assert dump[:4].hex().encode() not in station.given_up_ids
+
+    #Back on the reader after it left, the tag is read again
+    run_station(station, [Nfc([Mifare(DUMPS[0]), Mifare(dump)], presences=1)])
+    assert "Tag UID: " + dump[:4].hex() in capsys.readouterr().out
+
+def test_keys_derived_outside_lock(tmp_path):
+    #Deriving the keys of the first tag blocks until the test lets it go on
+    slow_uid = DUMPS[0][:4]
+    deriving = threading.Event()
+    proceed = threading.Event()
+    def derive(uid):
+        if uid == slow_uid:
+            deriving.set()
+            assert proceed.wait(10)
+        return kdf(uid)
+
+    station = DumpStation(KeyCache(derive=derive), str(tmp_path))
+    slow = threading.Thread(target=station.claim, args=(slow_uid.hex().encode(), "reader0"))
+    slow.start()
+    try:
+        assert deriving.wait(10)
+        #Other readers carry on with other tags, and don't pick up the tag that is being set up
+        assert station.claim(DUMPS[1][:4].hex().encode(), "reader1") is not None
+        assert station.claim(slow_uid.hex().encode(), "reader2") is None
+    finally:
+        proceed.set()
+        slow.join()
+    assert slow_uid.hex().encode() in station.dump
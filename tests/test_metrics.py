@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+# Tests for lib/metrics.py
+
+import json
+
+import pytest
+
+from lib import metrics
+
+@pytest.fixture
+def enabled(monkeypatch):
+    monkeypatch.setattr(metrics, "enabled", True)
+    metrics.reset()
+    yield
+    metrics.reset()
+
+@pytest.fixture
+def disabled(monkeypatch):
+    monkeypatch.setattr(metrics, "enabled", False)
+    metrics.reset()
+    yield
+    metrics.reset()
+
+def double(x):
+    return x * 2
+
+def test_disabled_is_a_no_op(disabled):
+    #timed() hands back the function itself, and timer() one shared context manager
+    assert metrics.timed("double_seconds")(double) is double
+    assert metrics.timer("a_seconds") is metrics.timer("b_seconds", label=1)
+    with metrics.timer("a_seconds"):
+        pass
+    metrics.observe("a_seconds", 1.0)
+    metrics.count("a_total")
+    assert metrics.snapshot() == {"histograms": {}, "counters": {}}
+
+def test_timed(enabled):
+    timed_double = metrics.timed("double_seconds", kind="test")(double)
+    assert timed_double is not double
+    assert timed_double.__name__ == "double"
+    assert timed_double(2) == 4
+    assert timed_double(3) == 6
+    [histogram] = metrics.snapshot()["histograms"]["double_seconds"]
+    assert histogram["labels"] == {"kind": "test"}
+    assert histogram["count"] == 2
+
+def test_bucket_placement(enabled):
+    #A value on a bound belongs to that bucket, like Prometheus' "le"
+    for seconds in (0.0001, 0.0005, 0.001, 0.0011, 600, 601):
+        metrics.observe("a_seconds", seconds)
+    [histogram] = metrics.snapshot()["histograms"]["a_seconds"]
+    buckets = {bound: n for bound, n in histogram["buckets"].items() if n}
+    assert buckets == {"0.0005": 2, "0.001": 1, "0.0025": 1, "600": 1, "+Inf": 1}
+    assert histogram["count"] == 6
+    assert histogram["min"] == 0.0001 and histogram["max"] == 601
+    assert histogram["sum"] == pytest.approx(1201.0027)
+
+def test_json_export(enabled, tmp_path):
+    metrics.observe("a_seconds", 0.2, program="pm3")
+    metrics.count("failures_total", program="pm3", reason="timeout")
+    metrics.count("failures_total", 2, program="pm3", reason="timeout")
+    metrics.count("failures_total", program="pm3", reason="exit")
+
+    path = tmp_path / "metrics.json"
+    metrics.export(str(path))
+    data = json.loads(path.read_text())
+    assert data == metrics.snapshot()
+    assert data["counters"]["failures_total"] == [
+        {"labels": {"program": "pm3", "reason": "exit"}, "value": 1},
+        {"labels": {"program": "pm3", "reason": "timeout"}, "value": 3},
+    ]
+    [histogram] = data["histograms"]["a_seconds"]
+    assert histogram["labels"] == {"program": "pm3"}
+    assert histogram["buckets"]["0.25"] == 1
+
+def test_prometheus_export(enabled, tmp_path):
+    metrics.observe("a_seconds", 0.003)
+    metrics.observe("a_seconds", 2)
+    metrics.count("failures_total", program="pm3")
+
+    path = tmp_path / "metrics.prom"
+    metrics.export(str(path))
+    lines = path.read_text().splitlines()
+    assert lines[0] == "# TYPE rfid_a_seconds histogram"
+    #Buckets are cumulative
+    assert 'rfid_a_seconds_bucket{le="0.0025"} 0' in lines
+    assert 'rfid_a_seconds_bucket{le="0.005"} 1' in lines
+    assert 'rfid_a_seconds_bucket{le="2.5"} 2' in lines
+    assert 'rfid_a_seconds_bucket{le="+Inf"} 2' in lines
+    assert "rfid_a_seconds_sum 2.003" in lines
+    assert "rfid_a_seconds_count 2" in lines
+    assert "# TYPE rfid_failures_total counter" in lines
+    assert 'rfid_failures_total{program="pm3"} 1' in lines
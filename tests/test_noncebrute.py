@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+# Tests for lib/noncebrute.py, recovering the keys of the trace in examples/
+# A full nested search takes several seconds, so nested keys are recovered from their true tag nonce
+
+import time
+import asyncio
+import threading
+
+import pytest
+
+from conftest import EXAMPLES
+from deriveKeys import kdf
+from lib.crypto1 import Crypto1
+from lib.noncebrute import nonce_brute, nonce_brute_args, nonce_candidates, prng_nonces, try_nonce
+from lib.trace import read_auths
+
+AUTHS = list(read_auths(EXAMPLES / "exampleTrace.trace"))
+KEYS_A, _ = kdf(bytes.fromhex("75066B1D"))
+
+#Decrypt the tag nonce of a nested authentication with its known key
+def true_nonce(auth, key):
+    return auth.nt ^ Crypto1(key).word(auth.cuid ^ auth.nt, True)
+
+def test_prng_nonces():
+    nonces = prng_nonces()
+    assert len(nonces) == 65535
+    assert len(set(nonces.tolist())) == 65535
+
+def test_plain_auth():
+    auth = AUTHS[0]
+    key = nonce_brute(auth.cuid, auth.nt, None, auth.nr_enc, auth.ar_enc, None, auth.at_enc, None, nested=False)
+    assert key == int(KEYS_A[0].hex(), 16)
+
+def test_plain_auth_args():
+    assert nonce_brute_args(AUTHS[0].brute_args(), nested=False) == KEYS_A[0].hex()
+
+def test_nested_nonce_candidates():
+    auth = AUTHS[1]
+    candidates = nonce_candidates(auth.nt, auth.nt_par_err, auth.ar_enc, auth.ar_par_err, auth.at_enc, auth.at_par_err)
+    #The parity errors rule out all but a few of the 65535 nonces, never the true one
+    assert true_nonce(auth, KEYS_A[1]) in candidates
+    assert len(candidates) < 256
+
+def test_nested_try_nonce():
+    auth = AUTHS[1]
+    nt = true_nonce(auth, KEYS_A[1])
+    assert try_nonce(auth.cuid, nt, auth.nt, auth.nr_enc, auth.ar_enc, auth.at_enc) == int(KEYS_A[1].hex(), 16)
+
+    wrong = next(c for c in nonce_candidates(auth.nt, auth.nt_par_err, auth.ar_enc, auth.ar_par_err, auth.at_enc, auth.at_par_err) if c != nt)
+    assert try_nonce(auth.cuid, wrong, auth.nt, auth.nr_enc, auth.ar_enc, auth.at_enc) is None
+
+def test_nested_timeout():
+    #Running out of time isn't an error, no key is returned
+    assert nonce_brute_args(AUTHS[1].brute_args(), timeout=0.2) == ""
+
+#A nested authentication with a corrupted {nr}: no candidate nonce gives a key, so the whole
+#search runs (tens of seconds on one core) unless it is stopped
+def unsolvable_args():
+    args = AUTHS[1].brute_args()
+    args[3] = f"{int(args[3], 16) ^ 1:08x}"
+    return args
+
+@pytest.mark.parametrize("jobs", [1, None])
+def test_nested_stop(jobs):
+    stop = threading.Event()
+    threading.Timer(0.5, stop.set).start()
+    start = time.monotonic()
+    assert nonce_brute_args(unsolvable_args(), jobs=jobs, stop=stop) == ""
+    assert time.monotonic() - start < 5
+
+#Cancelling a job of traceKeyExtractor stops the built-in search, instead of leaving it running
+#until asyncio.run can shut down its executor
+def test_cancel_builtin_brute_force(monkeypatch):
+    import traceKeyExtractor
+    monkeypatch.setattr(traceKeyExtractor, "pm3Location", None)
+    monkeypatch.setattr(traceKeyExtractor, "bruteForceJobs", 1)
+
+    async def cancelled():
+        task = asyncio.ensure_future(traceKeyExtractor.bruteForceAsync(unsolvable_args()))
+        await asyncio.sleep(0.5)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return True
+        return False
+
+    start = time.monotonic()
+    assert asyncio.run(cancelled())
+    assert time.monotonic() - start < 5
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+# Tests for lib/proxmark3.py, against a scripted stand-in for the pm3 client
+
+import sys
+import textwrap
+
+import pytest
+
+from lib.proxmark3 import Proxmark3Session, Proxmark3Error
+
+# Reads commands from stdin like the pm3 client does: every command is echoed after the prompt
+# (with the color codes of the real client), then answered
+FAKE_PM3 = textwrap.dedent(r"""
+    import sys, time
+
+    PROMPT = "\x1b[0m[usb|script] pm3 --> "
+    print("[=] Session log /tmp/fake.log")
+    print("[+] Using UART port /dev/ttyACM0", flush=True)
+    for line in sys.stdin:
+        command = line.strip()
+        print(PROMPT + command, flush=True)
+        if command == "quit":
+            break
+        elif command.startswith("rem "):
+            print("[+] " + command[4:])
+        elif command == "hw version":
+            print("[ Proxmark3 RFID instrument ]")
+            print("  client: RRG/Iceman/master/v4.18994")
+        elif command == "hf mf info":
+            print("[+] UID: 75 06 6B 1D")
+        elif command.startswith("msleep "):
+            time.sleep(int(command[7:]) / 1000)
+        elif command == "hw ping":
+            time.sleep(30)
+        elif command == "hw reset":
+            sys.exit(3)
+        else:
+            print("[!] unknown command: " + command)
+        sys.stdout.flush()
+""")
+
+@pytest.fixture
+def fake_pm3(tmp_path):
+    path = tmp_path / "pm3.py"
+    path.write_text(FAKE_PM3)
+    return [sys.executable, path]
+
+def test_command_output(fake_pm3):
+    with Proxmark3Session(fake_pm3) as pm3:
+        #The startup banner and the echoed prompts and markers are not part of any reply
+        assert pm3.command("hw version") == "[ Proxmark3 RFID instrument ]\n  client: RRG/Iceman/master/v4.18994"
+        assert pm3.command("hf mf info") == "[+] UID: 75 06 6B 1D"
+        assert pm3.running
+    assert not pm3.running
+
+def test_commands_keep_one_client(fake_pm3):
+    with Proxmark3Session(fake_pm3) as pm3:
+        process = pm3.process
+        outputs = pm3.commands(["hf mf info", "hw version", "hf mf info"])
+        assert outputs[0] == outputs[2] == "[+] UID: 75 06 6B 1D"
+        assert outputs[1].startswith("[ Proxmark3")
+        assert pm3.process is process
+
+#A command that prints nothing gets an empty reply, and doesn't take the reply of the next one
+def test_empty_reply(fake_pm3):
+    with Proxmark3Session(fake_pm3) as pm3:
+        assert pm3.command("msleep 10") == ""
+        assert pm3.command("hw version").startswith("[ Proxmark3")
+        assert pm3.commands(["msleep 10", "hf mf info", "msleep 10"]) == ["", "[+] UID: 75 06 6B 1D", ""]
+
+def test_timeout_restarts_client(fake_pm3):
+    with Proxmark3Session(fake_pm3) as pm3:
+        with pytest.raises(TimeoutError):
+            pm3.command("hw ping", timeout=0.5)
+        assert not pm3.running
+        #The client was in an unknown state, the next command starts a new one
+        assert pm3.command("hf mf info") == "[+] UID: 75 06 6B 1D"
+
+def test_client_exit(fake_pm3):
+    with Proxmark3Session(fake_pm3, timeout=10) as pm3:
+        with pytest.raises(Proxmark3Error, match="exited"):
+            pm3.command("hw reset")
+
+def test_start_failure(tmp_path):
+    with pytest.raises(Proxmark3Error, match="Could not start"):
+        Proxmark3Session([tmp_path / "missing" / "pm3"]).start()
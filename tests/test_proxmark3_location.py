@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+# Tests for the cached Proxmark3 location of lib/__init__.py, with a stand-in for the search
+
+import os
+
+import pytest
+
+import lib
+from lib import get_proxmark3_location, proxmark3_cache_path
+
+#A Proxmark3 installation with a pm3 command, and a search that finds it and counts its runs
+@pytest.fixture
+def install(tmp_path, monkeypatch):
+    location = tmp_path / "proxmark3"
+    (location / "bin").mkdir(parents=True)
+    (location / "bin" / "pm3").write_text("#!/bin/sh\n")
+    searches = []
+    def find():
+        searches.append(location)
+        return location
+    monkeypatch.setattr(lib, "find_proxmark3_location", find)
+    monkeypatch.setenv("PROXMARK3_CACHE", str(tmp_path / "cache" / "proxmark3.json"))
+    monkeypatch.setenv("PROXMARK3_DIR", str(location))
+    monkeypatch.setenv("PATH", "/usr/bin:/bin")
+    return location, searches
+
+def test_cached(install):
+    location, searches = install
+    assert get_proxmark3_location() == location
+    assert proxmark3_cache_path().exists()
+    assert get_proxmark3_location() == location
+    assert len(searches) == 1
+
+    #A refresh searches again, and caches what it found
+    assert get_proxmark3_location(refresh=True) == location
+    assert get_proxmark3_location() == location
+    assert len(searches) == 2
+
+def test_pm3_changed(install):
+    location, searches = install
+    pm3 = location / "bin" / "pm3"
+    get_proxmark3_location()
+
+    #An upgraded client has another modification time...
+    st = os.stat(pm3)
+    os.utime(pm3, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    get_proxmark3_location()
+    assert len(searches) == 2
+
+    #...or another size
+    with open(pm3, "a") as fp:
+        fp.write("exit 0\n")
+    os.utime(pm3, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    get_proxmark3_location()
+    assert len(searches) == 3
+
+    #A removed client is searched for again
+    pm3.unlink()
+    get_proxmark3_location()
+    assert len(searches) == 4
+
+@pytest.mark.parametrize("variable", ["PATH", "PROXMARK3_DIR"])
+def test_environment_changed(install, monkeypatch, variable):
+    location, searches = install
+    get_proxmark3_location()
+    monkeypatch.setenv(variable, "/opt/elsewhere")
+    get_proxmark3_location()
+    assert len(searches) == 2
+    get_proxmark3_location()
+    assert len(searches) == 2
+
+@pytest.mark.parametrize("contents", ["", "{", "[]", '{"location": 5}', '{"environment": {}}'])
+def test_corrupt_cache(install, contents):
+    location, searches = install
+    cache = proxmark3_cache_path()
+    cache.parent.mkdir(parents=True)
+    cache.write_text(contents)
+    assert get_proxmark3_location() == location
+    assert len(searches) == 1
+    #The broken file is replaced by a good one
+    assert get_proxmark3_location() == location
+    assert len(searches) == 1
+
+def test_cache_disabled(install, monkeypatch, tmp_path):
+    location, searches = install
+    monkeypatch.setenv("PROXMARK3_CACHE", "")
+    assert proxmark3_cache_path() is None
+    assert get_proxmark3_location() == location
+    assert get_proxmark3_location() == location
+    assert len(searches) == 2
+    assert not (tmp_path / "cache").exists()
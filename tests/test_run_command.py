@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+# Tests for run_command of lib/__init__.py
+
+import sys
+import subprocess
+
+from lib import run_command, running_processes
+
+def python(code):
+    return [sys.executable, "-c", code]
+
+def test_output_and_exit_codes():
+    assert run_command(python("print('done\\r')")) == "done"
+    assert run_command(python("print('done'); raise SystemExit(1)")) == "done"
+    assert run_command(python("raise SystemExit(3)")) is None
+    assert run_command(python("pass"), pipe=False) == ""
+
+def test_timeout():
+    assert run_command(python("import time; time.sleep(30)"), timeout=0.5) is None
+    assert not running_processes
+
+#A command that fails while it is waited on is killed and reaped, not left behind as a zombie
+def test_error_reaps_process(monkeypatch):
+    processes = []
+    communicate = subprocess.Popen.communicate
+    def failing_communicate(self, *args, **kwargs):
+        if not processes:
+            processes.append(self)
+            raise OSError("broken pipe")
+        return communicate(self, *args, **kwargs)
+    monkeypatch.setattr(subprocess.Popen, "communicate", failing_communicate)
+
+    assert run_command(python("import time; time.sleep(30)")) is None
+    [process] = processes
+    assert process.returncode is not None
+    assert not running_processes
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+# Tests for lib/trace.py, against the trace in examples/
+
+from conftest import EXAMPLES
+from lib.trace import HEADER, Frame, crc_a, check_crc, parity_length, read_frames, read_auths
+
+TRACE = EXAMPLES / "exampleTrace.trace"
+
+def test_parity_length():
+    assert [parity_length(n) for n in (0, 1, 8, 9, 16, 17)] == [1, 1, 1, 2, 2, 3]
+
+def test_crc_a():
+    #HALT command, as sent by every reader
+    assert crc_a(bytes.fromhex("5000")) == bytes.fromhex("57CD")
+    assert check_crc(bytes.fromhex("500057CD"))
+    assert not check_crc(bytes.fromhex("500057CE"))
+
+def test_read_frames():
+    frames = list(read_frames(TRACE))
+    assert len(frames) == 191
+    assert frames[0] == Frame(131942403, 992, False, b"\x52", b"\x00")
+    assert frames[1] == Frame(131944647, 2368, True, b"\x04\x00", b"\x40")
+
+def test_read_frames_from_bytes_ignores_truncated_record():
+    data = TRACE.read_bytes()
+    frames = list(read_frames(data))
+    #A record cut short, as at the end of a trace that is still being written, is left out
+    assert list(read_frames(data[:-1])) == frames[:-1]
+    assert list(read_frames(data[:HEADER.size - 1])) == []
+
+def test_read_auths():
+    auths = list(read_auths(TRACE))
+    assert len(auths) == 17
+    assert [auth.nested for auth in auths] == [False] + [True] * 15 + [False]
+    assert all(auth.uid == 0x75066B1D for auth in auths)
+
+    first = auths[0]
+    assert (first.key_type, first.block, first.sector) == ("A", 3, 0)
+    assert first.nt == 0xCD3AF1DA
+    assert first.brute_args() == [
+        "75066b1d", "cd3af1da", "0000", "8d92dadc", "12714fef", "0001", "453bdb0d", "1110", "93261ba1",
+    ]
+
+    #Nested authentications are encrypted, so their key type and block aren't known
+    nested = auths[1]
+    assert (nested.key_type, nested.block, nested.sector) == (None, None, None)
+    assert nested.brute_args() == [
+        "75066b1d", "828a301b", "1100", "d79f20fb", "9815e69f", "0011", "11a03116", "0110", "b6b5d201",
+    ]
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+# Tests for lib/validate.py, checking broken copies of the example dump
+
+import json
+
+import pytest
+
+from conftest import EXAMPLES
+from lib.bambu import bin_to_json
+from lib.dumparchive import read_dump
+from lib.validate import validate, validate_corpus
+
+EXAMPLE = (EXAMPLES / "exampleDump.bin").read_bytes()
+NAME = "hf-mf-75886B1D-dump.bin"
+
+def checks(result):
+    return [issue["check"] for issue in result["issues"]]
+
+def changed(offset, value):
+    data = bytearray(EXAMPLE)
+    data[offset:offset + len(value)] = value
+    return bytes(data)
+
+def test_valid_dump():
+    assert validate(NAME, EXAMPLE)["issues"] == []
+    result = validate("hf-mf-75886B1D-dump.json", bin_to_json(EXAMPLE).encode())
+    assert result["uid"] == "75886B1D"
+    assert result["issues"] == []
+
+def test_bcc():
+    result = validate(NAME, changed(4, b"\x00"))
+    assert checks(result) == ["bcc"]
+    assert result["issues"][0]["block"] == 0
+
+def test_keys():
+    result = validate(NAME, changed((5 * 4 + 3) * 16, bytes(6)))
+    assert checks(result) == ["key_a"]
+    assert result["issues"][0]["sector"] == 5
+
+    #Key B is usually not read, it is only checked when it is there, or with strict
+    assert validate(NAME, EXAMPLE, strict=True)["issues"][0]["check"] == "key_b"
+    assert checks(validate(NAME, changed((2 * 4 + 3) * 16 + 10, b"\x01" * 6))) == ["key_b"]
+
+def test_access_bits():
+    malformed = validate(NAME, changed((7 * 4 + 3) * 16 + 6, bytes.fromhex("FF0780")[::-1]))
+    assert checks(malformed) == ["access_bits"]
+    assert "malformed" in malformed["issues"][0]["message"]
+    #Transport configuration: well formed, but not what Bambu Lab tags use
+    unexpected = validate(NAME, changed((7 * 4 + 3) * 16 + 6, bytes.fromhex("FF0780")))
+    assert checks(unexpected) == ["access_bits"]
+    assert "expected 87878769" in unexpected["issues"][0]["message"]
+
+def test_truncated_bin():
+    result = validate(NAME, EXAMPLE[:1000])
+    assert checks(result) == ["length", "missing"]
+    assert result["issues"][1]["blocks"] == [62, 63]
+
+def test_uid_mismatch():
+    assert checks(validate("hf-mf-11223344-dump.bin", EXAMPLE)) == ["uid"]
+
+@pytest.mark.parametrize("blocks", [
+    {"5": "0011"},
+    {"-1": "00" * 16},
+    {"x": "00" * 16},
+    {"5": 5},
+    {"5": "zz" * 16},
+])
+def test_malformed_json(blocks):
+    data = json.dumps({"blocks": blocks}).encode()
+    result = validate("dump.json", data)
+    assert checks(result) == ["format"]
+    #Dumps that don't pass validation don't get into an archive either
+    with pytest.raises(ValueError):
+        read_dump("dump.json", data)
+
+def test_json_missing_blocks():
+    dump = json.loads(bin_to_json(EXAMPLE))
+    del dump["blocks"]["61"]
+    result = validate("dump.json", json.dumps(dump).encode())
+    assert checks(result) == ["missing"]
+    assert result["issues"][0]["blocks"] == [61]
+
+def test_validate_corpus(tmp_path):
+    (tmp_path / NAME).write_bytes(EXAMPLE)
+    (tmp_path / "short.bin").write_bytes(EXAMPLE[:512])
+    (tmp_path / "notes.txt").write_text("not a dump")
+    results = {result["path"]: checks(result) for result in validate_corpus([tmp_path], jobs=1)}
+    assert results == {str(tmp_path / NAME): [], str(tmp_path / "short.bin"): ["length", "missing"]}
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+# Tests for the batch mode of writeTag.py, against a scripted stand-in for the pm3 client
+# The stand-in emulates a stack of blank Gen 4 FUID tags: a tag is written with `hf mf restore`,
+# read back with `hf mf dump`, and replaced by the next blank tag once it was seen after writing.
+
+import sys
+import json
+import builtins
+import textwrap
+
+import pytest
+
+from conftest import EXAMPLES
+import writeTag
+
+FAKE_PM3 = textwrap.dedent(r"""
+    import os, sys, json, shlex
+
+    PROMPT = "[usb|script] pm3 --> "
+    blanks = json.loads(os.environ["FAKE_PM3_BLANKS"])
+    corrupt = int(os.environ["FAKE_PM3_CORRUPT"])      # Block the next written tag gets wrong
+    tags = [bytes.fromhex(uid) + bytes(1020) for uid in blanks]
+    written = False
+
+    for line in sys.stdin:
+        command = line.strip()
+        print(PROMPT + command)
+        args = shlex.split(command)
+        if command == "quit":
+            break
+        elif command.startswith("rem "):
+            print("[+] " + command[4:])
+        elif command == "hf 14a reader":
+            if tags:
+                print("[+]  UID: " + " ".join(f"{b:02X}" for b in tags[0][:4]))
+                if written:
+                    tags.pop(0)
+                    written = False
+            else:
+                print("[!] iso14443a card select failed")
+        elif command == "hf mf gdmcfg":
+            print("[+] Config... 85 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 00 08")
+        elif args[:3] == ["hf", "mf", "restore"]:
+            data = bytearray(open(args[args.index("-f") + 1], "rb").read())
+            if corrupt >= 0:
+                data[corrupt * 16] ^= 0xFF
+                corrupt = -1
+            tags[0] = bytes(data)
+            print("[=] Done!")
+        elif args[:3] == ["hf", "mf", "dump"]:
+            for block in range(64):
+                row = " ".join(f"{b:02X}" for b in tags[0][block * 16:block * 16 + 16])
+                print(f"[=] {block // 4:3} | {block:3} | {row} | ................")
+            written = True
+        else:
+            print("[!] unknown command: " + command)
+        sys.stdout.flush()
+""")
+
+BLANKS = ["04A1B2C3", "04A1B2C4", "04A1B2C5"]
+
+#Three copies of the example dump with their own UIDs, and a manifest listing them
+@pytest.fixture
+def manifest(tmp_path):
+    example = (EXAMPLES / "exampleDump.bin").read_bytes()
+    lines = ["dump,keyfile"]
+    for i in range(3):
+        dump = tmp_path / "dumps dir" / f"spool {i}.bin"
+        dump.parent.mkdir(exist_ok=True)
+        dump.write_bytes(bytes([0x11 * (i + 1), 0x22, 0x33, 0x44]) + example[4:])
+        dump.with_suffix(".key").write_bytes(bytes(192))
+        lines.append(f"dumps dir/spool {i}.bin,dumps dir/spool {i}.key")
+    path = tmp_path / "manifest.csv"
+    path.write_text("\n".join(lines) + "\n")
+    return path
+
+#Install the stand-in as pm3Location / pm3Command
+def install_pm3(tmp_path, monkeypatch, corrupt=-1):
+    pm3 = tmp_path / "pm3" / "bin" / "pm3"
+    pm3.parent.mkdir(parents=True)
+    pm3.write_text(f"#!{sys.executable}\n{FAKE_PM3}")
+    pm3.chmod(0o755)
+    monkeypatch.setattr(writeTag, "pm3Location", tmp_path / "pm3")
+    monkeypatch.setattr(writeTag, "tagPollInterval", 0)
+    monkeypatch.setenv("FAKE_PM3_BLANKS", json.dumps(BLANKS))
+    monkeypatch.setenv("FAKE_PM3_CORRUPT", str(corrupt))
+    monkeypatch.setattr(builtins, "input", lambda prompt="": "y")
+
+def test_read_manifest(manifest):
+    entries = writeTag.readManifest(manifest)
+    assert len(entries) == 3
+    assert entries[0] == (str(manifest.parent / "dumps dir" / "spool 0.bin"), str(manifest.parent / "dumps dir" / "spool 0.key"))
+
+def test_read_manifest_without_keyfile(tmp_path):
+    path = tmp_path / "manifest.csv"
+    path.write_text("spool.bin\n")
+    with pytest.raises(ValueError, match="no key file"):
+        writeTag.readManifest(path)
+
+def test_block_hashes_ignore_keys():
+    trailer = bytes.fromhex("FFFFFFFFFFFF 87878769 FFFFFFFFFFFF".replace(" ", ""))
+    assert writeTag.blockHashes({3: trailer}) == writeTag.blockHashes({3: bytes(6) + trailer[6:10] + bytes(6)})
+    assert writeTag.blockHashes({2: trailer}) != writeTag.blockHashes({2: bytes(6) + trailer[6:10] + bytes(6)})
+
+def test_batch(tmp_path, monkeypatch, manifest):
+    install_pm3(tmp_path, monkeypatch)
+    report = tmp_path / "report.json"
+    writeTag.writeBatch(str(manifest), str(report))
+
+    results = json.loads(report.read_text())
+    assert [result["status"] for result in results] == ["ok"] * 3
+    #Every blank tag is written once, even though a written tag stays on the reader for a moment
+    assert [result["tag_uid"] for result in results] == BLANKS
+    assert [result["tag_type"] for result in results] == ["Gen 4 FUID"] * 3
+
+def test_batch_verify_failure(tmp_path, monkeypatch, manifest, capsys):
+    install_pm3(tmp_path, monkeypatch, corrupt=5)
+    report = tmp_path / "report.csv"
+    writeTag.writeBatch(str(manifest), str(report), "Gen 4 FUID")
+
+    assert "2 of 3 tags written, 1 failed." in capsys.readouterr().out
+    rows = report.read_text().splitlines()
+    assert rows[0].startswith("dump,keyfile,tag_uid,tag_type,status,error")
+    assert ",failed,Blocks [5] don't match the dump," in rows[1]
+    assert ",ok,," in rows[2] and ",ok,," in rows[3]
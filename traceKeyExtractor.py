@@ -7,9 +7,17 @@ import subprocess
 import os
 import re
 import sys
+import time
+import argparse
+import threading
+import itertools
 from pathlib import Path
 
-from lib import strip_color_codes, get_proxmark3_location, run_command, testCommands
+from lib import strip_color_codes, get_proxmark3_location, run_command, testCommands, metrics
+from lib.trace import read_auths, read_frames, uid_to_bytes, block_sector, AuthDecoder, TraceFollower
+from deriveKeys import kdf, keyfile_bytes
+#asyncio (and lib.aiocommand) are imported where they are used: importing asyncio takes about half
+#of the start up time, and traces of Bambu Lab tags never need it
 
 #Global variables
 #Default name of the dictionary file we create
@@ -20,13 +28,20 @@ dictionaryFile = ""                         #File object for writing keys
 pm3Location = None                            #Calculated. The location of Proxmark3
 pm3Command = "bin/pm3"                      # The command that works to start proxmark3
 mfNonceBruteCommand = "share/proxmark3/tools/mf_nonce_brute" # The command to execute mfNonceBrute
+bruteForceTimeout = 600                     #Maximum time in seconds for a single mf_nonce_brute run
+bruteForceJobs = None                       #Processes used by the built-in brute force (default: one per CPU core)
+sectorCount = 16                            #Number of sectors (and therefore keys) on the tag
+followInterval = 0.2                        #Seconds between checks for new data in a followed trace file
+sniffTimeout = 600                          #Maximum time in seconds a single sniff (--sniff) may take
 
 def setup():
     global pm3Location,dictionaryFilepath
 
     pm3Location = get_proxmark3_location()
     if not pm3Location:
-        exit(-1)
+        print("Proxmark3 not found, keys will be recovered with the built-in (slower) brute force")
+    elif not nativeBruteForce():
+        print(f"{mfNonceBruteCommand} not found, nested keys will be recovered with the built-in (slower) brute force")
 
     #Create a dictionary file to store keys that we discover
     print(f"Creating dictionary file '{dictionaryFilename}'")
@@ -36,6 +51,17 @@ def setup():
     print(f"Saved dictionary to {dictionaryFilepath}")
 
 def main():
+    parser = argparse.ArgumentParser(description="Extract the keys of Bambu Lab filament RFID tags from a Proxmark3 trace")
+    parser.add_argument("trace", nargs="?", help="Trace file saved with `trace save` (asked for if left out)")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("-f", "--follow", action="store_true", help="Extract keys while the trace file is being written, and every time it is saved again")
+    mode.add_argument("-s", "--sniff", action="store_true", help="Sniff spool after spool with the Proxmark3, extracting the keys of each spool while the next one is sniffed")
+    parser.add_argument("--idle", type=float, help="With --follow, stop once the trace didn't change for this many seconds (default: run until Ctrl+C)")
+    parser.add_argument("-n", "--count", type=int, help="With --sniff, stop after this many spools (default: run until Ctrl+C)")
+    args = parser.parse_args()
+    if args.follow and not args.trace:
+        parser.error("--follow needs a trace file")
+
     print("--------------------------------------------------------")
     print("RFID Key Extractor v0.2.1 - Bambu Research Group 2024")
     print("--------------------------------------------------------")
@@ -51,9 +77,20 @@ def main():
     # Run setup
     setup()
 
-    if len(sys.argv) > 1:
+    if args.sniff or args.follow:
+        if args.sniff and not pm3Location:
+            print("Sniffing needs the Proxmark3 client, which wasn't found")
+            sys.exit(1)
+
+        import asyncio
+        keyfiles = asyncio.run(streamKeys(None if args.sniff else os.path.abspath(args.trace), args.idle, args.count))
+        print()
+        print(f"{len(keyfiles)} keyfiles written, keys saved to file: {dictionaryFilepath}")
+        return
+
+    if args.trace:
         # If the user included an argument, assume it's the path to the tracefile
-        trace = os.path.abspath(sys.argv[1])
+        trace = os.path.abspath(args.trace)
     else:
         #Instruct the user to create a trace file
         print()
@@ -67,145 +104,578 @@ def main():
         #Get the tracename/filepath from user
         trace = input("Enter trace name or full trace filepath: ")
 
-    discoverKeys(trace)
+    keyfiles = discoverKeys(trace)
     
     print("Keys obtained. Remove the spool from the AMS and place the Proxmark3 on the spool's tag.")
-    print(f"In proxmark terminal, execute command `hf mf fchk -f {dictionaryFilepath} --dump` to create a keyfile from this dictionary.")
-    print("Then, execute `hf mf dump` to dump the contents of the RFID tag.")
-
-
-#Loop 16 times to attempt to extract all 16 keys from the tracefile
+    if keyfiles:
+        print(f"In proxmark terminal, execute command `hf mf dump -k {keyfiles[0]}` to dump the contents of the RFID tag.")
+    else:
+        print(f"In proxmark terminal, execute command `hf mf fchk -f {dictionaryFilepath} --dump` to create a keyfile from this dictionary.")
+        print("Then, execute `hf mf dump` to dump the contents of the RFID tag.")
+
+
+#Extract all the keys from the tracefile
+#The trace is decoded natively in a single pass, then keys are discovered in passes over a worklist
+#of unresolved authentications:
+#   - Pass 1 gets the keys of the plaintext authentications from a single run of the Proxmark3 client
+#   - Later passes brute force the nested (encrypted) authentications that are still unresolved
+#After every pass, the newly found keys are checked against the unresolved authentications, so an
+#authentication that uses a key we already know never needs to be brute forced.
+#Discovery stops as soon as a pass doesn't find any new key.
+#Genuine Bambu Lab tags skip all of this: their keys are derived from the UID and verified directly.
+#Returns the keyfiles written for tags whose keys could be derived
 def discoverKeys(traceFilepath):
 
-    print("PROGRAM: ", mfNonceBruteCommand)
-
-    keyList = []
-
-    # Run a max of 16 times.
-    for i in range(16):
-        loopNum = i+1
+    print("PROGRAM: ", mfNonceBruteCommand if nativeBruteForce() else "built-in brute force")
+
+    keyList = {}          #Discovered keys, in the order they were found (used as an ordered set)
+
+    print(f"Reading trace {traceFilepath}")
+    #Authentications with the same nonces are the same authentication, only keep one of each
+    auths = list({tuple(auth.brute_args()): auth for auth in read_auths(traceFilepath)}.values())
+    attempted = set()     #Authentications already sent to mf_nonce_brute
+    print(f"Found {len(auths)} authentications ({len([a for a in auths if a.nested])} nested)")
+
+    #Fast path for Bambu Lab tags
+    keyfiles = []
+    derived = deriveTagKeys(auths)
+    with open(dictionaryFilename, "a") as dictionaryFile:
+        for uid, keys in derived.items():
+            keyfiles.append(writeKeyfile(uid, keys))
+
+            for key in [*keys[0], *keys[1]]:
+                key = key.hex().upper()
+                if key not in keyList:
+                    addKey(keyList, key)
+                    dictionaryFile.write(key)
+                    dictionaryFile.write("\n")
+
+    unresolved = [auth for auth in auths if auth.uid not in derived]
+    derivedCount = len(keyList)
+
+    passNum = 0
+    while unresolved and len(keyList) - derivedCount < sectorCount:
+        passNum += 1
+        start = time.perf_counter()
+        keyCount = len(keyList)
         print("----------------------")
-        print(f"Loop {loopNum} of 16")
-
-        #Run PM3 with the trace
-        # -o means run without connecting to PM3 hardware
-        # -c specifies commands within proxmark 3 software
-        print(f"Viewing tracelog with {len(keyList)} discovered keys")
-        output = run_command([pm3Location / pm3Command,"-o","-c", f"trace load -f {traceFilepath}; trace list -1 -t mf -f {dictionaryFilepath}"])
-
-        #Loop over output, line by line to try to find a key
-        #3 things we're looking for:
-        #   - "key" a known key
-        #   - "probable key" a key that should work
-        #   - "mf_nonce_brute" a key we need to calculate
-        for line in output.splitlines():
-            if " key " in line or " key: " in line:
-
-                #There's a lot of whitespace in this line
-                #replace multiple whitespaces with a single space for readability
-                line = ' '.join(line.split())
-
-                print()
-                print("Found line containing a key:")
-                print(f"    {line}")
-                # split the line into "words", which are whitespace separated
-                words = line.split(" ")
-
-                key = ""
-
-                #find the word "key", and then grab the word directly after it
-                for j in range(len(words)-1):
-                    w = words[j]
-                    if w == "key" or w == "key:":
-                        key = words[j+1]  #Guaranteed to not be out of bounds because we loop to words length - 1
-                        break
-
-                #If we didn't find a key, skip this line
-                if key == "":
+        print(f"Pass {passNum}: {len(unresolved)} unresolved authentications")
+
+        plain = [auth for auth in unresolved if not auth.nested]
+        if passNum == 1 and plain and not pm3Location:
+            #Without the Proxmark3 client, recover the keys of the plaintext authentications ourselves
+            from lib.noncebrute import nonce_brute
+            for auth in plain:
+                if auth.uid is None or any(auth.check_key(key) for key in keyList):
                     continue
-                
-                #If key ends with a vertical bar |, remove it
-                key = key.replace('|', '')
-                key = key.upper()
-
-                #Add this key to our keylist if it's new
-                if key in keyList:
-                    print(f"    Duplicate key, ignoring: {key}")
-                    continue
-                
-                keyList.append(key)
-                print(f"    Found new key: {key}")
-                
-            if "mf_nonce_brute" in line:
-                print()
-                print("Found line requiring decoding:")
-                print(line)
-
-                args = [] #Arguments passed into the brute force algorithm
-
-                #Parse the command arguments#
-                words = line.split(" ")
-                for j in range(len(words)-1):
-                    if "mf_nonce_brute" in words[j]:
-                        #Add the rest of the line to our arguments
-                        args = words[j+1:] #can't be out of bounds because we loop to len(words)-1
-                        break
-
-                key = bruteForce(args)
-
-                #Remove color coding from string
-                key = strip_color_codes(key)
-
-                if key == "":
-                    continue
-                
-                key = key.upper()
+                key = nonce_brute(auth.cuid, auth.nt, None, auth.nr_enc, auth.ar_enc, None, auth.at_enc, None, nested=False)
+                if key is not None:
+                    addKey(keyList, f"{key:012X}")
+        elif passNum == 1 and plain:
+            #Run PM3 with the trace
+            # -o means run without connecting to PM3 hardware
+            # -c specifies commands within proxmark 3 software
+            import asyncio
+            asyncio.run(listTraceKeys(traceFilepath, keyList))
+        else:
+            jobs = [auth for auth in unresolved if auth.nested and auth not in attempted]
+            attempted.update(jobs)
+            if jobs:
+                results = bruteForceAll([auth.brute_args() for auth in jobs], keyList, needed=sectorCount - (len(keyList) - derivedCount))
+                #A brute forced key is the key of its own authentication, even if we can't verify it
+                unresolved = [auth for auth in unresolved if not results.get(tuple(auth.brute_args()))]
+
+        newKeys = list(keyList)[keyCount:]
+
+        #Only the new keys can resolve authentications that are still unresolved
+        unresolved = [auth for auth in unresolved if not any(auth.check_key(key) for key in newKeys)]
+
+        #Save the new keys to our dictionary
+        with open(dictionaryFilename, "a") as dictionaryFile:
+            for key in newKeys:
+                dictionaryFile.write(key)
+                dictionaryFile.write("\n")
+
+        print(f"Pass {passNum}: found {len(newKeys)} new keys, {len(unresolved)} authentications left ({time.perf_counter() - start:.2f}s)")
+
+        if not newKeys and passNum > 1:
+            break
+
+    #Print off all the keys we've found
+    print()
+    print("Found keys: ")
+    for j, key in enumerate(keyList):
+        print(f"    {j}: {key}")
+    print()
 
-                #Add this key to our keylist if it's new
-                if key in keyList:
-                    print(f"    Duplicate key, ignoring: {key}")
-                    continue
-                
-                keyList.append(key)
-                print(f"    Found new key: {key}")
-            
-        #Print off all the keys we've found so far
-        #Save them to our dictionary
-        dictionaryFile = open(dictionaryFilename, "w")
-        print()
-        print("Found keys: ")
-        for j in range(len(keyList)):
-            print(f"    {j}: {keyList[j]}")
-            dictionaryFile.write(keyList[j])
-            dictionaryFile.write("\n")
-        print()
-        dictionaryFile.close()
-    
     #Done! Show results
     print(f"{len(keyList)} keys saved to file: {dictionaryFilepath}")
 
+    return keyfiles
+
+#Genuine Bambu Lab tags use keys derived from their UID (see deriveKeys.py)
+#For every UID in the trace, derive its keys and check them against (at most) two of its recorded
+#authentications. If they match, we have every key of the tag without any brute forcing.
+#Returns a dict mapping each verified UID to its [keysA, keysB]
+def deriveTagKeys(auths, checks=2):
+    derived = {}
+
+    for uid in dict.fromkeys(auth.uid for auth in auths if auth.uid is not None):
+        keys = kdf(uid_to_bytes(uid))
+
+        #Plaintext authentications tell us which key they use, so they are checked first
+        tagAuths = sorted([auth for auth in auths if auth.uid == uid], key=lambda auth: auth.nested)[:checks]
+
+        if all(checkDerivedKeys(auth, keys) for auth in tagAuths):
+            print(f"Tag {uid_to_bytes(uid).hex().upper()} uses keys derived from its UID")
+            derived[uid] = keys
+
+    return derived
+
+#Check the keys derived from a tag's UID against one of its authentications
+def checkDerivedKeys(auth, keys):
+    if not auth.nested and auth.sector < len(keys[0]):
+        candidates = [keys[0 if auth.key_type == "A" else 1][auth.sector]]
+    else:
+        candidates = [*keys[0], *keys[1]]
+    return any(auth.check_key(key) for key in candidates)
+
+#Write the key file of a tag next to the dictionary, returns its path
+def writeKeyfile(uid, keys):
+    keyfile = os.path.join(os.path.dirname(dictionaryFilepath), f"hf-mf-{uid_to_bytes(uid).hex().upper()}-key.bin")
+    with open(keyfile, "wb") as fp:
+        fp.write(keyfile_bytes(keys))
+    print(f"Saved keyfile to {keyfile}")
+    return keyfile
+
+#Parse a line of `trace list` output containing a key ("key" a known key, "probable key" a key that should work)
+#Returns the key on success, "" otherwise
+def parseKeyLine(line):
+    if not (" key " in line or " key: " in line):
+        return ""
+
+    #There's a lot of whitespace in this line
+    #replace multiple whitespaces with a single space for readability
+    line = ' '.join(line.split())
+
+    print()
+    print("Found line containing a key:")
+    print(f"    {line}")
+    # split the line into "words", which are whitespace separated
+    words = line.split(" ")
+
+    #find the word "key", and then grab the word directly after it
+    for j in range(len(words)-1):
+        w = words[j]
+        if w == "key" or w == "key:":
+            #If key ends with a vertical bar |, remove it
+            return strip_color_codes(words[j+1].replace('|', '')).upper()  #Guaranteed to not be out of bounds because we loop to words length - 1
+
+    return ""
+
+#Add a key to our keylist if it's new
+def addKey(keyList, key):
+    if key in keyList:
+        print(f"    Duplicate key, ignoring: {key}")
+        return
+
+    keyList[key] = None
+    print(f"    Found new key: {key}")
+
+#True if the mf_nonce_brute program of the Proxmark3 installation is available
+def nativeBruteForce():
+    return bool(pm3Location) and (pm3Location / mfNonceBruteCommand).exists()
+
+#Run the Proxmark3 client on the trace, adding the keys it recovers to keyList
+#Keys are picked up line by line while the client is still listing the (possibly huge) trace
+async def listTraceKeys(traceFilepath, keyList):
+    from lib.aiocommand import stream_command, CommandError
+    #Run PM3 with the trace
+    # -o means run without connecting to PM3 hardware
+    # -c specifies commands within proxmark 3 software
+    lines = stream_command([pm3Location / pm3Command,"-o","-c", f"trace load -f {traceFilepath}; trace list -1 -t mf -f {dictionaryFilepath}"])
+    try:
+        async for line in lines:
+            key = parseKeyLine(line)
+            if key:
+                addKey(keyList, key)
+    except CommandError as e:
+        print(f"Warning: {e}")
+    finally:
+        await lines.aclose()
+
+#Run mf_nonce_brute for every job (list of arguments) at the same time, one worker per CPU core
+#(the built-in brute force runs one job at a time, as each job already uses every core)
+#Duplicate jobs are only run once. Keys are added to keyList as soon as each job finishes,
+#and the remaining jobs are cancelled once we have a key for every sector
+#Returns a dict mapping each job (as a tuple) to the key it found
+def bruteForceAll(jobs, keyList, timeout=None, needed=None):
+    import asyncio
+    if timeout is None:
+        timeout = bruteForceTimeout
+    if needed is None:
+        needed = sectorCount
+
+    #Remove duplicate jobs, keeping their order
+    jobs = list(dict.fromkeys(tuple(args) for args in jobs))
+    workers = min(len(jobs), os.cpu_count() or 1) if nativeBruteForce() else 1
+    print()
+    print(f"Brute forcing {len(jobs)} nested authentications with {workers} workers")
+
+    return asyncio.run(bruteForceAllAsync(jobs, keyList, timeout, needed, workers))
+
+async def bruteForceAllAsync(jobs, keyList, timeout, needed, workers):
+    import asyncio
+    slots = asyncio.Semaphore(workers)
+
+    async def run(args):
+        async with slots:
+            return args, await bruteForceAsync(list(args), timeout)
+
+    tasks = [asyncio.ensure_future(run(args)) for args in jobs]
+    results = {}
+    try:
+        for task in asyncio.as_completed(tasks):
+            args, key = await task
+            #Remove color coding from string
+            key = strip_color_codes(key)
+
+            if key == "":
+                continue
+
+            key = key.upper()
+            results[args] = key
+            addKey(keyList, key)
+
+            if len(set(results.values())) >= needed:
+                print(f"Found keys for all {sectorCount} sectors, cancelling remaining jobs")
+                break
+    finally:
+        #Stop everything that is still queued or running (also on Ctrl+C), which kills their mf_nonce_brute
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    return results
+
 #Run the mf_nonce_brute program with the provided arguments to decode a key
+#mf_nonce_brute is stopped as soon as it reports a valid key
+#Without mf_nonce_brute, the built-in brute force (lib/noncebrute.py) runs in a worker thread instead
 #Returns a key on success, "" otherwise
-def bruteForce(args):
+async def bruteForceAsync(args, timeout=None):
+    import asyncio
+    from lib.aiocommand import stream_command, CommandError
+    if not nativeBruteForce():
+        #A worker thread can't be cancelled, so when this job is cancelled the search is told to stop
+        #(which also stops its processes), instead of running on until the timeout
+        stop = threading.Event()
+        future = asyncio.get_running_loop().run_in_executor(None, bruteForce, args, timeout, stop)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            stop.set()
+            await asyncio.wait([future])
+            raise
+
     print("Running bruteforce command:")
-    output = run_command([pm3Location / mfNonceBruteCommand] + args)
+    key = ""
+    lines = stream_command([pm3Location / mfNonceBruteCommand] + args, timeout=timeout)
+    with metrics.timer("brute_force_seconds", method="native"):
+        try:
+            async for line in lines:
+                key = parseBruteForceLine(line)
+                if key:
+                    break
+        except CommandError as e:
+            print(f"    {e}")
+        finally:
+            await lines.aclose()
+    metrics.count("brute_force_total", method="native", result="found" if key else "not_found")
+    return key
+
+#Run the mf_nonce_brute program with the provided arguments to decode a key
+#Without mf_nonce_brute, the built-in brute force (lib/noncebrute.py) is used instead
+#Returns a key on success, "" otherwise
+#`stop` (a threading.Event) ends the built-in brute force early, see bruteForceAsync
+def bruteForce(args, timeout=None, stop=None):
+    method = "native" if nativeBruteForce() else "builtin"
+    with metrics.timer("brute_force_seconds", method=method):
+        key = _bruteForce(args, timeout, stop)
+    metrics.count("brute_force_total", method=method, result="found" if key else "not_found")
+    return key
+
+def _bruteForce(args, timeout=None, stop=None):
+    if not nativeBruteForce():
+        from lib.noncebrute import nonce_brute_args
+        print(f"Running built-in bruteforce: {' '.join(args)}")
+        start = time.perf_counter()
+        key = nonce_brute_args(args, jobs=bruteForceJobs, timeout=timeout, stop=stop)
+        if key:
+            print(f"    Valid Key found [ {key} ] in {time.perf_counter() - start:.1f}s")
+        return key
+
+    print("Running bruteforce command:")
+    output = run_command([pm3Location / mfNonceBruteCommand] + args, timeout=timeout)
+    if output is None:
+        return ""
 
-    #Parse out the key
     for line in output.splitlines():
-        #Search for the line that says valid key. Example: "Valid Key found [ 63654db94d97 ] - matches candidate"
-        #In rare cases, multiple possible keys will be found. The "matches candidate" tag should indicate the right one
-        if not ("Valid Key" in line and "matches candidate" in line):
-            continue
-
-        print(f"    {line}")
-
-        #Parse out the key from within the brackets
-        words = line.split(" ")
-        for i in range(len(words)-1):
-            if words[i] == "[":
-                return words[i+1]
-            
+        key = parseBruteForceLine(line)
+        if key:
+            return key
+
     return "" #Not found
 
+#Parse the key out of a line of mf_nonce_brute output
+#Returns the key on success, "" otherwise
+def parseBruteForceLine(line):
+    #Search for the line that says valid key. Example: "Valid Key found [ 63654db94d97 ] - matches candidate"
+    #In rare cases, multiple possible keys will be found. The "matches candidate" tag should indicate the right one
+    if not ("Valid Key" in line and "matches candidate" in line):
+        return ""
+
+    print(f"    {line}")
+
+    #Parse out the key from within the brackets
+    words = line.split(" ")
+    for i in range(len(words)-1):
+        if words[i] == "[":
+            return words[i+1]
+
+    return ""
+
+# Extracts the keys of every spool in a trace while the trace is still being captured
+# Frames are fed in as they arrive (see followTrace and sniffSpools), keys are recovered as soon as
+# an authentication allows it, and the key file of a spool is written the moment it is complete:
+#   - Tags with keys derived from their UID are complete once two authentications match the derived keys
+#   - Other tags are complete once key A of every sector is known. Plaintext authentications name
+#     their sector, nested ones are brute forced in the background and their sector is read from the
+#     command that follows them (the reader reads a block of the sector it just authenticated).
+#     The AMS only authenticates with key A, so key B is key A unless it was seen.
+class KeyStream:
+    def __init__(self, keyList, checks=2):
+        import asyncio
+        self.keyList = keyList      #Discovered keys, shared by all spools
+        self.checks = checks
+        self.decoder = AuthDecoder()
+        self.seen = set()           #Authentications already handled, as their brute_args
+        self.spools = {}            #UID -> state of the spool, see spool()
+        self.tasks = set()          #Running brute force jobs
+        self.slots = asyncio.Semaphore((os.cpu_count() or 1) if nativeBruteForce() else 1)
+
+    #Process the next frames of the trace
+    def feed(self, frames):
+        for frame in frames:
+            for auth in self.decoder.feed(frame):
+                self.handleAuth(auth)
+
+    #The trace starts over (a new sniff, or the file was replaced)
+    #Authentications that were handled before are still skipped
+    def restart(self):
+        self.flush()
+        self.decoder = AuthDecoder()
+
+    #Handle the last authentication, which otherwise waits for the frame after it
+    def flush(self):
+        for auth in self.decoder.flush():
+            self.handleAuth(auth)
+
+    def spool(self, uid):
+        if uid not in self.spools:
+            self.spools[uid] = {
+                "name": uid_to_bytes(uid).hex().upper(),
+                "derived": kdf(uid_to_bytes(uid)),
+                "verified": 0,          #Authentications that matched the derived keys
+                "isDerived": None,      #None until the derived keys are confirmed or ruled out
+                "waiting": [],          #Authentications waiting for that
+                "keys": [[None] * sectorCount, [None] * sectorCount],
+                "keyfile": None,
+            }
+        return self.spools[uid]
+
+    def handleAuth(self, auth):
+        args = tuple(auth.brute_args())
+        if auth.uid is None or args in self.seen:
+            return
+        self.seen.add(args)
+
+        spool = self.spool(auth.uid)
+        if spool["keyfile"]:
+            return
+
+        if spool["isDerived"] is None:
+            if checkDerivedKeys(auth, spool["derived"]):
+                spool["verified"] += 1
+                spool["waiting"].append(auth)
+                if spool["verified"] >= self.checks:
+                    self.completeDerived(auth.uid, spool)
+                return
+
+            #Not a tag with derived keys, the authentications that waited can be resolved now
+            spool["isDerived"] = False
+            for waiting in spool["waiting"]:
+                self.resolve(spool, waiting)
+            spool["waiting"] = []
+
+        if not spool["isDerived"]:
+            self.resolve(spool, auth)
+
+    def completeDerived(self, uid, spool):
+        print(f"Tag {spool['name']} uses keys derived from its UID")
+        spool["isDerived"] = True
+        spool["waiting"] = []
+        for key in [*spool["derived"][0], *spool["derived"][1]]:
+            self.saveKey(key.hex().upper())
+        self.complete(uid, spool, spool["derived"])
+
+    #Find the key of an authentication of a tag that doesn't use derived keys
+    def resolve(self, spool, auth):
+        import asyncio
+        for key in self.keyList:
+            if auth.check_key(key):
+                self.assign(spool, auth, key)
+                return
+
+        if not auth.nested:
+            from lib.noncebrute import nonce_brute
+            key = nonce_brute(auth.cuid, auth.nt, None, auth.nr_enc, auth.ar_enc, None, auth.at_enc, None, nested=False)
+            if key is not None:
+                self.assign(spool, auth, f"{key:012X}")
+            return
+
+        task = asyncio.ensure_future(self.bruteForce(spool, auth))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def bruteForce(self, spool, auth):
+        async with self.slots:
+            if spool["keyfile"]:
+                return
+            #A key found while this job was waiting for a slot may be the one
+            for key in self.keyList:
+                if auth.check_key(key):
+                    self.assign(spool, auth, key)
+                    return
+            key = strip_color_codes(await bruteForceAsync(auth.brute_args(), bruteForceTimeout)).upper()
+        if key:
+            self.assign(spool, auth, key)
+
+    #Record the key of an authentication, and complete the spool if it was its last missing key
+    def assign(self, spool, auth, key):
+        self.saveKey(key)
+        if spool["keyfile"]:
+            return
+
+        if auth.nested:
+            block = auth.next_block(bytes.fromhex(key))
+            keyType, sector = 0, None if block is None else block_sector(block)
+        else:
+            keyType, sector = 0 if auth.key_type == "A" else 1, auth.sector
+        if sector is None or sector >= sectorCount:
+            return
+        spool["keys"][keyType][sector] = bytes.fromhex(key)
+
+        keysA = spool["keys"][0]
+        if all(keysA):
+            keysB = [keyB or keyA for keyA, keyB in zip(keysA, spool["keys"][1])]
+            self.complete(auth.uid, spool, [keysA, keysB])
+
+    def complete(self, uid, spool, keys):
+        spool["keyfile"] = writeKeyfile(uid, keys)
+        print(f"Spool {spool['name']} complete. Place the Proxmark3 on its tag and execute `hf mf dump -k {spool['keyfile']}` to dump it.")
+
+    #Add a key to the key list, and to the dictionary file right away
+    def saveKey(self, key):
+        if key in self.keyList:
+            return
+        addKey(self.keyList, key)
+        with open(dictionaryFilename, "a") as dictionaryFile:
+            dictionaryFile.write(key)
+            dictionaryFile.write("\n")
+
+    #Wait for the brute force jobs that are still running
+    #Returns the keyfiles of the complete spools
+    async def finish(self):
+        import asyncio
+        self.flush()
+        while self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+        keyfiles = []
+        for uid, spool in self.spools.items():
+            if spool["isDerived"] is None and spool["verified"]:
+                #The trace ended before a second check, one is what discoverKeys settles for too
+                self.completeDerived(uid, spool)
+            if spool["keyfile"]:
+                keyfiles.append(spool["keyfile"])
+            else:
+                known = sum(1 for key in spool["keys"][0] if key)
+                print(f"Spool {spool['name']} incomplete: found key A of {known} of {sectorCount} sectors")
+        return keyfiles
+
+#Extract the keys from a trace file while it is being written, until it didn't grow for `idle`
+#seconds (forever if None). A file that is replaced (e.g. by a new `trace save`) is read from the start
+async def followTrace(traceFilepath, stream, idle=None):
+    import asyncio
+    print(f"Following trace {traceFilepath}")
+    follower = TraceFollower(traceFilepath)
+    lastData = time.perf_counter()
+    while True:
+        frames = follower.poll()
+        if follower.restarted:
+            stream.restart()
+        if frames:
+            stream.feed(frames)
+            lastData = time.perf_counter()
+        elif idle is not None and time.perf_counter() - lastData > idle:
+            break
+        await asyncio.sleep(followInterval)
+    stream.flush()
+
+#Sniff spool after spool in a single Proxmark3 session, until `count` spools were sniffed (forever if None)
+#The client only hands over the trace once the sniff is stopped, so every spool is sniffed and saved on
+#its own. Its trace is decoded right away, and its keys are brute forced while the next spool is sniffed
+async def sniffSpools(stream, count=None):
+    import asyncio
+    from lib.proxmark3 import Proxmark3Session
+
+    loop = asyncio.get_running_loop()
+    directory = os.path.dirname(dictionaryFilepath)
+    started = time.strftime("%Y%m%d-%H%M%S")
+    with Proxmark3Session([pm3Location / pm3Command]) as session:
+        for number in itertools.count(1):
+            if count is not None and number > count:
+                break
+
+            print()
+            print(f"Spool {number}: place the Proxmark3 between the RFID reader and the spool, and load the filament.")
+            print("Once the AMS has read the spool, press the button on the Proxmark3.")
+            await loop.run_in_executor(None, session.command, "hf 14a sniff -c -r", sniffTimeout)
+
+            traceFilepath = os.path.join(directory, f"sniff-{started}-{number}.trace")
+            await loop.run_in_executor(None, session.command, f"trace save -f {traceFilepath}")
+            if not os.path.exists(traceFilepath):
+                print(f"The Proxmark3 client didn't save the trace to {traceFilepath}")
+                continue
+
+            stream.restart()
+            stream.feed(read_frames(traceFilepath))
+            stream.flush()
+
+#Run the streaming mode (followTrace with a trace file, sniffSpools without) until it ends or Ctrl+C
+#Returns the keyfiles of the complete spools
+async def streamKeys(traceFilepath=None, idle=None, count=None):
+    import asyncio
+    stream = KeyStream({})
+    try:
+        if traceFilepath:
+            await followTrace(traceFilepath, stream, idle)
+        else:
+            await sniffSpools(stream, count)
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        print()
+        print("Stopped, waiting for the brute force jobs that are still running (Ctrl+C again to abort)")
+    return await stream.finish()
+
 if __name__ == "__main__":
     main() #Run main program
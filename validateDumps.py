@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+# Python script to check a corpus of tag dumps for corrupt or inconsistent files
+# Created for https://github.com/Bambu-Research-Group/RFID-Tag-Guide
+# Requires: pycryptodome
+#
+# Checks the length, block 0 BCC, sector keys (against deriveKeys.kdf) and access bits of every
+# dump in the given files, directories and .tar/.zip archives, and writes a JSON Lines or CSV report.
+
+import sys
+import csv
+import json
+import time
+import argparse
+from collections import Counter
+
+from lib.validate import validate_corpus
+
+REPORT_FORMATS = ["jsonl", "csv"]
+
+#Stream results to the report, returns a tuple of (checked count, invalid count, issue counts)
+def write_report(results, fmt, fp, errors_only=False):
+    checked = 0
+    invalid = 0
+    checks = Counter()
+
+    writer = None
+    if fmt == "csv":
+        writer = csv.writer(fp)
+        writer.writerow(["path", "uid", "size", "valid", "issues"])
+
+    for result in results:
+        checked += 1
+        valid = not result["issues"]
+        if not valid:
+            invalid += 1
+            checks.update(set(issue["check"] for issue in result["issues"]))
+        elif errors_only:
+            continue
+
+        if writer:
+            issues = "; ".join(issue["message"] + (f" (sector {issue['sector']})" if "sector" in issue else "") for issue in result["issues"])
+            writer.writerow([result["path"], result["uid"] or "", result["size"] if result["size"] is not None else "", int(valid), issues])
+        else:
+            fp.write(json.dumps({**result, "valid": valid}) + "\n")
+
+    return checked, invalid, checks
+
+def main():
+    parser = argparse.ArgumentParser(description="Check tag dumps for truncation, bad BCC, wrong sector keys and access bits")
+    parser.add_argument("sources", nargs="+", help="Dump files, directories of dumps, or .tar/.zip archives of dumps")
+    parser.add_argument("-o", "--output", help="Report file (default: stdout)")
+    parser.add_argument("-f", "--format", choices=REPORT_FORMATS, default="jsonl", help="Report format (default: jsonl)")
+    parser.add_argument("-e", "--errors-only", action="store_true", help="Only report dumps with issues")
+    parser.add_argument("-s", "--strict", action="store_true", help="Also require key B, which most readers leave as zeros")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of worker processes (default: one per CPU core)")
+    args = parser.parse_args()
+
+    fp = sys.stdout if args.output in (None, "-") else open(args.output, "w", newline="")
+    start = time.perf_counter()
+    try:
+        checked, invalid, checks = write_report(validate_corpus(args.sources, args.jobs, args.strict), args.format, fp, args.errors_only)
+    finally:
+        if fp is not sys.stdout:
+            fp.close()
+    elapsed = time.perf_counter() - start
+
+    rate = checked / elapsed if elapsed > 0 else 0
+    print(f"Checked {checked} dumps in {elapsed:.2f}s ({rate:.0f} dumps/s): {checked - invalid} valid, {invalid} with issues", file=sys.stderr)
+    for check, count in checks.most_common():
+        print(f"  {check}: {count}", file=sys.stderr)
+
+    if invalid:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -8,13 +8,28 @@ import subprocess
 import os
 import re
 import sys
+import csv
+import json
+import time
+import hashlib
+import argparse
 from pathlib import Path
 
-from lib import strip_color_codes, get_proxmark3_location, run_command, testCommands
+from lib import strip_color_codes, get_proxmark3_location, run_command, testCommands, metrics
+from lib.proxmark3 import Proxmark3Session
+from lib.bambu import json_to_bin, BLOCK_SIZE, BLOCKS_PER_SECTOR
 
 #Global variables
 pm3Location = None                            #Calculated. The location of Proxmark3
 pm3Command = "bin/pm3"                      # The command that works to start proxmark3
+tagWaitTime = 120                           # Seconds to wait for the next tag in batch mode
+tagPollInterval = 0.5                       # Seconds between checks for a tag in batch mode
+
+TAG_TYPES = {"fuid": "Gen 4 FUID", "ufuid": "Gen 4 UFUID"}
+UID_RE = re.compile(r"UID:\s*((?:[0-9A-Fa-f]{2} ?)+)")
+GDM_CONFIG_RE = re.compile(r"\[\+\] Config\.*\s*((?:[0-9A-Fa-f]{2} ?){8,})")
+#Block rows of `hf mf dump`/`hf mf cgetblk` output, with or without the sector column
+BLOCK_ROW_RE = re.compile(r"^\[=\]\s*(?:\d*\s*\|\s*)?(\d+)\s*\|\s*((?:[0-9A-Fa-f]{2} ){15}[0-9A-Fa-f]{2})", re.MULTILINE)
 
 def setup():
     global pm3Location
@@ -31,19 +46,31 @@ def main():
     print("Proxmark3 device, allowing RFID tags for non-Bambu spools.")
     print("--------------------------------------------------------")
 
+    parser = argparse.ArgumentParser(description="Write a tag dump to a Gen 4 FUID or UFUID tag, then lock it")
+    parser.add_argument("dump", nargs="?", help="Tag dump to write")
+    parser.add_argument("keyfile", nargs="?", help="Key file of the tag dump")
+    parser.add_argument("-b", "--batch", metavar="MANIFEST", help="Write many tags: CSV file with a dump and a key file per line")
+    parser.add_argument("-r", "--report", metavar="FILE", help="Batch mode: write the result of every tag to a .csv or .json report")
+    parser.add_argument("-t", "--tag-type", choices=TAG_TYPES, help="Batch mode: skip detecting the type of every tag")
+    args = parser.parse_args()
+
     # Run setup
     setup()
 
-    if len(sys.argv) > 1:
+    if args.batch:
+        writeBatch(args.batch, args.report, TAG_TYPES.get(args.tag_type))
+        return
+
+    if args.dump:
         # If the user included an argument, assume it's the path to the tracefile
-        tagdump = os.path.abspath(sys.argv[1])
+        tagdump = os.path.abspath(args.dump)
     else:
         #Get the tracename/filepath from user
         tagdump = input("Enter the path to the tag dump you wish to write: ").replace("\\ ", " ")
 
-    if len(sys.argv) > 2:
+    if args.keyfile:
         # If the user included a second argument, assume it's the path to the key file
-        keydump = os.path.abspath(sys.argv[2])
+        keydump = os.path.abspath(args.keyfile)
     else:
         #Get the keyname/filepath from user
         keydump = input("Enter the path to the tag's key dump you wish to write: ").replace("\\ ", " ")
@@ -54,33 +81,53 @@ def main():
 
     input()
 
-    tagtype = getTagType()
+    #Keep one Proxmark3 client running for every command we send to the tag
+    with Proxmark3Session([pm3Location / pm3Command, "-d", "1"]) as session:
+        writeWithConfirmation(tagdump, keydump, session)
 
     print()
-    print("=========== WARNING! == WARNING! == WARNING! ===========")
-    print("This script will write the contents of a dump to your")
-    print("RFID tag, and then PERMANENTLY WRITE LOCK the tag.")
-    print("")
-    print("This process is IRREVERSIBLE, proceed at your own risk.")
-    print("========================================================")
+    print("Writing complete! Your tag should now register on the AMS.")
     print()
 
-    confirm = input("Are you SURE you wish to continue (y/N)? ")
-    if confirm.lower() not in ["y", "yes"]:
+def writeWithConfirmation(tagdump, keydump, session=None):
+    tagtype = getTagType(session)
+
+    if not confirmWrite():
         print("Confirmation not obtained, exiting")
         exit(0)
 
     print("Writing tag data now...")
-    writeTag(tagdump, keydump, tagtype)
+    writeTag(tagdump, keydump, tagtype, session)
 
+def confirmWrite(count=1):
     print()
-    print("Writing complete! Your tag should now register on the AMS.")
+    print("=========== WARNING! == WARNING! == WARNING! ===========")
+    print("This script will write the contents of a dump to your")
+    print("RFID tag, and then PERMANENTLY WRITE LOCK the tag.")
+    print("")
+    print("This process is IRREVERSIBLE, proceed at your own risk.")
+    if count > 1:
+        print(f"You will not be asked again for the {count} tags of this batch.")
+    print("========================================================")
     print()
 
+    confirm = input("Are you SURE you wish to continue (y/N)? ")
+    return confirm.lower() in ["y", "yes"]
+
+#Run Proxmark3 client commands, through `session` if one is open, or in a new client otherwise
+def runPm3(commands, session=None, pipe=True, options=()):
+    if session:
+        #The client only splits commands at ";" when they come from -c, so send them one by one
+        output = "\n".join(session.commands([c.strip() for c in commands.split(";")]))
+        if not pipe:
+            print(output)
+        return output
+    return run_command([pm3Location / pm3Command, *options, "-c", commands], pipe=pipe)
 
-def getTagType():
+@metrics.timed("write_tag_phase_seconds", phase="detect")
+def getTagType(session=None):
     print(f"Checking tag type...")
-    output = run_command([pm3Location / pm3Command, "-d", "1", "-c", f"hf mf info"])
+    output = runPm3("hf mf info", session, options=("-d", "1"))
 
     if 'iso14443a card select failed' in output:
         raise RuntimeError("Tag not found or is wrong type")
@@ -103,16 +150,180 @@ def getTagType():
     
     raise RuntimeError("Tag is not a compatible type (must be Gen 4 FUID or UFUID)")
 
-def writeTag(tagdump, keydump, tagtype):
+@metrics.timed("write_tag_phase_seconds", phase="write")
+def writeTag(tagdump, keydump, tagtype, session=None):
+    tagdump = tagdump.replace(" ", "\\ ")
+    keydump = keydump.replace(" ", "\\ ")
+
     if tagtype == "Gen 4 FUID":
         # Load tag dump onto RFID tag
-        output = run_command([pm3Location / pm3Command, "-c", f"hf mf restore --force -f {tagdump.replace(" ", "\\ ")} -k {keydump.replace(" ", "\\ ")}"], pipe=False)
+        output = runPm3(f"hf mf restore --force -f {tagdump} -k {keydump}", session, pipe=False)
         return
 
     if tagtype == "Gen 4 UFUID":
         # Load tag dump onto RFID tag, then immediately seal
-        output = run_command([pm3Location / pm3Command, "-c", f"hf mf cload -f {tagdump.replace(" ", "\\ ")}; hf 14a raw -a -k -b 7 40; hf 14a raw -k 43; hf 14a raw -k -c e100; hf 14a raw -c 85000000000000000000000000000008"], pipe=False)
+        output = runPm3(f"hf mf cload -f {tagdump}; hf 14a raw -a -k -b 7 40; hf 14a raw -k 43; hf 14a raw -k -c e100; hf 14a raw -c 85000000000000000000000000000008", session, pipe=False)
+
+
+#Cheaper alternative to getTagType for batch mode: instead of `hf mf info`, which runs every magic
+#tag detection there is, only try the two wakeups of the tags we can write
+@metrics.timed("write_tag_phase_seconds", phase="probe")
+def probeTagType(session=None):
+    output = runPm3("hf mf gdmcfg", session)
+    if GDM_CONFIG_RE.search(output):
+        return "Gen 4 FUID"
+
+    output = runPm3("hf mf cgetblk --blk 0", session)
+    if BLOCK_ROW_RE.search(output):
+        return "Gen 4 UFUID"
+
+    #Unknown output (e.g. from another client version), let hf mf info decide
+    return getTagType(session)
+
+#UID of the tag on the Proxmark3, or None if there is no tag
+def readUid(session=None):
+    match = UID_RE.search(runPm3("hf 14a reader", session))
+    if not match:
+        return None
+    return match.group(1).replace(" ", "").upper()
+
+#Wait until a tag that isn't in `done` is placed on the Proxmark3, returns its UID (None on timeout)
+@metrics.timed("write_tag_phase_seconds", phase="wait")
+def waitForTag(done, session=None, timeout=tagWaitTime):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        uid = readUid(session)
+        if uid and uid not in done:
+            return uid
+        time.sleep(tagPollInterval)
+    return None
+
+#Read a dump file (.bin or Proxmark3 .json) as raw bytes
+def loadDump(path):
+    with open(path, "rb") as fp:
+        data = fp.read()
+    if path.lower().endswith(".json") or data[:1] == b"{":
+        return bytes(json_to_bin(data))
+    return data
+
+#SHA-256 of every block of a dump. Only the access bits of the sector trailers are compared,
+#as the keys can't be read back
+def blockHashes(blocks):
+    hashes = {}
+    for block, data in blocks.items():
+        if block % BLOCKS_PER_SECTOR == BLOCKS_PER_SECTOR - 1:
+            data = data[6:10]
+        hashes[block] = hashlib.sha256(data).hexdigest()
+    return hashes
+
+#Read the tag back and return the blocks whose contents don't match the dump
+@metrics.timed("write_tag_phase_seconds", phase="verify")
+def verifyTag(tagdump, keydump, session=None):
+    data = loadDump(tagdump)
+    expected = blockHashes({block: data[block * BLOCK_SIZE:(block + 1) * BLOCK_SIZE] for block in range(len(data) // BLOCK_SIZE)})
+
+    keydump = keydump.replace(" ", "\\ ")
+    output = runPm3(f"hf mf dump --ns -k {keydump}", session)
+    actual = blockHashes({int(block): bytes.fromhex(row) for block, row in BLOCK_ROW_RE.findall(output)})
+
+    return [block for block, digest in expected.items() if actual.get(block) != digest]
+
+#Read a batch manifest: one "dump,keyfile" pair per line, relative paths are relative to the manifest
+def readManifest(manifest):
+    base = os.path.dirname(os.path.abspath(manifest))
+    entries = []
+    with open(manifest, newline="") as fp:
+        for row in csv.reader(fp):
+            row = [cell.strip() for cell in row]
+            if not row or not row[0] or row[0].startswith("#") or row[0].lower() == "dump":
+                continue
+            if len(row) < 2 or not row[1]:
+                raise ValueError(f"{manifest}: no key file for {row[0]}")
+            entries.append(tuple(os.path.join(base, path) for path in row[:2]))
+    return entries
+
+def writeReport(report, results):
+    if report.lower().endswith(".json"):
+        with open(report, "w") as fp:
+            json.dump(results, fp, indent=2)
+        return
+
+    with open(report, "w", newline="") as fp:
+        writer = csv.DictWriter(fp, fieldnames=list(results[0].keys()) if results else ["dump"])
+        writer.writeheader()
+        writer.writerows(results)
+
+#Write, seal and verify one tag of a batch, returning its report entry
+def writeBatchTag(tagdump, keydump, uid, tagtype=None, session=None):
+    result = {"dump": tagdump, "keyfile": keydump, "tag_uid": uid, "tag_type": tagtype, "status": "failed", "error": "",
+              "probe_ms": 0, "write_ms": 0, "verify_ms": 0}
+
+    start = time.perf_counter()
+    try:
+        if not tagtype:
+            tagtype = result["tag_type"] = probeTagType(session)
+        probed = time.perf_counter()
+        result["probe_ms"] = round((probed - start) * 1000)
+
+        writeTag(tagdump, keydump, tagtype, session)
+        written = time.perf_counter()
+        result["write_ms"] = round((written - probed) * 1000)
+
+        mismatched = verifyTag(tagdump, keydump, session)
+        result["verify_ms"] = round((time.perf_counter() - written) * 1000)
+        if mismatched:
+            raise RuntimeError(f"Blocks {mismatched} don't match the dump")
+        result["status"] = "ok"
+    except (RuntimeError, OSError, ValueError) as e:
+        result["error"] = str(e)
+    return result
+
+def writeBatch(manifest, report=None, tagtype=None):
+    entries = readManifest(manifest)
+    for paths in entries:
+        for path in paths:
+            if not os.path.exists(path):
+                print(f"Missing file: {path}")
+                exit(-1)
+
+    print(f"{len(entries)} tags to write.")
+    if not confirmWrite(len(entries)):
+        print("Confirmation not obtained, exiting")
+        exit(0)
+
+    results = []
+    done = set()         #UIDs of the tags we already handled, before and after writing
+    try:
+        with Proxmark3Session([pm3Location / pm3Command, "-d", "1"]) as session:
+            for index, (tagdump, keydump) in enumerate(entries, 1):
+                print()
+                print(f"[{index}/{len(entries)}] Place a blank tag on the Proxmark3 to write {os.path.basename(tagdump)}")
+                uid = waitForTag(done, session)
+                if uid is None:
+                    print("No tag found, stopping.")
+                    break
+                done.add(uid)
+
+                result = writeBatchTag(tagdump, keydump, uid, tagtype, session)
+                written_uid = readUid(session)
+                if written_uid:
+                    done.add(written_uid)
+
+                total = result["probe_ms"] + result["write_ms"] + result["verify_ms"]
+                if result["status"] == "ok":
+                    print(f"[{index}/{len(entries)}] Tag {uid} written and verified in {total} ms; remove it.")
+                else:
+                    print(f"[{index}/{len(entries)}] Tag {uid} FAILED: {result['error']}")
+                results.append(result)
+    except KeyboardInterrupt:
+        print("\nStopping.")
+    finally:
+        if report:
+            writeReport(report, results)
+            print(f"Report written to {report}")
 
+    ok = sum(1 for result in results if result["status"] == "ok")
+    print(f"{ok} of {len(entries)} tags written, {len(results) - ok} failed.")
 
 if __name__ == "__main__":
     main() #Run main program